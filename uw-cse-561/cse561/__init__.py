@@ -0,0 +1,4 @@
+# Shared support code for the POX controllers in project1/ and project2/.
+#
+# POX puts its ext/ directory on the path, so link this package there:
+#   ln -s ~/uw-cse-561/cse561 ~/pox/ext/cse561
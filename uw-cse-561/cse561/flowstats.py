@@ -0,0 +1,348 @@
+# Periodic flow and port statistics for every connected switch.
+#
+# Each switch is sent an ofp_flow_stats_request and an
+# ofp_port_stats_request once per `interval`. The switches are spread
+# over `slots` evenly spaced ticks of that interval, so the requests (and
+# the replies, which grow with the flow tables) don't all arrive at once.
+# A switch whose last request is still unanswered is skipped, so a slow
+# switch never has more than one request of each kind in flight.
+#
+# Replies become rates (bytes/s, packets/s) between consecutive polls,
+# kept as time series in fixed-size arrays: `history` samples per port
+# and per flow, and at most `max_flows` flows per switch (the busiest
+# ones). Other components query it through core.flow_stats:
+#
+#   core.flow_stats.port_rate(dpid, port)      # (rx_bps, tx_bps), bytes/s
+#   core.flow_stats.busiest(ports)             # of a set of (dpid, port)
+#   core.flow_stats.top_flows(dpid, n)         # [(bytes/s, FlowSeries), ...]
+#
+# Run it as a POX component next to a controller:
+#
+#   ./pox.py project1.a1ext2controller cse561.flowstats --interval=5
+
+from array import array
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+POLL_INTERVAL = 5.0  # seconds between two polls of the same switch
+POLL_SLOTS = 10  # ticks per interval the switches are spread over
+HISTORY = 60  # samples kept per series
+MAX_FLOWS = 1024  # flows tracked per switch
+
+
+class Series(object):
+    """
+    The last `size` (time, value) samples, in two fixed-size arrays used
+    as a ring.
+    """
+
+    __slots__ = ("times", "values", "count")
+
+    def __init__(self, size=HISTORY):
+        self.times = array("d", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, len(self.values))
+
+    def append(self, t, value):
+        i = self.count % len(self.values)
+        self.times[i] = t
+        self.values[i] = value
+        self.count += 1
+
+    @property
+    def latest(self):
+        if not self.count:
+            return 0.0
+        return self.values[(self.count - 1) % len(self.values)]
+
+    def samples(self):
+        """
+        [(time, value), ...], oldest first.
+        """
+        size = len(self.values)
+        start = self.count - len(self)
+        return [(self.times[i % size], self.values[i % size]) for i in range(start, self.count)]
+
+    def mean(self):
+        n = len(self)
+        if not n:
+            return 0.0
+        if n == len(self.values):
+            return sum(self.values) / n
+        return sum(self.values[:n]) / n
+
+
+class PortSeries(object):
+    """
+    Receive and transmit rates of one switch port, in bytes/s.
+    """
+
+    __slots__ = ("dpid", "port", "rx", "tx", "_last")
+
+    def __init__(self, dpid, port, history=HISTORY):
+        self.dpid = dpid
+        self.port = port
+        self.rx = Series(history)
+        self.tx = Series(history)
+        self._last = None  # (time, rx_bytes, tx_bytes)
+
+    def update(self, now, rx_bytes, tx_bytes):
+        last = self._last
+        self._last = (now, rx_bytes, tx_bytes)
+        if last is None or now <= last[0] or rx_bytes < last[1] or tx_bytes < last[2]:
+            return  # first sample, or the counters were reset
+        dt = now - last[0]
+        self.rx.append(now, (rx_bytes - last[1]) / dt)
+        self.tx.append(now, (tx_bytes - last[2]) / dt)
+
+
+class FlowSeries(object):
+    """
+    Byte and packet rates of one flow entry, keyed by (match, priority,
+    cookie). `match` is the ofp_match from the latest reply.
+    """
+
+    __slots__ = ("match", "priority", "cookie", "bytes", "packets", "_last")
+
+    def __init__(self, entry, history=HISTORY):
+        self.match = entry.match
+        self.priority = entry.priority
+        self.cookie = entry.cookie
+        self.bytes = Series(history)
+        self.packets = Series(history)
+        self._last = None  # (duration, byte_count, packet_count)
+
+    def update(self, now, entry):
+        self.match = entry.match
+        duration = entry.duration_sec + entry.duration_nsec / 1e9
+        last = self._last
+        self._last = (duration, entry.byte_count, entry.packet_count)
+        if last is None or duration <= last[0] or entry.byte_count < last[1]:
+            return  # first sample, or the flow was replaced
+        # The switch's own clock for the flow, not when the reply arrived
+        dt = duration - last[0]
+        self.bytes.append(now, (entry.byte_count - last[1]) / dt)
+        self.packets.append(now, (entry.packet_count - last[2]) / dt)
+
+
+def _flow_key(entry):
+    return (entry.match.pack(), entry.priority, entry.cookie)
+
+
+def _byte_rate(entry, series):
+    """
+    Bytes/s of entry since the previous sample in series; without one
+    (a new, replaced or untracked flow), its average since it was installed.
+    """
+    duration = entry.duration_sec + entry.duration_nsec / 1e9
+    last = series._last if series is not None else None
+    if last is not None and duration > last[0] and entry.byte_count >= last[1]:
+        return (entry.byte_count - last[1]) / (duration - last[0])
+    return entry.byte_count / max(duration, 1.0)
+
+
+class StatsCollector(object):
+    """
+    Polls every connected switch for flow and port statistics and keeps
+    their rates; registered as core.flow_stats.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL, slots=POLL_SLOTS, history=HISTORY,
+                 max_flows=MAX_FLOWS, flows=True, clock=time.time):
+        self.interval = interval
+        self.slots = max(1, slots)
+        self.history = history
+        self.max_flows = max_flows
+        self.poll_flows = flows
+        self.clock = clock
+
+        self.connections = {}  # dpid -> connection
+        self._slot_of = {}  # dpid -> slot
+        self._tick = 0
+        self._outstanding = {}  # (dpid, kind) -> (xid, sent at)
+
+        self.ports = {}  # (dpid, port) -> PortSeries
+        self.flows = {}  # dpid -> {flow key: FlowSeries}
+
+        self.requests = 0
+        self.replies = 0
+        self.skipped = 0
+        self.flows_dropped = 0
+
+        core.openflow.addListeners(self)
+        self._timer = Timer(self.interval / self.slots, self._poll, recurring=True)
+
+    def _handle_ConnectionUp(self, event):
+        self.connections[event.dpid] = event.connection
+        # The least used slot, so switches stay spread out as they come and go
+        used = [0] * self.slots
+        for slot in self._slot_of.values():
+            used[slot] += 1
+        self._slot_of[event.dpid] = used.index(min(used))
+
+    def _handle_ConnectionDown(self, event):
+        if self.connections.get(event.dpid) is not event.connection:
+            return
+        del self.connections[event.dpid]
+        self._slot_of.pop(event.dpid, None)
+        self.flows.pop(event.dpid, None)
+        for key in [k for k in self.ports if k[0] == event.dpid]:
+            del self.ports[key]
+        for key in [k for k in self._outstanding if k[0] == event.dpid]:
+            del self._outstanding[key]
+
+    def _poll(self):
+        slot = self._tick % self.slots
+        self._tick += 1
+        for dpid, s in list(self._slot_of.items()):
+            if s == slot:
+                self._request(dpid, "port", of.ofp_port_stats_request())
+                if self.poll_flows:
+                    self._request(dpid, "flow", of.ofp_flow_stats_request())
+
+    def _request(self, dpid, kind, body):
+        now = self.clock()
+        pending = self._outstanding.get((dpid, kind))
+        if pending is not None and now - pending[1] < 2 * self.interval:
+            self.skipped += 1
+            return
+        req = of.ofp_stats_request(body=body)
+        self._outstanding[(dpid, kind)] = (req.xid, now)
+        self.connections[dpid].send(req)
+        self.requests += 1
+
+    def _answered(self, event, kind):
+        """
+        True if this reply is the one we are waiting for (not, e.g., a
+        FlowReconciler's).
+        """
+        key = (event.connection.dpid, kind)
+        pending = self._outstanding.get(key)
+        if pending is None or event.ofp[0].xid != pending[0]:
+            return False
+        del self._outstanding[key]
+        self.replies += 1
+        return True
+
+    def _handle_PortStatsReceived(self, event):
+        if not self._answered(event, "port"):
+            return
+        now = self.clock()
+        dpid = event.connection.dpid
+        for entry in event.stats:
+            if entry.port_no >= of.OFPP_MAX:
+                continue
+            series = self.ports.get((dpid, entry.port_no))
+            if series is None:
+                series = self.ports[(dpid, entry.port_no)] = PortSeries(
+                    dpid, entry.port_no, self.history)
+            series.update(now, entry.rx_bytes, entry.tx_bytes)
+
+    def _handle_FlowStatsReceived(self, event):
+        if not self._answered(event, "flow"):
+            return
+        now = self.clock()
+        dpid = event.connection.dpid
+        old = self.flows.get(dpid, {})
+        entries = event.stats
+        if self.max_flows and len(entries) > self.max_flows:
+            # Keep the flows busiest right now, not the ones that carried
+            # the most over their lifetime
+            self.flows_dropped += len(entries) - self.max_flows
+            entries = sorted(entries, key=lambda e: _byte_rate(e, old.get(_flow_key(e))),
+                             reverse=True)[:self.max_flows]
+        # Flows missing from the reply are gone from the switch
+        flows = {}
+        for entry in entries:
+            key = _flow_key(entry)
+            series = old.get(key)
+            if series is None:
+                series = FlowSeries(entry, self.history)
+            series.update(now, entry)
+            flows[key] = series
+        self.flows[dpid] = flows
+
+    # Queries
+
+    def port_rate(self, dpid, port):
+        """
+        Latest (rx, tx) rate of a port in bytes/s, or None if not polled yet.
+        """
+        series = self.ports.get((dpid, port))
+        if series is None or not series.rx.count:
+            return None
+        return series.rx.latest, series.tx.latest
+
+    def busiest(self, ports=None):
+        """
+        (bytes/s, (dpid, port)) of the port with the highest latest tx rate
+        among `ports` (an iterable of (dpid, port), default all), or None.
+        For a link, pass the port on each end; the tx side is the direction
+        that leaves through it.
+        """
+        keys = self.ports if ports is None else ports
+        best = None
+        for key in keys:
+            series = self.ports.get(key)
+            if series is None or not series.tx.count:
+                continue
+            if best is None or series.tx.latest > best[0]:
+                best = (series.tx.latest, key)
+        return best
+
+    def top_flows(self, dpid, n=10, cookie=None):
+        """
+        The n flows of a switch (all of them if n is None, only those with
+        this cookie if given) with the highest latest byte rate, as
+        [(bytes/s, FlowSeries), ...].
+        """
+        flows = self.flows.get(dpid, {})
+        rated = [(f.bytes.latest, f) for f in flows.values()
+                 if f.bytes.count and (cookie is None or f.cookie == cookie)]
+        rated.sort(key=lambda r: r[0], reverse=True)
+        return rated if n is None else rated[:n]
+
+    def stats(self):
+        return {
+            "switches": len(self.connections),
+            "ports": len(self.ports),
+            "flows": sum(len(f) for f in list(self.flows.values())),
+            "requests": self.requests,
+            "replies": self.replies,
+            "skipped": self.skipped,
+            "flows_dropped": self.flows_dropped,
+        }
+
+
+def launch(interval=POLL_INTERVAL, slots=POLL_SLOTS, history=HISTORY, max_flows=MAX_FLOWS,
+           flows=True):
+    """
+    Poll switch flow and port statistics.
+
+    --interval=S    seconds between two polls of the same switch
+    --slots=N       spread the switches over N ticks of that interval
+    --history=N     samples kept per port and per flow series
+    --max_flows=N   flows tracked per switch, busiest first (0 = all)
+    --flows=False   poll port statistics only
+    """
+    flows = str(flows).lower() != "false"
+
+    def start():
+        collector = StatsCollector(float(interval), int(slots), int(history),
+                                   int(max_flows), flows)
+        core.register("flow_stats", collector)
+        if core.hasComponent("metrics"):
+            from cse561 import metrics
+            metrics.stats_collector(
+                "cse561_flow_stats", "Statistics poller state", (), lambda: {(): collector.stats()})
+        log.info("Polling switch statistics every %ss over %s slots", interval, slots)
+
+    core.call_when_ready(start, ["openflow"])
@@ -0,0 +1,189 @@
+# Flow-table reconciliation for (re)connecting switches.
+#
+# Instead of blindly reinstalling every rule on ConnectionUp, read the
+# switch's flow table, diff it against the rules the controller wants
+# (matched by cookie) and send only what is missing or stale, followed by
+# a barrier.
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+
+log = core.getLogger()
+
+# Give up waiting for the flow stats reply after this long and reinstall
+STATS_TIMEOUT = 5.0
+
+# Cookies are owned by namespace: the high 32 bits name the controller
+COOKIE_NAMESPACE_MASK = 0xffffffff00000000
+
+
+# Match fields that each have one wildcard bit (nw_src/nw_dst have prefix lengths)
+_MATCH_FIELDS = (
+    ("in_port", of.OFPFW_IN_PORT), ("dl_src", of.OFPFW_DL_SRC),
+    ("dl_dst", of.OFPFW_DL_DST), ("dl_vlan", of.OFPFW_DL_VLAN),
+    ("dl_vlan_pcp", of.OFPFW_DL_VLAN_PCP), ("dl_type", of.OFPFW_DL_TYPE),
+    ("nw_tos", of.OFPFW_NW_TOS), ("nw_proto", of.OFPFW_NW_PROTO),
+    ("tp_src", of.OFPFW_TP_SRC), ("tp_dst", of.OFPFW_TP_DST),
+)
+
+
+def _pack_all(items):
+    return b"".join(i.pack() for i in items)
+
+
+def _prefix(addr, wildcard_bits):
+    """
+    (prefix length, masked address as an int) of an nw_src/nw_dst field.
+    """
+    length = 32 - min(wildcard_bits, 32)
+    if length == 0 or addr is None:
+        return (0, 0)
+    mask = (0xffffffff << (32 - length)) & 0xffffffff
+    return (length, addr.toUnsigned() & mask)
+
+
+def _normalized(match):
+    """
+    What a match actually matches: its wildcards and the fields they leave
+    in. Switches report wildcarded fields as zero (or anything) and may set
+    unused wildcard bits, so two equal matches need not pack the same.
+    """
+    wc = match.wildcards
+    fields = tuple(None if wc & bit else getattr(match, name)
+                   for name, bit in _MATCH_FIELDS)
+    src = _prefix(match.nw_src, (wc & of.OFPFW_NW_SRC_MASK) >> of.OFPFW_NW_SRC_SHIFT)
+    dst = _prefix(match.nw_dst, (wc & of.OFPFW_NW_DST_MASK) >> of.OFPFW_NW_DST_SHIFT)
+    return fields + (src, dst)
+
+
+class FlowReconciler(object):
+    """
+    Brings one switch's flows in a cookie namespace in line with `desired`,
+    a list of ofp_flow_mod (ADD) messages with unique cookies, or a function
+    returning that list when the stats reply arrives (for controllers whose
+    rules may change while the request is in flight).
+    - cookie wanted, same match/priority/actions/timeouts on the switch: nothing
+    - cookie wanted but missing or different: (delete the old one,) add it
+    - cookie in our namespace but no longer wanted: delete it
+    Flows with cookies outside the namespace are left alone.
+    `done(reconciler)` is called after the closing barrier is answered.
+    """
+
+    def __init__(self, connection, namespace, desired, done=None, timeout=STATS_TIMEOUT):
+        self.connection = connection
+        self.namespace = namespace & COOKIE_NAMESPACE_MASK
+        self._desired = desired
+        self.desired = {}
+        self.done = done
+        self.timeout = timeout
+
+        self.added = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.finished = False
+
+        self._stats_xid = None
+        self._barrier_xid = None
+        self._listeners = None
+        self._timer = None
+
+    def _owned(self, cookie):
+        return cookie & COOKIE_NAMESPACE_MASK == self.namespace
+
+    def start(self):
+        self._listeners = self.connection.addListeners(self)
+        req = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+        self._stats_xid = req.xid
+        self.connection.send(req)
+        self._timer = Timer(self.timeout, self._handle_timeout)
+        return self
+
+    def _load_desired(self):
+        flows = self._desired() if callable(self._desired) else self._desired
+        self.desired = dict((fm.cookie, fm) for fm in flows)
+        if len(self.desired) != len(flows):
+            raise ValueError("desired flows need unique cookies")
+
+    def _same(self, entry, fm):
+        return (entry.priority == fm.priority
+                and _normalized(entry.match) == _normalized(fm.match)
+                and _pack_all(entry.actions) == _pack_all(fm.actions)
+                and entry.idle_timeout == fm.idle_timeout
+                and entry.hard_timeout == fm.hard_timeout)
+
+    def _delete(self, entry):
+        fm = of.ofp_flow_mod()
+        fm.command = of.OFPFC_DELETE_STRICT
+        fm.match = entry.match
+        fm.priority = entry.priority
+        self.connection.send(fm)
+        self.deleted += 1
+
+    def _handle_FlowStatsReceived(self, event):
+        if self._stats_xid is None or event.ofp[0].xid != self._stats_xid:
+            return  # someone else's request
+        self._stats_xid = None
+        if self._timer is not None:
+            self._timer.cancel()
+
+        self._load_desired()
+        seen = set()
+        for entry in event.stats:
+            if not self._owned(entry.cookie):
+                continue
+            fm = self.desired.get(entry.cookie)
+            if fm is None or entry.cookie in seen:
+                self._delete(entry)  # stale, or a duplicate of one we kept
+            elif self._same(entry, fm):
+                seen.add(entry.cookie)
+                self.unchanged += 1
+            else:
+                self._delete(entry)
+
+        for cookie, fm in self.desired.items():
+            if cookie not in seen:
+                self.connection.send(fm)
+                self.added += 1
+        self._barrier()
+
+    def _handle_timeout(self):
+        if self._stats_xid is None:
+            return
+        self._load_desired()
+        log.warning("dpid=%s: no flow stats reply, reinstalling %d flows",
+                    self.connection.dpid, len(self.desired))
+        self._stats_xid = None
+        for fm in self.desired.values():
+            self.connection.send(fm)
+            self.added += 1
+        self._barrier()
+
+    def _barrier(self):
+        barrier = of.ofp_barrier_request()
+        self._barrier_xid = barrier.xid
+        self.connection.send(barrier)
+
+    def _handle_BarrierIn(self, event):
+        if self._barrier_xid is None or event.xid != self._barrier_xid:
+            return
+        self._barrier_xid = None
+        self.finished = True
+        self.connection.removeListeners(self._listeners)
+        log.info("dpid=%s: reconciled flows: %d kept, %d added, %d deleted",
+                 self.connection.dpid, self.unchanged, self.added, self.deleted)
+        if self.done is not None:
+            self.done(self)
+
+    def _handle_ConnectionDown(self, event):
+        if self._timer is not None:
+            self._timer.cancel()
+        self.connection.removeListeners(self._listeners)
+
+
+def keep_flows_on_connect():
+    """
+    POX wipes every flow table on connect by default, which leaves nothing
+    to reconcile. Call from launch() to turn that off.
+    """
+    core.openflow.clear_flows_on_connect = False
@@ -0,0 +1,109 @@
+# Sending a packet-in's packet back out.
+#
+# A switch that buffers a table miss sends the controller only the first
+# miss_send_len bytes of the frame plus a buffer_id; a packet_out naming
+# that buffer_id makes the switch send its own copy. So a buffered frame
+# crosses the control channel in full neither way. Unbuffered packet-ins
+# carry the whole frame (OpenFlow 1.0 spec) and it goes back as data.
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+
+log = core.getLogger()
+
+NO_BUFFER = 0xffffffff
+
+
+class Forwarder(object):
+    """
+    Builds the packet_outs that resend packet-ins, by buffer_id when the
+    switch buffered the frame and with the frame otherwise, and counts the
+    control-channel bytes that saved:
+    - bytes_in_saved: frame bytes the switch left out of packet-ins
+    - bytes_out_saved: frame bytes we didn't send back thanks to a buffer_id
+    A frame that was cut short and not buffered can't be resent; those are
+    counted as truncated and dropped.
+    """
+
+    def __init__(self):
+        self.buffered = 0
+        self.unbuffered = 0
+        self.truncated = 0
+        self.bytes_out = 0
+        self.bytes_in_saved = 0
+        self.bytes_out_saved = 0
+
+    def buffer_or_data(self, packet_in):
+        """
+        (buffer_id, data) to resend packet_in's frame with, one of them
+        NO_BUFFER / b"", or None if that's impossible.
+        """
+        data = packet_in.data or b""
+        total_len = packet_in.total_len or len(data)
+        if total_len > len(data):
+            self.bytes_in_saved += total_len - len(data)
+        buffer_id = packet_in.buffer_id
+        if buffer_id is not None and buffer_id != -1 and buffer_id != NO_BUFFER:
+            self.buffered += 1
+            self.bytes_out_saved += total_len
+            return buffer_id, b""
+        if total_len > len(data):
+            self.truncated += 1
+            log.debug("Can't resend a truncated, unbuffered packet (%d of %d bytes)",
+                      len(data), total_len)
+            return None
+        self.unbuffered += 1
+        self.bytes_out += len(data)
+        return NO_BUFFER, data
+
+    def packet_out(self, packet_in, actions):
+        """
+        ofp_packet_out resending packet_in's frame with `actions` (a list,
+        or one output port), or None.
+        """
+        resend = self.buffer_or_data(packet_in)
+        if resend is None:
+            return None
+        msg = of.ofp_packet_out()
+        msg.in_port = packet_in.in_port
+        if resend[0] != NO_BUFFER:
+            msg.buffer_id = resend[0]
+        else:
+            msg.data = resend[1]
+        if isinstance(actions, int):
+            actions = [of.ofp_action_output(port=actions)]
+        msg.actions.extend(actions)
+        return msg
+
+    def send(self, connection, packet_in, actions):
+        msg = self.packet_out(packet_in, actions)
+        if msg is None:
+            return False
+        connection.send(msg)
+        return True
+
+    def stats(self):
+        return {
+            "buffered": self.buffered,
+            "unbuffered": self.unbuffered,
+            "truncated": self.truncated,
+            "bytes_out": self.bytes_out,
+            "bytes_in_saved": self.bytes_in_saved,
+            "bytes_out_saved": self.bytes_out_saved,
+        }
+
+
+def set_miss_send_len(miss_send_len):
+    """
+    Have every switch that connects from now on send at most miss_send_len
+    bytes of a table-miss frame to the controller (OFPT_SET_CONFIG). Call
+    from launch(); None leaves POX's default alone.
+    """
+    if miss_send_len is None:
+        return
+    miss_send_len = int(miss_send_len)
+
+    def configure(event):
+        event.connection.send(of.ofp_set_config(miss_send_len=miss_send_len))
+
+    core.openflow.addListenerByName("ConnectionUp", configure)
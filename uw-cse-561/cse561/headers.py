@@ -0,0 +1,86 @@
+# Minimal header decoding for the packet-in hot path.
+#
+# event.parsed turns the whole frame into POX packet objects (ethernet,
+# vlan, ipv4, tcp, payloads) the first time it is used. Most handlers only
+# need the MACs, the ethertype and maybe the ARP or IPv4 addresses.
+# Headers reads just those straight from the frame bytes (event.ofp.data)
+# with struct, each when asked for. The full parse stays available as
+# event.parsed for the few paths that need it.
+#
+# MACs are 6 raw bytes and IPv4 addresses ints, as in routing.py and
+# templates.py. No POX imports.
+
+import struct
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_VLAN = 0x8100
+ETH_TYPE_LLDP = 0x88cc
+
+ARP_REQUEST = 1
+ARP_REPLY = 2
+
+ETH_HEADER_LEN = 14
+VLAN_TAG_LEN = 4
+
+_U16 = struct.Struct("!H")
+_IPV4 = struct.Struct("!9xB2xLL")  # protocol, src, dst
+_ARP = struct.Struct("!6xH6sL6xL")  # opcode, sender MAC, sender IP, target IP
+
+
+class Headers(object):
+    """
+    Lazily decoded view of one Ethernet frame.
+    `dl_type` is the ethertype after an optional 802.1Q tag and `l3` the
+    offset of what follows it. A frame too short for an Ethernet header
+    isn't `complete`.
+    """
+
+    __slots__ = ("data", "dl_type", "l3")
+
+    def __init__(self, data):
+        self.data = data
+        if len(data) < ETH_HEADER_LEN:
+            self.dl_type = None
+            self.l3 = len(data)
+            return
+        dl_type = _U16.unpack_from(data, 12)[0]
+        l3 = ETH_HEADER_LEN
+        if dl_type == ETH_TYPE_VLAN and len(data) >= ETH_HEADER_LEN + VLAN_TAG_LEN:
+            dl_type = _U16.unpack_from(data, 16)[0]
+            l3 += VLAN_TAG_LEN
+        self.dl_type = dl_type
+        self.l3 = l3
+
+    @property
+    def complete(self):
+        return self.dl_type is not None
+
+    @property
+    def dl_dst(self):
+        return self.data[0:6]
+
+    @property
+    def dl_src(self):
+        return self.data[6:12]
+
+    @property
+    def is_multicast(self):
+        return bool(self.data[0] & 1)
+
+    def ipv4(self):
+        """
+        (protocol, src, dst) of an IPv4 packet, or None.
+        """
+        if self.dl_type != ETH_TYPE_IP or len(self.data) < self.l3 + 20:
+            return None
+        return _IPV4.unpack_from(self.data, self.l3)
+
+    def arp(self):
+        """
+        (opcode, sender MAC, sender IP, target IP) of an Ethernet/IPv4 ARP
+        packet, or None.
+        """
+        if self.dl_type != ETH_TYPE_ARP or len(self.data) < self.l3 + 28:
+            return None
+        return _ARP.unpack_from(self.data, self.l3)
@@ -0,0 +1,303 @@
+# Controller metrics, served in the Prometheus text format.
+#
+# Counters and histograms are plain dicts keyed by label-value tuples that
+# the controllers bump inline (one dict get/set, or a bisect for a
+# histogram), so they stay on all the time. Table sizes and the counters
+# the controllers already keep (MacTable.stats(), ArpCache.stats(), ...)
+# are read by collector functions only when the endpoint is scraped.
+#
+# The endpoint is a stdlib HTTP server on its own thread. Run it as a POX
+# component:
+#
+#   ./pox.py ... cse561.metrics --port=8561
+#   curl -s localhost:8561/metrics
+#
+# Scrapes read the controllers' dicts from that thread without locking.
+# Anything a scrape iterates (the metrics' own dicts here, and the tables
+# the collector functions walk) is first copied with list(d.items()) or
+# list(d.values()), a single C call the GIL keeps atomic, so a switch
+# connecting or a flow being learned mid-scrape can't break the
+# iteration. The worst a scrape can see is a count from a moment earlier.
+# Collector functions must do the same.
+
+from bisect import bisect_left
+import functools
+import threading
+import time
+
+from pox.core import core
+
+log = core.getLogger()
+
+DEFAULT_PORT = 8561
+
+# _handle_PacketIn latency buckets, seconds
+LATENCY_BUCKETS = (25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 0.1)
+
+# OpenFlow 1.0 message type -> label
+OFPT_NAMES = {
+    0: "hello", 2: "echo_request", 3: "echo_reply", 5: "features_request",
+    7: "get_config_request", 9: "set_config", 13: "packet_out", 14: "flow_mod",
+    15: "port_mod", 16: "stats_request", 18: "barrier_request",
+}
+
+ETH_TYPE_NAMES = {0x0800: "ipv4", 0x0806: "arp", 0x86dd: "ipv6", 0x88cc: "lldp", 0x8100: "vlan"}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % (",".join(pairs),) if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    __slots__ = ("name", "help", "labels", "values")
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values -> count
+
+    def inc(self, key=(), n=1):
+        values = self.values
+        values[key] = values.get(key, 0) + n
+
+    def samples(self):
+        for key, value in list(self.values.items()):
+            yield self.name, _labels(self.labels, key), value
+
+
+class Histogram(object):
+    """
+    Per label set: a count per bucket (plus +Inf), and the sum.
+    """
+
+    __slots__ = ("name", "help", "labels", "buckets", "series")
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, key, value):
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for key, series in list(self.series.items()):
+            series = list(series)
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                total += count
+                yield (self.name + "_bucket",
+                       _labels(self.labels, key, 'le="%s"' % (_number(bound),)), total)
+            yield self.name + "_sum", _labels(self.labels, key), series[-1]
+            yield self.name + "_count", _labels(self.labels, key), total
+
+
+class Collected(object):
+    """
+    A gauge or counter whose values come from fn() -> {label values: value}
+    at scrape time.
+    """
+
+    __slots__ = ("name", "help", "labels", "kind", "fn")
+
+    def __init__(self, name, help, labels, fn, kind="gauge"):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        for key, value in list(self.fn().items()):
+            if not isinstance(key, tuple):
+                key = (key,)
+            yield self.name, _labels(self.labels, key), value
+
+
+class Registry(object):
+    """
+    Named metrics. Asking for an existing name returns the existing metric,
+    so controller modules can be reloaded.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def _get(self, cls, name, *args, **kw):
+        metric = self.metrics.get(name)
+        if metric is None or not isinstance(metric, cls):
+            metric = self.metrics[name] = cls(name, *args, **kw)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def collect(self, name, help, labels, fn, kind="gauge"):
+        """
+        Register fn() -> {label values: value}, replacing an earlier one.
+        """
+        self.metrics[name] = Collected(name, help, labels, fn, kind)
+
+    def render(self):
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                log.exception("Collecting %s failed", name)
+                continue
+            lines.append("# HELP %s %s" % (name, metric.help))
+            lines.append("# TYPE %s %s" % (name, metric.kind))
+            for sample, labels, value in samples:
+                lines.append("%s%s %s" % (sample, labels, _number(value)))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Shared by every controller
+PACKET_INS = registry.counter(
+    "cse561_packet_ins_total", "Packet-ins handled, by ethertype",
+    ("controller", "dpid", "type"))
+PACKET_IN_SECONDS = registry.histogram(
+    "cse561_packet_in_seconds", "Time spent in _handle_PacketIn", ("controller", "dpid"))
+MESSAGES_SENT = registry.counter(
+    "cse561_messages_sent_total", "OpenFlow messages sent to switches, by type",
+    ("dpid", "type"))
+DECISIONS = registry.counter(
+    "cse561_decisions_total", "What the controller did with a packet-in (flood, unicast, ...)",
+    ("controller", "dpid", "decision"))
+
+
+def timed_packet_in(controller):
+    """
+    Decorator for a _handle_PacketIn(self, event) method whose object has
+    a .connection: counts the packet-in by ethertype and times the handler.
+    """
+    def decorate(handler):
+        @functools.wraps(handler)
+        def _handle_PacketIn(self, event):
+            start = time.perf_counter()
+            try:
+                return handler(self, event)
+            finally:
+                elapsed = time.perf_counter() - start
+                dpid = self.connection.dpid
+                PACKET_IN_SECONDS.observe((controller, dpid), elapsed)
+                data = event.ofp.data
+                dl_type = (data[12] << 8 | data[13]) if len(data) >= 14 else None
+                PACKET_INS.inc((controller, dpid, ETH_TYPE_NAMES.get(dl_type, "other")))
+        return _handle_PacketIn
+    return decorate
+
+
+def decision(controller, dpid, what):
+    DECISIONS.inc((controller, dpid, what))
+
+
+def meter_connection(connection):
+    """
+    Count every message sent on this connection by OpenFlow type, by
+    wrapping its send(). Safe to call more than once.
+    """
+    if getattr(connection, "_metered", False):
+        return
+    send = connection.send
+    dpid = connection.dpid
+
+    def metered_send(data):
+        if isinstance(data, (bytes, bytearray)):
+            ofpt = data[1] if len(data) > 1 else None
+        else:
+            ofpt = getattr(data, "header_type", None)
+        MESSAGES_SENT.inc((dpid, OFPT_NAMES.get(ofpt, "other")))
+        return send(data)
+
+    connection.send = metered_send
+    connection._metered = True
+
+
+def stats_collector(name, help, labels, sources, kind="gauge"):
+    """
+    Export a family of stats() dicts: sources() -> {label values: stats
+    dict}; each stats key becomes a `stat` label.
+    """
+    def fn():
+        out = {}
+        for key, stats in list(sources().items()):
+            if not isinstance(key, tuple):
+                key = (key,)
+            for stat, value in stats.items():
+                out[key + (stat,)] = value
+        return out
+    registry.collect(name, help, tuple(labels) + ("stat",), fn, kind)
+
+
+def serve(address="127.0.0.1", port=DEFAULT_PORT):
+    """
+    Serve registry.render() on http://address:port/metrics from a daemon
+    thread. Returns the server.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            log.debug("%s %s", self.address_string(), fmt % args)
+
+    server = ThreadingHTTPServer((address, int(port)), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="cse561.metrics")
+    thread.daemon = True
+    thread.start()
+    log.info("Metrics on http://%s:%s/metrics", address, server.server_address[1])
+    return server
+
+
+def launch(address="127.0.0.1", port=DEFAULT_PORT):
+    """
+    Serve the controllers' metrics over HTTP.
+
+    --address=A  listen address (default 127.0.0.1, local only)
+    --port=N     listen port (default 8561)
+    """
+    server = serve(address, int(port))
+    core.register("metrics", registry)
+    core.addListenerByName("GoingDownEvent", lambda event: server.shutdown())
@@ -0,0 +1,150 @@
+# Heavy computations off POX's event loop.
+#
+# POX runs every event handler on one cooperative thread, so a handler
+# that spends a second recomputing backup trees delays every packet-in
+# from every switch by a second. Such work goes through
+# offloader.submit(name, fn, args, callback) instead: fn(*args) runs on a
+# worker thread or process, and callback(result) is then called back on
+# the POX thread (core.callLater), where it can touch controller state.
+#
+# Results are versioned per name. Every submit gets the next version, and
+# only the result of the newest one is applied; older results are
+# dropped as stale. While a computation of a name runs, newer submits
+# wait and only the newest waiting one is started, so a burst of
+# topology changes costs one or two computations, not one each.
+#
+# fn must work on its own copies of the data (the event loop keeps
+# changing the originals). In process mode fn and its arguments must be
+# picklable, so fn has to be a module-level function.
+#
+# Modes: thread (the default), process, or inline (run fn right away on
+# the POX thread, as before). Pick one with the component:
+#
+#   ./pox.py ... cse561.offload --mode=process --workers=2
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pox.core import core
+
+log = core.getLogger()
+
+MODES = ("thread", "process", "inline")
+
+
+class Offloader(object):
+    """
+    Runs submitted computations on `workers` threads or processes and
+    hands the newest result for each name back through call_later
+    (default core.callLater).
+    """
+
+    def __init__(self, mode="thread", workers=1, call_later=None):
+        self._executor = None
+        self._call_later = call_later
+        self._version = {}  # name -> newest version submitted
+        self._running = set()  # names with a computation on a worker
+        self._waiting = {}  # name -> (version, fn, args, callback) to start next
+
+        self.submitted = 0
+        self.applied = 0
+        self.stale = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.configure(mode, workers)
+
+    def configure(self, mode="thread", workers=1):
+        if mode not in MODES:
+            raise ValueError("mode must be one of %s, got %r" % (", ".join(MODES), mode))
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.mode = mode
+        self.workers = workers
+        if mode == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=workers,
+                                                thread_name_prefix="cse561.offload")
+        elif mode == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = None
+
+    def submit(self, name, fn, args=(), callback=None):
+        """
+        Compute fn(*args) off the event loop and call callback(result) on
+        it, unless a newer submit for `name` supersedes this one.
+        Returns this submit's version.
+        """
+        version = self._version.get(name, 0) + 1
+        self._version[name] = version
+        self.submitted += 1
+        if self._executor is None:
+            result = fn(*args)
+            self.applied += 1
+            if callback is not None:
+                callback(result)
+        elif name in self._running:
+            if name in self._waiting:
+                self.coalesced += 1
+            self._waiting[name] = (version, fn, args, callback)
+        else:
+            self._start(name, version, fn, args, callback)
+        return version
+
+    def _start(self, name, version, fn, args, callback):
+        self._running.add(name)
+        future = self._executor.submit(fn, *args)
+        call_later = self._call_later or core.callLater
+        # Called on the worker side; the result is picked up on the POX thread
+        future.add_done_callback(
+            lambda f: call_later(self._done, name, version, f, callback))
+
+    def _done(self, name, version, future, callback):
+        self._running.discard(name)
+        waiting = self._waiting.pop(name, None)
+        if waiting is not None:
+            self._start(name, *waiting)
+
+        try:
+            result = future.result()
+        except Exception:
+            self.errors += 1
+            log.exception("Offloaded %s (version %d) failed", name, version)
+            return
+        if version != self._version.get(name):
+            self.stale += 1
+            return
+        self.applied += 1
+        if callback is not None:
+            callback(result)
+
+    def pending(self, name):
+        """
+        True while a result for `name` is still to come.
+        """
+        return name in self._running
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "applied": self.applied,
+            "stale": self.stale,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "running": len(self._running),
+        }
+
+
+# The one offloader every controller submits to
+offloader = Offloader()
+
+
+def launch(mode="thread", workers=1):
+    """
+    Choose where heavy computations run.
+
+    --mode=MODE  thread (default), process (fn and args get pickled) or
+                 inline (on the POX thread, blocking it)
+    --workers=N  worker threads or processes
+    """
+    offloader.configure(mode, int(workers))
+    core.register("offloader", offloader)
+    log.info("Offloading computations: %s, %s workers", mode, workers)
@@ -0,0 +1,141 @@
+# Binary log of the OpenFlow messages between switches and a controller.
+#
+# tools/ofrecord.py writes one while relaying a Mininet run between the
+# switches and POX; tools/ofreplay.py feeds the switch side of it back
+# into controller modules offline. Only needs the standard library.
+#
+# A log is an 8-byte magic and the start time (a double, Unix seconds),
+# then one record per event:
+#
+#   !QHB  microseconds since the start, connection number, kind
+#
+# CONNECT and CLOSE records end there; TO_CONTROLLER and TO_SWITCH ones
+# are followed by the OpenFlow message, whose header carries its length.
+# That is 11 bytes on top of each message. A name ending in .gz is
+# gzip-compressed.
+
+from collections import namedtuple
+import gzip
+import struct
+
+MAGIC = b"CSE561OF"
+
+CONNECT = 0  # a switch connected
+TO_CONTROLLER = 1  # switch -> controller message
+TO_SWITCH = 2  # controller -> switch message
+CLOSE = 3  # either side closed the connection
+
+KIND_NAMES = {CONNECT: "connect", TO_CONTROLLER: "to_controller", TO_SWITCH: "to_switch",
+              CLOSE: "close"}
+
+# OpenFlow 1.0 message types
+OFPT_NAMES = {
+    0: "hello", 1: "error", 2: "echo_request", 3: "echo_reply", 4: "vendor",
+    5: "features_request", 6: "features_reply", 7: "get_config_request",
+    8: "get_config_reply", 9: "set_config", 10: "packet_in", 11: "flow_removed",
+    12: "port_status", 13: "packet_out", 14: "flow_mod", 15: "port_mod",
+    16: "stats_request", 17: "stats_reply", 18: "barrier_request", 19: "barrier_reply",
+    20: "queue_get_config_request", 21: "queue_get_config_reply",
+}
+
+_START = struct.Struct("!d")
+_RECORD = struct.Struct("!QHB")
+_OFP_HEADER = struct.Struct("!BBHL")
+
+Record = namedtuple("Record", "time conn kind data")
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class LogWriter(object):
+    """
+    Appends records to a new log. Times are taken by the caller (seconds,
+    same clock as `start`).
+    """
+
+    def __init__(self, path, start):
+        self.path = path
+        self.start = start
+        self.records = 0
+        self._f = _open(path, "wb")
+        self._f.write(MAGIC + _START.pack(start))
+
+    def write(self, t, conn, kind, data=b""):
+        micros = max(0, int(round((t - self.start) * 1e6)))
+        self._f.write(_RECORD.pack(micros, conn, kind))
+        if data:
+            self._f.write(data)
+        self.records += 1
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def read_log(path):
+    """
+    (start time, iterator of Records) for a log; Record.time is seconds
+    since the start. A log cut short ends at its last whole record.
+    """
+    f = _open(path, "rb")
+    head = f.read(len(MAGIC) + _START.size)
+    if len(head) < len(MAGIC) + _START.size or head[:len(MAGIC)] != MAGIC:
+        f.close()
+        raise ValueError("%s is not an OpenFlow log" % (path,))
+    start = _START.unpack_from(head, len(MAGIC))[0]
+
+    def records():
+        with f:
+            while True:
+                raw = f.read(_RECORD.size)
+                if len(raw) < _RECORD.size:
+                    return
+                micros, conn, kind = _RECORD.unpack(raw)
+                data = b""
+                if kind in (TO_CONTROLLER, TO_SWITCH):
+                    header = f.read(_OFP_HEADER.size)
+                    if len(header) < _OFP_HEADER.size:
+                        return
+                    length = _OFP_HEADER.unpack(header)[2]
+                    body = f.read(length - len(header)) if length > len(header) else b""
+                    if len(body) < length - len(header):
+                        return
+                    data = header + body
+                yield Record(micros / 1e6, conn, kind, data)
+
+    return start, records()
+
+
+def type_name(data):
+    return OFPT_NAMES.get(data[1], "type%d" % (data[1],))
+
+
+def label(data):
+    """
+    type_name(), with "/lldp" added for packet-ins and packet-outs that
+    carry discovery's LLDP frames (timer-driven, so they rarely line up
+    between two runs).
+    """
+    name = type_name(data)
+    if data[1] == 10:
+        frame = 18  # ofp_packet_in fields before the frame
+    elif data[1] == 13 and len(data) >= 16:
+        frame = 16 + struct.unpack_from("!H", data, 14)[0]  # after the actions
+    else:
+        return name
+    if data[frame + 12:frame + 14] == b"\x88\xcc":
+        return name + "/lldp"
+    return name
+
+
+def without_xid(data):
+    """
+    The message with its xid zeroed, for comparing two runs' outputs.
+    """
+    return data[:4] + b"\x00\x00\x00\x00" + data[8:]
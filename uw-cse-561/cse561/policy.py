@@ -0,0 +1,251 @@
+# Policy compiler for the project2 router topologies.
+#
+# The network and its policy are plain data:
+#
+#   network = {
+#       "routers": {21: {"h10": 1, "serv1": 4, ...}},  # dpid -> zone member -> port
+#       "edges": {1: "h10", 31: "serv1", ...},         # dpid -> member it floods for
+#   }
+#   zones = {"untrusted": ["hnotrust"], "datacenter": ["serv1"], ...}
+#   policy = [  # first match wins, whatever is not denied gets routed
+#       {"action": "deny", "src": "untrusted", "proto": "icmp"},
+#       {"action": "deny", "src": "untrusted", "dst": "datacenter"},
+#   ]
+#
+# Zone members are names from `subnets` (or literal CIDRs). compile(dpid)
+# turns this into the flows for one switch: edge switches flood IPv4,
+# routers get the policy as high-priority ACL flows above one route per
+# (aggregated) destination prefix. No POX imports, so it can be used and
+# benchmarked offline.
+
+from collections import namedtuple
+import ipaddress
+
+# Priorities: ACL flows sit above every route, routes are ordered by prefix
+# length (OpenFlow 1.0 has no longest-prefix match of its own)
+ACL_PRIORITY = 1000
+ROUTE_PRIORITY = 900
+EDGE_PRIORITY = 900
+MAX_PRIORITY = 0xffff  # ofp_flow_mod.priority is 16 bits
+
+FLOOD = "flood"  # out_port of the edge switch rule
+
+PROTOCOLS = {"icmp": 1, "tcp": 6, "udp": 17}
+
+# One flow: src/dst are CIDR strings or None (any), out_port None = drop
+FlowSpec = namedtuple("FlowSpec", "priority src dst proto tp_dst out_port")
+
+_ANY = ipaddress.ip_network("0.0.0.0/0")
+
+
+class PolicyError(ValueError):
+    pass
+
+
+def _covers(outer, inner):
+    """
+    Field-wise: outer matches everything inner does (None = wildcard).
+    """
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    if isinstance(outer, ipaddress.IPv4Network):
+        return inner.subnet_of(outer)
+    return outer == inner
+
+
+def _ancestors(net):
+    """
+    Keys (address, prefixlen) of net and every prefix containing it, then
+    None for the wildcard.
+    """
+    if net is not None:
+        addr = int(net.network_address)
+        for plen in range(net.prefixlen, -1, -1):
+            yield (addr & (0xffffffff << (32 - plen)) & 0xffffffff, plen)
+    yield None
+
+
+def _key(net):
+    return None if net is None else (int(net.network_address), net.prefixlen)
+
+
+def _overlaps(a, b):
+    if a is None or b is None:
+        return True
+    if isinstance(a, ipaddress.IPv4Network):
+        return a.overlaps(b)
+    return a == b
+
+
+def aggregate_routes(routes):
+    """
+    Smallest route table with the same longest-prefix-match result as
+    `routes` (network -> port):
+    - drop a prefix whose nearest covering prefix already has its port
+    - merge two sibling prefixes with the same port into their parent
+    """
+    table = dict(routes)
+
+    def covering_port(net):
+        while net.prefixlen > 0:
+            net = net.supernet()
+            if net in table:
+                return table[net]
+        return None
+
+    for plen in range(32, 0, -1):
+        for net in [n for n in table if n.prefixlen == plen]:
+            if net not in table:
+                continue  # merged away as a sibling
+            port = table[net]
+            parent = net.supernet()
+            a, b = parent.subnets()
+            sibling = b if net == a else a
+            if table.get(sibling) == port:
+                # Together they cover all of parent, whatever it routed before
+                del table[net]
+                del table[sibling]
+                table[parent] = port
+
+    # Redundant entries, longest first so removals don't hide each other
+    for net in sorted(table, key=lambda n: -n.prefixlen):
+        if covering_port(net) == table[net]:
+            del table[net]
+    return table
+
+
+class PolicyCompiler(object):
+    """
+    Compiles network + zones + policy into FlowSpecs per switch.
+    The router result is computed once per dpid and cached.
+    """
+
+    def __init__(self, network, zones, policy, subnets):
+        self.subnets = subnets
+        self.zones = dict((name, self._prefixes(members)) for name, members in zones.items())
+        self.routers = network.get("routers", {})
+        self.edges = network.get("edges", {})
+        self.policy = [self._parse_rule(r) for r in policy]
+        self._cache = {}
+
+        # dpid -> (shadowed, redundant) rules dropped compiling it, for logging
+        self.dropped = {}
+
+    def _prefix(self, member):
+        return ipaddress.ip_network(self.subnets.get(member, member), strict=False)
+
+    def _prefixes(self, members):
+        # overlapping/adjacent members collapse into fewer prefixes
+        return list(ipaddress.collapse_addresses(self._prefix(m) for m in members))
+
+    def _side(self, value):
+        if value is None:
+            return [None]
+        if value in self.zones:
+            return self.zones[value]
+        return [self._prefix(value)]
+
+    def _parse_rule(self, rule):
+        action = rule.get("action", "deny")
+        if action not in ("allow", "deny"):
+            raise PolicyError("unknown action %r" % (action,))
+        proto = rule.get("proto")
+        if proto is not None:
+            proto = PROTOCOLS.get(proto, proto)
+        tp_dst = rule.get("tp_dst")
+        if tp_dst is not None and proto not in (PROTOCOLS["tcp"], PROTOCOLS["udp"]):
+            raise PolicyError("tp_dst needs proto tcp or udp: %r" % (rule,))
+        # src x dst cross product of the zones' prefixes
+        return [(action, src, dst, proto, tp_dst)
+                for src in self._side(rule.get("src"))
+                for dst in self._side(rule.get("dst"))]
+
+    def compile(self, dpid):
+        """
+        FlowSpecs for this switch, or None if the network doesn't know it.
+        """
+        specs = self._cache.get(dpid)
+        if specs is None:
+            if dpid in self.routers:
+                specs, self.dropped[dpid] = self._compile_router(self.routers[dpid])
+            elif dpid in self.edges:
+                specs = [FlowSpec(EDGE_PRIORITY, None, None, None, None, FLOOD)]
+            else:
+                return None
+            self._cache[dpid] = specs
+        return specs
+
+    def _compile_router(self, ports):
+        """
+        (specs, (shadowed, redundant)) for a router with these ports.
+        """
+        routes = aggregate_routes(dict((self._prefix(m), port) for m, port in ports.items()))
+
+        def lpm(net):
+            while True:
+                port = routes.get(net)
+                if port is not None or net.prefixlen == 0:
+                    return port
+                net = net.supernet()
+
+        # 1. flatten the policy, dropping rules an earlier rule shadows.
+        #    Earlier rules are indexed by (src, dst) key, so only the ones
+        #    whose prefixes contain this rule's are looked at.
+        shadowed = redundant = 0
+        acl = []
+        seen = {}  # (src key, dst key) -> [(proto, tp_dst)]
+        for rule in self.policy:
+            for entry in rule:
+                action, src, dst, proto, tp_dst = entry
+                if any(_covers(p, proto) and _covers(t, tp_dst)
+                       for s in _ancestors(src) for d in _ancestors(dst)
+                       for p, t in seen.get((s, d), ())):
+                    shadowed += 1
+                    continue
+                acl.append(entry)
+                seen.setdefault((_key(src), _key(dst)), []).append((proto, tp_dst))
+
+        # 2. an allow only matters if a later deny overlaps it; otherwise the
+        #    routes below do the same thing
+        kept = []
+        for i, entry in enumerate(acl):
+            if entry[0] == "allow" and not any(
+                    e[0] == "deny" and all(_overlaps(x, y) for x, y in zip(e[1:], entry[1:]))
+                    for e in acl[i + 1:]):
+                redundant += 1
+                continue
+            kept.append(entry)
+
+        # 3. ACL flows, top rule first; an allow forwards like the routes it
+        #    spans, most specific first
+        flows = []
+        for action, src, dst, proto, tp_dst in kept:
+            if action == "deny":
+                flows.append((src, dst, proto, tp_dst, None))
+                continue
+            scope = _ANY if dst is None else dst
+            inner = sorted((n for n in routes if n != scope and n.subnet_of(scope)),
+                           key=lambda n: -n.prefixlen)
+            for net in inner:
+                flows.append((src, net, proto, tp_dst, routes[net]))
+            port = lpm(scope)
+            if port is not None:
+                flows.append((src, dst, proto, tp_dst, port))
+
+        specs = []
+        top = ACL_PRIORITY + len(flows) - 1
+        if top > MAX_PRIORITY:
+            raise PolicyError("%d ACL flows do not fit in priorities %d-%d"
+                              % (len(flows), ACL_PRIORITY, MAX_PRIORITY))
+        for i, (src, dst, proto, tp_dst, port) in enumerate(flows):
+            specs.append(FlowSpec(top - i, _str(src), _str(dst), proto, tp_dst, port))
+        for net in sorted(routes, key=lambda n: (-n.prefixlen, n)):
+            specs.append(FlowSpec(ROUTE_PRIORITY + net.prefixlen, None, str(net),
+                                  None, None, routes[net]))
+        return specs, (shadowed, redundant)
+
+
+def _str(net):
+    return None if net is None else str(net)
@@ -0,0 +1,112 @@
+# Longest-prefix-match routing table.
+#
+# One hash table per prefix length in use, probed longest length first:
+# a lookup masks the address and does one dict get per length until one
+# hits. Routing tables use few distinct lengths (the Part 4 table one or
+# two, a large mixed table about six), so that is a handful of C-level
+# dict probes, and memory is one dict entry per prefix.
+
+_EMPTY = object()
+
+
+def _parse(prefix):
+    """
+    "a.b.c.d/n", "a.b.c.d" or (int or str address, n) -> (int address, n),
+    with host bits cleared.
+    """
+    if isinstance(prefix, tuple):
+        addr, plen = prefix
+    elif "/" in str(prefix):
+        addr, plen = str(prefix).split("/")
+        plen = int(plen)
+    else:
+        addr, plen = prefix, 32
+    addr = ip_to_int(addr)
+    if not 0 <= plen <= 32:
+        raise ValueError("bad prefix length in %r" % (prefix,))
+    mask = (0xffffffff << (32 - plen)) & 0xffffffff
+    return addr & mask, plen
+
+
+def ip_to_int(addr):
+    if isinstance(addr, int):
+        return addr
+    # POX IPAddr has toUnsigned(); anything else is taken as dotted quad
+    to_unsigned = getattr(addr, "toUnsigned", None)
+    if to_unsigned is not None:
+        return to_unsigned()
+    a, b, c, d = (int(x) for x in str(addr).split("."))
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def int_to_ip(addr):
+    return "%d.%d.%d.%d" % (addr >> 24, addr >> 16 & 0xff, addr >> 8 & 0xff, addr & 0xff)
+
+
+def _mask(plen):
+    return (0xffffffff << (32 - plen)) & 0xffffffff
+
+
+class PrefixTable(object):
+    """
+    Maps IPv4 prefixes to values with longest-prefix-match lookup.
+    Prefixes are "a.b.c.d/n" strings, (address, length) tuples or plain
+    addresses (/32).
+    """
+
+    def __init__(self):
+        self._by_length = {}  # prefix length -> {address: value}
+        self._probes = ()  # ((mask, {address: value}), ...), longest first
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, prefix):
+        addr, plen = _parse(prefix)
+        return addr in self._by_length.get(plen, ())
+
+    def items(self):
+        """
+        (prefix string, value), longest prefixes first.
+        """
+        for plen in sorted(self._by_length, reverse=True):
+            for addr, value in sorted(self._by_length[plen].items()):
+                yield "%s/%d" % (int_to_ip(addr), plen), value
+
+    def _reprobe(self):
+        self._probes = tuple((_mask(plen), self._by_length[plen])
+                             for plen in sorted(self._by_length, reverse=True))
+
+    def insert(self, prefix, value):
+        addr, plen = _parse(prefix)
+        table = self._by_length.get(plen)
+        if table is None:
+            table = self._by_length[plen] = {}
+            self._reprobe()
+        if addr not in table:
+            self._count += 1
+        table[addr] = value
+
+    def remove(self, prefix):
+        addr, plen = _parse(prefix)
+        table = self._by_length.get(plen)
+        if table is None or addr not in table:
+            raise KeyError(prefix)
+        del table[addr]
+        self._count -= 1
+        if not table:
+            del self._by_length[plen]
+            self._reprobe()
+
+    def lookup(self, addr, default=None):
+        """
+        Value of the longest prefix containing addr.
+        """
+        if not isinstance(addr, int):
+            addr = ip_to_int(addr)
+        for mask, table in self._probes:
+            value = table.get(addr & mask, _EMPTY)
+            if value is not _EMPTY:
+                return value
+        return default
@@ -0,0 +1,263 @@
+# Pre-packed OpenFlow 1.0 messages for the controllers' hot paths.
+#
+# Building a reply with POX objects (arp() + ethernet() + pack(), then an
+# ofp_packet_out with action objects, then pack() again) allocates a few
+# dozen objects per packet. A template packs the constant part of the
+# message once into a bytearray; build() patches only the variable fields
+# in place with struct.pack_into and returns one bytes object, which is
+# what Connection.send() wants.
+#
+# Addresses may be given as raw bytes, ints, POX EthAddr/IPAddr or strings.
+# Templates reuse their buffer, so they are not thread-safe; POX runs the
+# handlers on one thread.
+
+import itertools
+import struct
+
+OFP_VERSION = 0x01
+OFPT_PACKET_OUT = 13
+OFPT_FLOW_MOD = 14
+OFPAT_OUTPUT = 0
+OFPAT_SET_DL_DST = 5
+OFPP_NONE = 0xffff
+NO_BUFFER = 0xffffffff
+
+# ofp_match wildcard bits
+OFPFW_ALL = (1 << 22) - 1
+OFPFW_DL_TYPE = 1 << 4
+OFPFW_NW_DST_MASK = 0x3f << 14
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ARP_REQUEST = 1
+ARP_REPLY = 2
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+OFP_HEADER = struct.Struct("!BBHL")
+PACKET_OUT = struct.Struct("!BBHLLHH")  # header + buffer_id, in_port, actions_len
+ACTION_OUTPUT = struct.Struct("!HHHH")
+ACTION_SET_DL_DST = struct.Struct("!HH6s6x")
+MATCH = struct.Struct("!LH6s6sHBxHBBxxLLHH")
+FLOW_MOD = struct.Struct("!QHHHHLHH")  # after the match
+ETHERNET = struct.Struct("!6s6sH")
+ARP = struct.Struct("!HHBBH6sL6sL")
+
+_XID = struct.Struct("!L")
+_PORT = struct.Struct("!H")
+_U32 = struct.Struct("!L")
+_MAC = struct.Struct("!6s")
+
+_BROADCAST = b"\xff" * 6
+_ZERO_MAC = b"\x00" * 6
+
+# Our own xid range, away from the low numbers POX hands out
+_xids = itertools.count(0x40000000)
+
+
+def mac_bytes(mac):
+    if isinstance(mac, (bytes, bytearray)) and len(mac) == 6:
+        return bytes(mac)
+    to_raw = getattr(mac, "toRaw", None)
+    if to_raw is not None:
+        return to_raw()
+    return bytes(int(x, 16) for x in str(mac).replace("-", ":").split(":"))
+
+
+def ip_int(ip):
+    if isinstance(ip, int):
+        return ip
+    if isinstance(ip, (bytes, bytearray)) and len(ip) == 4:
+        return _U32.unpack(bytes(ip))[0]
+    to_unsigned = getattr(ip, "toUnsigned", None)
+    if to_unsigned is not None:
+        return to_unsigned()
+    a, b, c, d = (int(x) for x in str(ip).split("."))
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data = bytes(data) + b"\x00"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def _update_checksum(buf, at, old, new):
+    """
+    RFC 1624 incremental update of the checksum at buf[at:at+2] for one
+    16-bit word changing from old to new: HC' = ~(~HC + ~m + m').
+    """
+    total = (~_PORT.unpack_from(buf, at)[0] & 0xffff) + (~old & 0xffff) + new
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    _PORT.pack_into(buf, at, ~total & 0xffff)
+
+
+class ArpTemplate(object):
+    """
+    packet_out carrying an ARP request or reply from `src_mac`, sent out of
+    one port. build() patches the port, the addresses and the xid.
+    """
+
+    def __init__(self, opcode, src_mac):
+        src_mac = mac_bytes(src_mac)
+        frame_at = PACKET_OUT.size + ACTION_OUTPUT.size
+        self._buf = bytearray(frame_at + ETHERNET.size + ARP.size)
+        PACKET_OUT.pack_into(self._buf, 0, OFP_VERSION, OFPT_PACKET_OUT, len(self._buf), 0,
+                             NO_BUFFER, OFPP_NONE, ACTION_OUTPUT.size)
+        ACTION_OUTPUT.pack_into(self._buf, PACKET_OUT.size, OFPAT_OUTPUT, ACTION_OUTPUT.size, 0, 0)
+        ETHERNET.pack_into(self._buf, frame_at, _BROADCAST, src_mac, ETH_TYPE_ARP)
+        ARP.pack_into(self._buf, frame_at + ETHERNET.size, 1, ETH_TYPE_IP, 6, 4, opcode,
+                      src_mac, 0, _ZERO_MAC, 0)
+        self.opcode = opcode
+        self._port_at = PACKET_OUT.size + 4
+        self._eth_dst_at = frame_at
+        arp_at = frame_at + ETHERNET.size
+        self._spa_at = arp_at + 14
+        self._tha_at = arp_at + 18
+        self._tpa_at = arp_at + 24
+
+    def build(self, port, sender_ip, target_ip, target_mac=None):
+        """
+        ARP from sender_ip (at our MAC) to target_ip. A request without
+        target_mac is broadcast.
+        """
+        buf = self._buf
+        _XID.pack_into(buf, 4, next(_xids))
+        _PORT.pack_into(buf, self._port_at, port)
+        target_mac = _BROADCAST if target_mac is None else mac_bytes(target_mac)
+        _MAC.pack_into(buf, self._eth_dst_at, target_mac)
+        _MAC.pack_into(buf, self._tha_at,
+                       _ZERO_MAC if self.opcode == ARP_REQUEST else target_mac)
+        _U32.pack_into(buf, self._spa_at, ip_int(sender_ip))
+        _U32.pack_into(buf, self._tpa_at, ip_int(target_ip))
+        return bytes(buf)
+
+
+class EchoReplyTemplate(object):
+    """
+    Turns an ICMP echo request frame into the packet_out of its reply, sent
+    from `src_mac`: MACs and IPs swapped, TTL reset, type 0, checksums
+    updated (the ICMP one incrementally, whatever the payload size).
+    """
+
+    TTL = 64
+
+    def __init__(self, src_mac):
+        self.src_mac = mac_bytes(src_mac)
+        self._head = bytearray(PACKET_OUT.size + ACTION_OUTPUT.size)
+        PACKET_OUT.pack_into(self._head, 0, OFP_VERSION, OFPT_PACKET_OUT, 0, 0,
+                             NO_BUFFER, OFPP_NONE, ACTION_OUTPUT.size)
+        ACTION_OUTPUT.pack_into(self._head, PACKET_OUT.size, OFPAT_OUTPUT, ACTION_OUTPUT.size, 0, 0)
+
+    def build(self, port, request):
+        """
+        Reply to the echo request frame `request` (bytes) out of `port`, or
+        None if it isn't one.
+        """
+        if len(request) < 14 + 20 + 8:
+            return None
+        ihl = (request[14] & 0x0f) * 4
+        total_len = struct.unpack_from("!H", request, 16)[0]
+        icmp_at = 14 + ihl
+        if (request[12:14] != b"\x08\x00" or request[23] != 1
+                or len(request) < 14 + total_len or request[icmp_at] != ICMP_ECHO_REQUEST):
+            return None
+
+        frame = bytearray(request[:14 + total_len])  # drop ethernet padding
+        frame[0:6] = request[6:12]
+        frame[6:12] = self.src_mac
+        frame[26:30] = request[30:34]
+        frame[30:34] = request[26:30]
+        # Swapping the addresses keeps both sums, only TTL and type change
+        frame[22] = self.TTL
+        _update_checksum(frame, 24, request[22] << 8, self.TTL << 8)
+        frame[icmp_at] = ICMP_ECHO_REPLY
+        _update_checksum(frame, icmp_at + 2, ICMP_ECHO_REQUEST << 8, ICMP_ECHO_REPLY << 8)
+
+        head = self._head
+        _PORT.pack_into(head, 2, len(head) + len(frame))
+        _XID.pack_into(head, 4, next(_xids))
+        _PORT.pack_into(head, PACKET_OUT.size + 4, port)
+        return bytes(head) + bytes(frame)
+
+
+class PacketOutTemplate(object):
+    """
+    packet_out with an optional set-dl_dst action and one output action.
+    build() patches the xid, buffer_id, in_port, MAC and port; the frame is
+    only appended when the switch didn't buffer it.
+    """
+
+    def __init__(self, set_dst=False):
+        self.set_dst = set_dst
+        actions_len = ACTION_OUTPUT.size + (ACTION_SET_DL_DST.size if set_dst else 0)
+        self._buf = bytearray(PACKET_OUT.size + actions_len)
+        PACKET_OUT.pack_into(self._buf, 0, OFP_VERSION, OFPT_PACKET_OUT, 0, 0,
+                             NO_BUFFER, OFPP_NONE, actions_len)
+        at = PACKET_OUT.size
+        if set_dst:
+            ACTION_SET_DL_DST.pack_into(self._buf, at, OFPAT_SET_DL_DST, ACTION_SET_DL_DST.size,
+                                        _ZERO_MAC)
+            self._mac_at = at + 4
+            at += ACTION_SET_DL_DST.size
+        ACTION_OUTPUT.pack_into(self._buf, at, OFPAT_OUTPUT, ACTION_OUTPUT.size, 0, 0xffff)
+        self._port_at = at + 4
+
+    def build(self, port, data=b"", buffer_id=None, in_port=OFPP_NONE, mac=None):
+        buf = self._buf
+        if buffer_id is None or buffer_id == -1:
+            buffer_id = NO_BUFFER
+        if buffer_id != NO_BUFFER:
+            data = b""
+        _PORT.pack_into(buf, 2, len(buf) + len(data))
+        _XID.pack_into(buf, 4, next(_xids))
+        _U32.pack_into(buf, 8, buffer_id)
+        _PORT.pack_into(buf, 12, in_port)
+        if self.set_dst:
+            _MAC.pack_into(buf, self._mac_at, mac_bytes(mac))
+        _PORT.pack_into(buf, self._port_at, port)
+        return bytes(buf) + data if data else bytes(buf)
+
+    def resend(self, packet_in, port, mac=None):
+        """
+        Send what a pox ofp_packet_in carried (its buffer, or its data).
+        """
+        return self.build(port, packet_in.data or b"", packet_in.buffer_id, packet_in.in_port, mac)
+
+
+class HostRouteTemplate(object):
+    """
+    flow_mod (ADD) for IPv4 to one host: match dl_type + nw_dst, rewrite
+    dl_dst and output. Priority, timeouts and cookie are fixed per template.
+    """
+
+    def __init__(self, priority, idle_timeout=0, hard_timeout=0, cookie=0):
+        match_at = OFP_HEADER.size
+        fm_at = match_at + MATCH.size
+        actions_at = fm_at + FLOW_MOD.size
+        self._buf = bytearray(actions_at + ACTION_SET_DL_DST.size + ACTION_OUTPUT.size)
+        OFP_HEADER.pack_into(self._buf, 0, OFP_VERSION, OFPT_FLOW_MOD, len(self._buf), 0)
+        wildcards = OFPFW_ALL & ~OFPFW_DL_TYPE & ~OFPFW_NW_DST_MASK
+        MATCH.pack_into(self._buf, match_at, wildcards, 0, _ZERO_MAC, _ZERO_MAC, 0, 0,
+                        ETH_TYPE_IP, 0, 0, 0, 0, 0, 0)
+        FLOW_MOD.pack_into(self._buf, fm_at, cookie, 0, idle_timeout, hard_timeout, priority,
+                           NO_BUFFER, OFPP_NONE, 0)
+        ACTION_SET_DL_DST.pack_into(self._buf, actions_at, OFPAT_SET_DL_DST,
+                                    ACTION_SET_DL_DST.size, _ZERO_MAC)
+        ACTION_OUTPUT.pack_into(self._buf, actions_at + ACTION_SET_DL_DST.size,
+                                OFPAT_OUTPUT, ACTION_OUTPUT.size, 0, 0xffff)
+        self._nw_dst_at = match_at + 32
+        self._mac_at = actions_at + 4
+        self._port_at = actions_at + ACTION_SET_DL_DST.size + 4
+
+    def build(self, ip, mac, port):
+        buf = self._buf
+        _XID.pack_into(buf, 4, next(_xids))
+        _U32.pack_into(buf, self._nw_dst_at, ip_int(ip))
+        _MAC.pack_into(buf, self._mac_at, mac_bytes(mac))
+        _PORT.pack_into(buf, self._port_at, port)
+        return bytes(buf)
@@ -0,0 +1,198 @@
+# Sampled, lazily formatted tracing for the controllers' hot paths.
+#
+# The handlers used to print a full packet dump (and "Flooding ..." lines)
+# for every packet-in, which is synchronous stdout I/O on POX's event loop.
+# Now they call tracer.trace(category, fmt, *args) instead:
+# - a category that isn't enabled costs one dict lookup
+# - an enabled one records every Nth call (its sampling rate) into a
+#   fixed-size ring buffer, as (time, category, fmt, args)
+# - nothing is formatted until the record is echoed to the log or dumped;
+#   fmt may be a %-format string or a function called with args
+#
+# The ring has one writer (POX's cooperative thread): a record is one list
+# store and one counter increment, so it needs no lock. Dumps requested by
+# signal are run on that thread too.
+#
+# Everything is off by default. Run it as a POX component to turn it on:
+#
+#   ./pox.py ... cse561.trace --packet=0.01 --forward=1 --echo
+#
+# or at runtime from POX's `py` console (core.tracer.set_rate("packet", 1),
+# core.tracer.toggle(), core.tracer.dump()), or with signals: SIGUSR1
+# pauses/resumes tracing, SIGUSR2 writes the ring to the log.
+
+import signal
+import time
+
+from pox.core import core
+
+log = core.getLogger()
+
+RING_SIZE = 1024
+
+
+class _Lazy(object):
+    """
+    Formats a record only if the log message is actually emitted.
+    """
+
+    __slots__ = ("record",)
+
+    def __init__(self, record):
+        self.record = record
+
+    def __str__(self):
+        return format_record(self.record)
+
+
+def format_record(record):
+    _, category, fmt, args = record
+    try:
+        text = fmt(*args) if callable(fmt) else fmt % args
+    except Exception as e:
+        text = "(unformattable: %r %r: %s)" % (fmt, args, e)
+    return "[%s] %s" % (category, text)
+
+
+class Tracer(object):
+    """
+    Per-category sampled trace records in a ring of `size` entries.
+    A category's rate is the fraction of its calls that get recorded: 1
+    records all of them, 0.01 every 100th, 0 (or unset) none.
+    With `echo`, every record is also logged at INFO.
+    """
+
+    def __init__(self, size=RING_SIZE, echo=False, clock=time.time):
+        self.size = size
+        self.echo = echo
+        self.clock = clock
+        self.rates = {}  # category -> configured rate
+        self.paused = False
+        self._every = {}  # category -> N, for the active categories
+        self._calls = {}  # category -> calls seen while active
+        self._ring = [None] * size
+        self._next = 0  # records written so far
+
+    def set_rate(self, category, rate):
+        rate = float(rate)
+        if not 0 <= rate <= 1:
+            raise ValueError("rate for %s must be in [0, 1], got %s" % (category, rate))
+        if rate:
+            self.rates[category] = rate
+        else:
+            self.rates.pop(category, None)
+        self._activate()
+
+    def _activate(self):
+        self._every = {} if self.paused else dict(
+            (c, max(1, int(round(1 / r)))) for c, r in self.rates.items())
+
+    def toggle(self):
+        """
+        Pause or resume every category; returns True if tracing is now on.
+        """
+        self.paused = not self.paused
+        self._activate()
+        log.info("Tracing %s", "paused" if self.paused else "resumed")
+        return not self.paused
+
+    def enabled(self, category):
+        return category in self._every
+
+    def trace(self, category, fmt, *args):
+        every = self._every.get(category)
+        if every is None:
+            return False
+        n = self._calls.get(category, 0)
+        self._calls[category] = n + 1
+        if n % every:
+            return False
+        record = (self.clock(), category, fmt, args)
+        self._ring[self._next % self.size] = record
+        self._next += 1
+        if self.echo:
+            log.info("%s", _Lazy(record))
+        return True
+
+    def records(self):
+        """
+        Records in the ring, oldest first.
+        """
+        if self._next <= self.size:
+            return self._ring[:self._next]
+        i = self._next % self.size
+        return self._ring[i:] + self._ring[:i]
+
+    def dump(self):
+        """
+        The ring as formatted lines, oldest first.
+        """
+        lines = []
+        for record in self.records():
+            lines.append("%.6f %s" % (record[0], format_record(record)))
+        return lines
+
+    def log_dump(self):
+        lines = self.dump()
+        log.info("Trace ring: %d of %d records kept", len(lines), self._next)
+        for line in lines:
+            log.info("%s", line)
+
+    def clear(self):
+        self._ring = [None] * self.size
+        self._next = 0
+        self._calls.clear()
+
+    def stats(self):
+        return {
+            "recorded": self._next,
+            "kept": min(self._next, self.size),
+            "calls": sum(self._calls.values()),
+            "categories": len(self._every),
+        }
+
+
+# The one tracer every controller writes to
+tracer = Tracer()
+
+
+def describe_packet_in(event):
+    """
+    fmt for packet-in records: the full POX dump, parsed only when shown.
+    """
+    packet = event.parsed
+    if not packet.parsed:
+        return "dpid=%s port=%s incomplete packet" % (event.dpid, event.port)
+    return "dpid=%s port=%s %s" % (event.dpid, event.port, packet.dump())
+
+
+def _on_signal(signum, frame):
+    # Don't touch the tracer from the signal handler itself
+    if signum == signal.SIGUSR1:
+        core.callLater(tracer.toggle)
+    else:
+        core.callLater(tracer.log_dump)
+
+
+def launch(size=RING_SIZE, echo=False, signals=True, **rates):
+    """
+    Turn tracing on.
+
+    --<category>=RATE  record this fraction of a category's traces, e.g.
+                       --packet=0.01 (packet-in dumps), --forward=1
+    --size=N           records kept in the ring
+    --echo             also log every record as it is made
+    --signals=False    don't install the SIGUSR1/SIGUSR2 handlers
+    """
+    tracer.size = int(size)
+    tracer.echo = str(echo).lower() != "false"
+    tracer.clear()
+    for category, rate in rates.items():
+        tracer.set_rate(category, rate)
+    core.register("tracer", tracer)
+
+    if signals and str(signals).lower() != "false" and hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, _on_signal)
+        signal.signal(signal.SIGUSR2, _on_signal)
+    log.info("Tracing %s", ", ".join("%s=%s" % kv for kv in sorted(tracer.rates.items()))
+             or "nothing yet")
@@ -3,11 +3,375 @@
 # based on Lab 4 from UCSC's Networking Class
 # which is based on of_tutorial by James McCauley
 
+from collections import OrderedDict, defaultdict, deque
+import time
+
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
+
+from cse561 import metrics
+from cse561.forwarding import Forwarder, set_miss_send_len
+from cse561.headers import Headers
+from cse561.trace import describe_packet_in, tracer
 
 log = core.getLogger()
 
+# extension 1: defaults for the MAC learning table and the flows it installs
+MAC_TABLE_CAPACITY = 4096
+FLOW_IDLE_TIMEOUT = 10  # seconds, 0 = never
+FLOW_HARD_TIMEOUT = 60  # seconds, 0 = never
+EXPIRE_INTERVAL = 1  # seconds between sweeps for aged-out MAC entries
+
+# How unicast flows are matched:
+#   dst   - dl_dst only (one flow per destination, the original behaviour)
+#   l2    - (in_port, dl_src, dl_dst), installed in both directions
+#   exact - full 10-tuple from the packet, installed in both directions
+MATCH_MODES = ("dst", "l2", "exact")
+
+IP_TYPE = 0x0800
+LLDP_TYPE = 0x88cc
+TCP_PROTO = 6
+UDP_PROTO = 17
+
+
+class MacTable(object):
+    """
+    Bounded MAC -> port table.
+    - At most `capacity` entries; the least recently used entry is evicted first.
+    - An entry expires when its host has not been seen as a source for
+      `idle_timeout` seconds, or `max_age` seconds after it was learned.
+    Both timeouts mirror the ones on the flows we install, so the table
+    forgets a host at about the same time the switch does.
+    """
+
+    def __init__(self, capacity=MAC_TABLE_CAPACITY, idle_timeout=FLOW_IDLE_TIMEOUT,
+                 max_age=FLOW_HARD_TIMEOUT, clock=time.time):
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.clock = clock
+
+        # mac -> [port, learned_at, last_seen], oldest use first
+        self._entries = OrderedDict()
+
+        self.learned = 0
+        self.moves = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, mac):
+        return self.lookup(mac) is not None
+
+    def _expired(self, entry, now):
+        _, learned_at, last_seen = entry
+        if self.idle_timeout and now - last_seen >= self.idle_timeout:
+            return True
+        if self.max_age and now - learned_at >= self.max_age:
+            return True
+        return False
+
+    def learn(self, mac, port):
+        """
+        Record that `mac` was seen on `port`.
+        Returns (old_port, evicted) where old_port is the previous port if the
+        host moved (else None) and evicted is a list of (mac, port) pushed out
+        to stay within capacity. An aged-out entry not swept yet still counts
+        for old_port: its flow may outlive it.
+        """
+        now = self.clock()
+        entry = self._entries.get(mac)
+        old_port = None
+        if entry is not None:
+            expired = self._expired(entry, now)
+            if entry[0] == port and not expired:
+                entry[2] = now
+                self._entries.move_to_end(mac)
+                return None, []
+            if entry[0] != port:
+                old_port = entry[0]
+                if not expired:
+                    self.moves += 1
+
+        self._entries[mac] = [port, now, now]
+        self._entries.move_to_end(mac)
+        self.learned += 1
+
+        evicted = []
+        while self.capacity and len(self._entries) > self.capacity:
+            old_mac, old_entry = self._entries.popitem(last=False)
+            evicted.append((old_mac, old_entry[0]))
+            self.evictions += 1
+        return old_port, evicted
+
+    def lookup(self, mac):
+        """
+        Return the port for `mac`, or None if unknown or expired.
+        """
+        entry = self._entries.get(mac)
+        if entry is None:
+            return None
+        if self._expired(entry, self.clock()):
+            del self._entries[mac]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(mac)
+        return entry[0]
+
+    def forget(self, mac, port=None):
+        """
+        Drop `mac` (only if it is still on `port`, when given).
+        Returns True if an entry was removed.
+        """
+        entry = self._entries.get(mac)
+        if entry is None or (port is not None and entry[0] != port):
+            return False
+        del self._entries[mac]
+        return True
+
+    def forget_port(self, port):
+        """
+        Drop every host learned on `port`. Returns their MACs.
+        """
+        dead = [mac for mac, e in self._entries.items() if e[0] == port]
+        for mac in dead:
+            del self._entries[mac]
+        return dead
+
+    def expire(self):
+        """
+        Remove every aged-out entry. Returns the list of (mac, port) removed.
+        """
+        now = self.clock()
+        dead = [(mac, e[0]) for mac, e in self._entries.items() if self._expired(e, now)]
+        for mac, _ in dead:
+            del self._entries[mac]
+        self.expirations += len(dead)
+        return dead
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "learned": self.learned,
+            "moves": self.moves,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class HostDirectory(object):
+    """
+    Controller-wide host locations: mac -> (dpid, port).
+    Hosts are only learned on edge ports (ports without a discovered link),
+    so a host is learned once for the whole fabric, not once per switch.
+    When a destination is known, the path to it is installed on every
+    switch along the way in one go.
+    """
+
+    def __init__(self, firewalls):
+        self.firewalls = firewalls  # dpid -> Firewall
+        self.hosts = {}  # mac -> (dpid, port)
+
+        # (dpid, port) -> (dpid2, port2), from openflow.discovery
+        self.link_out = {}
+        self.interswitch_ports = defaultdict(set)
+
+        # Derived from link_out, dropped whenever a link changes
+        self._adj = None
+        self._paths = {}
+
+        # (dpid, port) -> MACs whose installed paths leave through that link
+        self._paths_via = defaultdict(set)
+
+        # Links dropped on PortStatus that discovery still lists; restored if
+        # the port comes back before discovery times them out
+        self._suspended = {}
+
+        self.moves = 0
+        self.paths_installed = 0
+
+        core.call_when_ready(self._attach_discovery, ['openflow_discovery'])
+
+    def _attach_discovery(self):
+        core.openflow_discovery.addListenerByName("LinkEvent", self._handle_LinkEvent)
+        log.info("Host directory attached to openflow.discovery LinkEvent")
+
+    def _handle_LinkEvent(self, event):
+        l = event.link
+        a = (l.dpid1, l.port1)
+        b = (l.dpid2, l.port2)
+
+        if event.added:
+            self.link_out[a] = b
+            self.interswitch_ports[l.dpid1].add(l.port1)
+            # Anything learned on this port was seen in transit, not at home
+            for mac, loc in list(self.hosts.items()):
+                if loc == a:
+                    del self.hosts[mac]
+        elif event.removed:
+            self._suspended.pop(a, None)
+            if self.link_out.get(a) == b:
+                del self.link_out[a]
+            self.interswitch_ports[l.dpid1].discard(l.port1)
+            self._drop_paths_via(a)
+
+        self._adj = None
+        self._paths.clear()
+
+    def _drop_paths_via(self, a):
+        """
+        Delete the installed paths that leave through link end a, on every
+        switch, so their next packet is routed again around the link.
+        """
+        macs = self._paths_via.pop(a, ())
+        for mac in macs:
+            for fw in self.firewalls.values():
+                fw._delete_flow(mac)
+        if macs:
+            log.info("Link dpid=%s port=%s gone, deleted the paths to %d hosts",
+                     a[0], a[1], len(macs))
+
+    def path_installed(self, hops, mac):
+        for hop in hops[:-1]:
+            self._paths_via[hop].add(mac)
+
+    def _forget_link(self, a):
+        b = self.link_out.pop(a, None)
+        self._drop_paths_via(a)
+        if b is not None:
+            self._drop_paths_via(b)
+            self._suspended[a] = b
+            if self.link_out.get(b) == a:
+                del self.link_out[b]
+                self._suspended[b] = a
+        self._adj = None
+        self._paths.clear()
+        return b
+
+    def port_up(self, dpid, port):
+        a = (dpid, port)
+        b = self._suspended.pop(a, None)
+        if b is None:
+            return
+        self.link_out[a] = b
+        if self._suspended.get(b) == a:
+            del self._suspended[b]
+            self.link_out[b] = a
+        self._adj = None
+        self._paths.clear()
+
+    def port_down(self, dpid, port):
+        """
+        (dpid, port) went down: hosts behind it are gone, and so is the link
+        on it, if any. Returns the far end of that link or None.
+        """
+        for mac, loc in list(self.hosts.items()):
+            if loc == (dpid, port):
+                del self.hosts[mac]
+        return self._forget_link((dpid, port))
+
+    def switch_down(self, dpid):
+        for mac, loc in list(self.hosts.items()):
+            if loc[0] == dpid:
+                del self.hosts[mac]
+        for a in list(self._paths_via):
+            if a[0] == dpid or self.link_out.get(a, (None,))[0] == dpid:
+                self._drop_paths_via(a)
+        for links in (self.link_out, self._suspended):
+            for a, b in list(links.items()):
+                if a[0] == dpid or b[0] == dpid:
+                    del links[a]
+        self.interswitch_ports.pop(dpid, None)
+        self._adj = None
+        self._paths.clear()
+
+    def is_edge_port(self, dpid, port):
+        return port not in self.interswitch_ports.get(dpid, ())
+
+    def learn(self, mac, dpid, port):
+        """
+        Record a sighting of `mac` on (dpid, port); ignored on inter-switch ports.
+        If the host was known elsewhere, it moved: flows towards it are removed
+        from every switch.
+        """
+        if not self.is_edge_port(dpid, port):
+            return
+        old = self.hosts.get(mac)
+        if old == (dpid, port):
+            return
+        self.hosts[mac] = (dpid, port)
+        if old is not None:
+            self.moves += 1
+            log.info("Host %s moved from dpid=%s port=%s to dpid=%s port=%s",
+                     mac, old[0], old[1], dpid, port)
+            for fw in self.firewalls.values():
+                fw.mac_to_port.forget(mac)
+                fw._delete_flow(mac)
+
+    def _adjacency(self):
+        """
+        adj[u][v] = u's port towards v, for links seen in both directions.
+        With parallel links the lowest port wins.
+        """
+        if self._adj is None:
+            adj = defaultdict(dict)
+            for (u, up), (v, vp) in self.link_out.items():
+                if self.link_out.get((v, vp)) != (u, up):
+                    continue
+                if v not in adj[u] or up < adj[u][v]:
+                    adj[u][v] = up
+            self._adj = adj
+        return self._adj
+
+    def path(self, src, dst):
+        """
+        Shortest switch path from dpid src to dpid dst as [(dpid, out_port), ...],
+        [] if src == dst, None if unreachable.
+        """
+        key = (src, dst)
+        if key in self._paths:
+            return self._paths[key]
+
+        adj = self._adjacency()
+        parent = {src: None}
+        q = deque([src])
+        while q and dst not in parent:
+            u = q.popleft()
+            for v in sorted(adj.get(u, ())):
+                if v not in parent:
+                    parent[v] = u
+                    q.append(v)
+
+        hops = None
+        if dst in parent:
+            hops = []
+            v = dst
+            while parent[v] is not None:
+                u = parent[v]
+                hops.append((u, adj[u][v]))
+                v = u
+            hops.reverse()
+        self._paths[key] = hops
+        return hops
+
+    def route(self, dpid, mac):
+        """
+        Hops from switch `dpid` to host `mac`, ending with the host port,
+        or None if the host is unknown or unreachable.
+        """
+        loc = self.hosts.get(mac)
+        if loc is None:
+            return None
+        hops = self.path(dpid, loc[0])
+        if hops is None:
+            return None
+        return hops + [loc]
+
 
 class Firewall(object):
     """
@@ -15,79 +379,306 @@ class Firewall(object):
     A Connection object for that switch is passed to the __init__ function.
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, capacity=MAC_TABLE_CAPACITY,
+                 idle_timeout=FLOW_IDLE_TIMEOUT, hard_timeout=FLOW_HARD_TIMEOUT,
+                 match_mode="dst", directory=None):
         # Keep track of the connection to the switch so that we can
         # send it messages!
         self.connection = connection
+        metrics.meter_connection(connection)
 
         # This binds our PacketIn event listener
         connection.addListeners(self)
 
         # extension 1
-        self.mac_to_port = {}
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.match_mode = match_mode
+        self.directory = directory
+        self.mac_to_port = MacTable(capacity, idle_timeout, hard_timeout)
+        self.flows_removed = 0
+
+    def _delete_flow(self, dst_mac):
+        # Keep the switch in sync with the table: no flow for a forgotten host
+        fm = of.ofp_flow_mod()
+        fm.command = of.OFPFC_DELETE
+        fm.match.dl_dst = dst_mac
+        self.connection.send(fm)
+
+    def _install(self, match, out_port):
+        fm = of.ofp_flow_mod()
+        fm.priority = 1000
+        fm.match = match
+        fm.idle_timeout = self.idle_timeout
+        fm.hard_timeout = self.hard_timeout
+        fm.flags = of.OFPFF_SEND_FLOW_REM
+        fm.actions.append(of.ofp_action_output(port=out_port))
+        self.connection.send(fm)
+
+    def _flow_matches(self, event, src, dst, in_port, out_port):
+        """
+        Return [(match, out_port), ...] for the flows to install so that
+        packets like this one from src to dst (and, except in dst mode, its
+        replies) stay in the datapath. Only exact mode parses the packet.
+        """
+        if self.match_mode == "dst":
+            return [(of.ofp_match(dl_dst=dst), out_port)]
+
+        if self.match_mode == "exact":
+            fwd = of.ofp_match.from_packet(event.parsed, in_port)
+            if fwd.dl_type == IP_TYPE:
+                rev = fwd.clone()
+                rev.in_port = out_port
+                rev.dl_src, rev.dl_dst = fwd.dl_dst, fwd.dl_src
+                rev.nw_src, rev.nw_dst = fwd.nw_dst, fwd.nw_src
+                if fwd.nw_proto in (TCP_PROTO, UDP_PROTO):
+                    rev.tp_src, rev.tp_dst = fwd.tp_dst, fwd.tp_src
+                else:
+                    # e.g. ICMP echo request/reply differ in type; don't guess
+                    rev.tp_src = rev.tp_dst = None
+                return [(fwd, out_port), (rev, in_port)]
+            # ARP & co: the reply differs (opcode), so reverse on L2 only
+            rev = of.ofp_match(in_port=out_port, dl_src=dst, dl_dst=src)
+            return [(fwd, out_port), (rev, in_port)]
+
+        fwd = of.ofp_match(in_port=in_port, dl_src=src, dl_dst=dst)
+        rev = of.ofp_match(in_port=out_port, dl_src=dst, dl_dst=src)
+        return [(fwd, out_port), (rev, in_port)]
+
+    def _install_route(self, hops, match):
+        """
+        Install `match` along hops [(dpid, out_port), ...], far end first so
+        the packet never overtakes its own flows. False if a hop is missing.
+        """
+        firewalls = self.directory.firewalls
+        if any(dpid not in firewalls for dpid, _ in hops):
+            return False
+        match = match.clone()
+        match.in_port = None  # in_port differs per hop
+        for dpid, out_port in reversed(hops):
+            firewalls[dpid]._install(match, out_port)
+        self.directory.path_installed(hops, match.dl_dst)
+        self.directory.paths_installed += 1
+        return True
+
+    def _forward_global(self, event, src, dst):
+        """
+        Forward using the controller-wide host directory.
+        Returns False if the destination is not known anywhere yet.
+        """
+        hops = self.directory.route(self.connection.dpid, dst)
+        if not hops:
+            return False
+
+        in_port = event.port
+        matches = self._flow_matches(event, src, dst, in_port, hops[0][1])
+        if not self._install_route(hops, matches[0][0]):
+            return False
 
+        if len(matches) > 1:
+            # l2/exact: set up the way back too, from the destination's switch
+            dst_dpid = hops[-1][0]
+            back = self.directory.route(dst_dpid, src)
+            if back:
+                self._install_route(back, matches[1][0])
+
+        _forwarding.send(self.connection, event.ofp, hops[0][1])
+        return True
+
+    def expire_entries(self):
+        # Table entries only: a flow carrying traffic sends no packet-ins, so
+        # it looks idle from here. The switch times its flows out on its own
+        # (same timeouts) and _handle_FlowRemoved catches up.
+        for mac, port in self.mac_to_port.expire():
+            log.debug("dpid=%s: aged out %s on port %s", self.connection.dpid, mac, port)
+
+    def _handle_FlowRemoved(self, event):
+        """
+        The switch timed out (or deleted) one of our unicast flows.
+        Forget the destination too, so the next packet re-learns it.
+        """
+        if event.deleted:
+            # our own OFPFC_DELETE (host moved or evicted); table already updated
+            return
+        self.flows_removed += 1
+        dst_mac = event.ofp.match.dl_dst
+        if dst_mac is not None:
+            self.mac_to_port.forget(dst_mac)
+
+    def _delete_flows_out(self, port):
+        # Every flow forwarding to `port`, whatever it matches
+        fm = of.ofp_flow_mod()
+        fm.command = of.OFPFC_DELETE
+        fm.out_port = port
+        self.connection.send(fm)
+
+    def _handle_PortStatus(self, event):
+        """
+        React to a port going down now instead of waiting for flows and
+        table entries to time out.
+        """
+        desc = event.ofp.desc
+        port = event.port
+        if not (event.deleted or desc.config & of.OFPPC_PORT_DOWN
+                or desc.state & of.OFPPS_LINK_DOWN):
+            if self.directory is not None:
+                self.directory.port_up(self.connection.dpid, port)
+            return
+        gone = self.mac_to_port.forget_port(port)
+        self._delete_flows_out(port)
+        log.info("dpid=%s: port %s down, forgot %d hosts", self.connection.dpid, port, len(gone))
+
+        if self.directory is not None:
+            peer = self.directory.port_down(self.connection.dpid, port)
+            if peer is not None:
+                # Paths through this link are dead from both ends
+                fw = self.directory.firewalls.get(peer[0])
+                if fw is not None:
+                    fw._delete_flows_out(peer[1])
+
+    def _handle_ConnectionDown(self, event):
+        if _tables.get(self.connection.dpid) is self:
+            del _tables[self.connection.dpid]
+            if self.directory is not None:
+                self.directory.switch_down(self.connection.dpid)
+
+    @metrics.timed_packet_in("a1ext1")
     def _handle_PacketIn(self, event):
         """
         Packets not handled by the router rules will be
         forwarded to this method to be handled by the controller
         """
 
-        packet = event.parsed  # This is the parsed packet data.
-        if not packet.parsed:
+        packet_in = event.ofp  # The actual ofp_packet_in message.
+        # Only the MACs and the ethertype are needed here, so skip the full
+        # parse (event.parsed) unless exact-match flows or a trace want it
+        headers = Headers(packet_in.data)
+        if not headers.complete:
             log.warning("Ignoring incomplete packet")
             return
-
-        packet_in = event.ofp  # The actual ofp_packet_in message.
-        print("Unhandled packet :" + str(packet.dump()))
+        tracer.trace("packet", describe_packet_in, event)
 
         # extension 1
-        src_mac = packet.src
-        dst_mac = packet.dst
+        src_mac = EthAddr(headers.dl_src)
+        dst_mac = EthAddr(headers.dl_dst)
         in_port = event.port
 
         # backwards learning
-        self.mac_to_port[src_mac] = in_port
-
-        if dst_mac in self.mac_to_port:
-            out_port = self.mac_to_port[dst_mac]
-
-            fm = of.ofp_flow_mod()
-            fm.priority = 1000
-            fm.match.dl_dst = dst_mac
-            fm.actions.append(of.ofp_action_output(port=out_port))
-            self.connection.send(fm)
-
-            msg = of.ofp_packet_out()
-            msg.in_port = in_port
-            msg.actions.append(of.ofp_action_output(port=out_port))
-            if packet_in.buffer_id is not None and packet_in.buffer_id != -1:
-                msg.buffer_id = packet_in.buffer_id
-            else:
-                msg.data = packet_in.data
-            self.connection.send(msg)
-            print((f"Installed flow for {dst_mac} -> port {out_port}"))
+        old_port, evicted = self.mac_to_port.learn(src_mac, in_port)
+        if old_port is not None:
+            # host moved: the flow towards it points at the wrong port now
+            self._delete_flow(src_mac)
+        for mac, _ in evicted:
+            self._delete_flow(mac)
+
+        if self.directory is not None:
+            if headers.dl_type == LLDP_TYPE:
+                return  # openflow.discovery's, never flood it
+            self.directory.learn(src_mac, self.connection.dpid, in_port)
+            if self._forward_global(event, src_mac, dst_mac):
+                metrics.decision("a1ext1", self.connection.dpid, "path")
+                tracer.trace("forward", "Installed path for %s", dst_mac)
+                return
+
+        out_port = self.mac_to_port.lookup(dst_mac)
+        if out_port is not None:
+            for match, port in self._flow_matches(event, src_mac, dst_mac, in_port, out_port):
+                self._install(match, port)
+
+            _forwarding.send(self.connection, packet_in, out_port)
+            metrics.decision("a1ext1", self.connection.dpid, "unicast")
+            tracer.trace("forward", "Installed flow for %s -> port %s", dst_mac, out_port)
         else:
-            out_port = of.OFPP_FLOOD
-            msg = of.ofp_packet_out()
+            _forwarding.send(self.connection, packet_in, of.OFPP_FLOOD)
+            metrics.decision("a1ext1", self.connection.dpid, "flood")
+            tracer.trace("forward", "Flooding packet for %s", dst_mac)
+
+
+# dpid -> Firewall, so we can age tables and report on them
+_tables = {}
+
+# resends packet-ins by buffer_id where possible, for all switches
+_forwarding = Forwarder()
 
-            if packet_in.buffer_id is not None and packet_in.buffer_id != -1:
-                msg.buffer_id = packet_in.buffer_id
-            else:
-                msg.data = packet_in.data
 
-            msg.in_port = in_port
-            msg.actions.append(of.ofp_action_output(port=out_port))
-            self.connection.send(msg)
-            print(f"Flooding packet for {dst_mac}")
+def _expire_tables():
+    for fw in list(_tables.values()):
+        fw.expire_entries()
 
 
-def launch():
+def _log_stats():
+    for dpid, fw in sorted(_tables.items()):
+        stats = fw.mac_to_port.stats()
+        stats["flows_removed"] = fw.flows_removed
+        log.info("dpid=%s mac table: %s", dpid,
+                 " ".join("%s=%s" % kv for kv in sorted(stats.items())))
+    if core.hasComponent("host_directory"):
+        d = core.host_directory
+        log.info("host directory: hosts=%s moves=%s paths_installed=%s",
+                 len(d.hosts), d.moves, d.paths_installed)
+    log.info("packet-outs: %s", " ".join("%s=%s" % kv for kv in sorted(_forwarding.stats().items())))
+
+
+def _register_metrics():
+    # Read when /metrics is scraped (see cse561.metrics)
+    metrics.stats_collector(
+        "cse561_a1ext1_mac_table", "a1ext1 MAC table (mac_to_port) size and counters",
+        ("dpid",), lambda: dict((dpid, fw.mac_to_port.stats()) for dpid, fw in list(_tables.items())))
+    metrics.stats_collector(
+        "cse561_a1ext1_packet_outs_total", "a1ext1 packet-out buffering counters", (),
+        lambda: {(): _forwarding.stats()}, kind="counter")
+    if core.hasComponent("host_directory"):
+        d = core.host_directory
+        metrics.registry.collect(
+            "cse561_a1ext1_hosts", "Hosts in the fabric-wide host directory", (),
+            lambda: {(): len(d.hosts)})
+
+
+def launch(capacity=MAC_TABLE_CAPACITY, idle_timeout=FLOW_IDLE_TIMEOUT,
+           hard_timeout=FLOW_HARD_TIMEOUT, match="dst", global_hosts=False,
+           stats_interval=0, miss_send_len=None, expire_interval=EXPIRE_INTERVAL):
     """
     Starts the component
+
+    --capacity=N         max MAC entries per switch (LRU eviction)
+    --idle_timeout=S     idle timeout for installed flows and MAC entries
+    --hard_timeout=S     hard timeout for installed flows and MAC entries
+    --match=MODE         dst (default), l2 or exact; l2/exact install both directions
+    --global_hosts       learn hosts once for the whole fabric (needs openflow.discovery)
+                         and install the full path when the destination is known
+    --stats_interval=S   log table occupancy/eviction counters every S seconds
+    --expire_interval=S  sweep aged-out MAC entries every S seconds (flows age on the switch)
+    --miss_send_len=N    switches send at most N bytes of a table-miss packet
+                         and buffer the rest
     """
+    capacity = int(capacity)
+    idle_timeout = int(idle_timeout)
+    hard_timeout = int(hard_timeout)
+    stats_interval = float(stats_interval)
+    global_hosts = str(global_hosts).lower() != "false"
+    expire_interval = float(expire_interval)
+    if match not in MATCH_MODES:
+        raise RuntimeError("--match must be one of %s" % (", ".join(MATCH_MODES),))
+    set_miss_send_len(miss_send_len)
+
+    directory = None
+    if global_hosts:
+        if not core.hasComponent('openflow_discovery'):
+            import pox.openflow.discovery as discovery
+            discovery.launch()
+            log.info("Launched openflow.discovery automatically")
+        directory = HostDirectory(_tables)
+        core.register("host_directory", directory)
 
     def start_switch(event):
         log.debug("Controlling %s" % (event.connection,))
-        Firewall(event.connection)
+        _tables[event.dpid] = Firewall(event.connection, capacity, idle_timeout,
+                                     hard_timeout, match, directory)
 
     core.openflow.addListenerByName("ConnectionUp", start_switch)
+    _register_metrics()
+
+    if expire_interval > 0 and (idle_timeout or hard_timeout):
+        Timer(expire_interval, _expire_tables, recurring=True)
+    if stats_interval > 0:
+        Timer(stats_interval, _log_stats, recurring=True)
@@ -5,8 +5,19 @@
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
 
-from collections import defaultdict, deque
+from cse561 import metrics
+from cse561.flowsync import FlowReconciler, keep_flows_on_connect
+from cse561.forwarding import Forwarder, set_miss_send_len
+from cse561.headers import ETH_TYPE_LLDP, Headers
+from cse561.offload import offloader
+
+from collections import Counter, OrderedDict, defaultdict, deque
+import struct
+import time
+import zlib
 
 log = core.getLogger()
 
@@ -14,17 +25,85 @@ log = core.getLogger()
 STP_DROP_PRIORITY = 10000
 STP_DROP_COOKIE_BASE = 0x53545000  # 'STP\0' style marker (low 32 bits used)
 
+# Flooding modes:
+#   controller - every broadcast/unknown frame comes to us and we send a
+#                packet_out listing the allowed ports (original behaviour)
+#   datapath   - non-tree ports get OFPPC_NO_FLOOD and the switch floods
+#                broadcast and ARP frames itself with OFPP_FLOOD
+FLOOD_MODES = ("controller", "datapath")
+FLOOD_PRIORITY = 5000  # below the STP drop rules
+FLOOD_COOKIE = (STP_DROP_COOKIE_BASE << 32) | 0xf100d
+ARP_TYPE = 0x0806
+ETHER_BROADCAST = "ff:ff:ff:ff:ff:ff"
+
+# Multipath mode: unicast to known hosts is routed over all shortest paths
+# (parallel links included) instead of the tree, hashing each flow onto
+# one of them. Only broadcasts stay confined to the tree.
+MULTIPATH_PRIORITY = 2000
+MULTIPATH_COOKIE = (STP_DROP_COOKIE_BASE << 32) | 0xecb0
+MULTIPATH_IDLE_TIMEOUT = 10
+MULTIPATH_HARD_TIMEOUT = 60
+
+# Elephant flows (--te): routed flows at least ELEPHANT_RATE bytes/s fast
+# at their ingress switch are moved to less loaded paths, checked every
+# TE_INTERVAL seconds. Candidate paths may be up to TE_SLACK hops longer
+# than the shortest; a move must cut the busiest link's load on the flow's
+# path by TE_MIN_GAIN. At most TE_MAX_MOVES moves per round and one per
+# flow per TE_COOLDOWN seconds keep flows from flapping (and reordering).
+ELEPHANT_RATE = 1000000  # bytes/s
+TE_INTERVAL = 2.0
+TE_SLACK = 1
+TE_MAX_PATHS = 16
+TE_MIN_GAIN = 0.1
+TE_MAX_MOVES = 2
+TE_COOLDOWN = 10.0
+TE_DRAIN = 1.0  # seconds before entries left only on the old path go
+IP_TYPE = 0x0800
+
+# ofp_header + ofp_packet_out fields (buffer_id, in_port, actions_len),
+# used to build flood packet_outs from pre-packed action lists
+OFP_PACKET_OUT = struct.Struct("!BBHLLHH")
+
+# resends packet-ins by buffer_id where possible, for all switches
+_forwarding = Forwarder()
+
+# Time from the first link event of a batch to the update being pushed
+_CONVERGENCE = metrics.registry.histogram(
+    "cse561_a1ext2_convergence_seconds", "Link event batch convergence time", (),
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+# Link events are applied in batches: once no new event has arrived for
+# LINK_SETTLE seconds, or LINK_MAX_DELAY seconds after the first one.
+LINK_SETTLE = 0.2
+LINK_MAX_DELAY = 1.0
 
-def _is_lldp(pkt):
+
+def _is_lldp(headers):
     """
     Return True if this is an LLDP packet (used by openflow.discovery).
     We must NOT flood LLDP or we'll confuse discovery/topology.
     """
-    try:
-        # POX packet has .find() helper
-        return pkt.find('lldp') is not None
-    except Exception:
-        return False
+    return headers.dl_type == ETH_TYPE_LLDP
+
+
+def _multipath_flow_mod(match, out_port, command=of.OFPFC_ADD):
+    fm = of.ofp_flow_mod()
+    fm.command = command
+    fm.match = match
+    fm.priority = MULTIPATH_PRIORITY
+    fm.idle_timeout = MULTIPATH_IDLE_TIMEOUT
+    fm.hard_timeout = MULTIPATH_HARD_TIMEOUT
+    fm.cookie = MULTIPATH_COOKIE
+    fm.actions.append(of.ofp_action_output(port=out_port))
+    return fm
+
+
+def _flood_rules():
+    """
+    (cookie, match) of the datapath flood rules: broadcast and ARP.
+    """
+    return [(FLOOD_COOKIE, of.ofp_match(dl_dst=EthAddr(ETHER_BROADCAST))),
+            (FLOOD_COOKIE + 1, of.ofp_match(dl_type=ARP_TYPE))]
 
 
 class Switch(object):
@@ -33,6 +112,12 @@ class Switch(object):
     We do:
     - Install/remove drop rules on blocked inter-switch ports
     - For PacketIn: flood only to allowed ports (excluding in_port)
+    - In datapath flood mode: keep OFPPC_NO_FLOOD on blocked ports and the
+      broadcast/ARP flood rules installed while the tree is stable
+    Flood actions are packed once per in_port and reused until the ports,
+    the blocked set or the flood mode change.
+    With reconcile, a (re)connecting switch's drop/flood rules and NO_FLOOD
+    bits are checked against what we want instead of assumed to be empty.
     """
 
     def __init__(self, connection, controller):
@@ -41,6 +126,9 @@ class Switch(object):
         self.ctrl = controller
         self.blocked_ports = set()
         self.stable_tree = False
+        self.datapath_flood = False
+        self._flood_cache = {}  # in_port -> packed ofp_action_output list
+        metrics.meter_connection(connection)
         connection.addListeners(self)
         log.info("Switch connected dpid=%s", self.dpid)
 
@@ -48,6 +136,12 @@ class Switch(object):
         # Cookie used to identify our own drop rules
         return (STP_DROP_COOKIE_BASE << 32) | (port_no & 0xffffffff)
 
+    def _drop_match(self, port_no):
+        if self.ctrl.multipath:
+            # Routed unicast may use non-tree links; only keep broadcasts off them
+            return of.ofp_match(in_port=port_no, dl_dst=EthAddr(ETHER_BROADCAST))
+        return of.ofp_match(in_port=port_no)
+
     def apply_blocked_ports(self, new_blocked_ports):
         """
         Update drop rules so that ports in new_blocked_ports are blocked (drop),
@@ -61,33 +155,151 @@ class Switch(object):
         for port in sorted(to_del):
             fm = of.ofp_flow_mod()
             fm.command = of.OFPFC_DELETE
-            fm.match = of.ofp_match(in_port=port)
+            fm.match = self._drop_match(port)
             # Best-effort: restrict by cookie if supported by your OF1.0 impl.
             # POX supports cookie_mask fields in ofp_flow_mod.
             fm.cookie = self._drop_cookie(port)
             fm.cookie_mask = 0xffffffffffffffff
             self.connection.send(fm)
+            self._set_no_flood(port, False)
             log.info("dpid=%s: UNBLOCK port=%s", self.dpid, port)
 
         # Add new drop rules
         for port in sorted(to_add):
             fm = of.ofp_flow_mod()
             fm.priority = STP_DROP_PRIORITY
-            fm.match = of.ofp_match(in_port=port)
+            fm.match = self._drop_match(port)
             fm.cookie = self._drop_cookie(port)
             # No actions => drop
             self.connection.send(fm)
+            self._set_no_flood(port, True)
             log.info("dpid=%s: BLOCK port=%s (not on spanning tree)", self.dpid, port)
 
         self.blocked_ports = new_blocked_ports
+        if to_add or to_del:
+            self._flood_cache.clear()
+
+    def _flood_actions(self, in_port):
+        """
+        Packed output actions for flooding a frame that came in on in_port.
+        """
+        actions = self._flood_cache.get(in_port)
+        if actions is None:
+            if self.ctrl.flood == "datapath":
+                # Blocked ports are NO_FLOOD, so the switch can pick the ports
+                ports = [of.OFPP_FLOOD]
+            else:
+                # Flood only on allowed ports (tree ports + host-facing ports),
+                # skipping special/non-physical ports and in_port
+                ports = sorted(p for p in self.ctrl.get_allowed_ports(self.dpid)
+                               if p < of.OFPP_MAX and p != in_port)
+            actions = b"".join(of.ofp_action_output(port=p).pack() for p in ports)
+            self._flood_cache[in_port] = actions
+        return actions
+
+    def _handle_PortStatus(self, event):
+        self._flood_cache.clear()
+        desc = event.ofp.desc
+        if (event.deleted or desc.config & of.OFPPC_PORT_DOWN
+                or desc.state & of.OFPPS_LINK_DOWN):
+            self.ctrl.port_down(self.dpid, event.port)
+        else:
+            self.ctrl.port_up(self.dpid, event.port)
 
+    def _handle_FlowRemoved(self, event):
+        # Flows we deleted ourselves were already accounted for
+        if self.ctrl.multipath and event.ofp.cookie == MULTIPATH_COOKIE and not event.deleted:
+            self.ctrl.flow_removed(event.ofp)
+
+    def _handle_ConnectionDown(self, event):
+        self._flood_cache.clear()
+
+    def _set_no_flood(self, port_no, no_flood):
+        """
+        Datapath flood mode: keep OFPP_FLOOD off blocked ports.
+        """
+        if self.ctrl.flood != "datapath":
+            return
+        self._port_mod_no_flood(port_no, no_flood)
+
+    def _port_mod_no_flood(self, port_no, no_flood):
+        port = self.connection.ports.get(port_no)
+        if port is None:
+            return
+        pm = of.ofp_port_mod()
+        pm.port_no = port_no
+        pm.hw_addr = port.hw_addr
+        pm.config = of.OFPPC_NO_FLOOD if no_flood else 0
+        pm.mask = of.OFPPC_NO_FLOOD
+        self.connection.send(pm)
+
+    def set_datapath_flood(self, enabled):
+        """
+        Install (or remove) the rules that let the switch flood broadcast and
+        ARP frames on its own. Only safe once non-tree ports are NO_FLOOD.
+        """
+        if enabled == self.datapath_flood:
+            return
+        self.datapath_flood = enabled
+        for cookie, match in _flood_rules():
+            fm = of.ofp_flow_mod()
+            fm.match = match
+            fm.priority = FLOOD_PRIORITY
+            fm.cookie = cookie
+            if enabled:
+                fm.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
+            else:
+                fm.command = of.OFPFC_DELETE_STRICT
+            self.connection.send(fm)
+        log.info("dpid=%s: datapath flooding %s", self.dpid, "on" if enabled else "off")
+
+    def _desired_flows(self):
+        """
+        The flow_mods apply_blocked_ports/set_datapath_flood would have
+        installed for the current state.
+        """
+        flows = []
+        for port in sorted(self.blocked_ports):
+            fm = of.ofp_flow_mod()
+            fm.priority = STP_DROP_PRIORITY
+            fm.match = self._drop_match(port)
+            fm.cookie = self._drop_cookie(port)
+            flows.append(fm)
+        if self.datapath_flood:
+            for cookie, match in _flood_rules():
+                fm = of.ofp_flow_mod()
+                fm.match = match
+                fm.priority = FLOOD_PRIORITY
+                fm.cookie = cookie
+                fm.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
+                flows.append(fm)
+        return flows
+
+    def reconcile(self):
+        """
+        Sync the switch with our view after a (re)connect: stale drop rules
+        and routed flows from a previous controller go, missing rules are
+        added, and NO_FLOOD is fixed on ports where it is wrong.
+        """
+        for port_no, port in self.connection.ports.items():
+            if port_no >= of.OFPP_MAX:
+                continue
+            want = self.ctrl.flood == "datapath" and port_no in self.blocked_ports
+            if bool(port.config & of.OFPPC_NO_FLOOD) != want:
+                self._port_mod_no_flood(port_no, want)
+        FlowReconciler(self.connection, STP_DROP_COOKIE_BASE << 32,
+                       self._desired_flows).start()
+
+    @metrics.timed_packet_in("a1ext2")
     def _handle_PacketIn(self, event):
-        pkt = event.parsed
-        if not pkt.parsed:
+        # Flooding needs only the ethertype; the full parse (event.parsed)
+        # is left to the multipath flows
+        headers = Headers(event.ofp.data)
+        if not headers.complete:
             return
 
         # Ignore LLDP frames (discovery)
-        if _is_lldp(pkt):
+        if _is_lldp(headers):
             return
 
         in_port = event.port
@@ -96,38 +308,249 @@ class Switch(object):
         if in_port in self.blocked_ports:
             return
 
-        # Flood only on allowed ports (tree ports + host-facing ports)
-        allowed_ports = self.ctrl.get_allowed_ports(self.dpid)
+        if self.ctrl.multipath:
+            self.ctrl.learn_host(EthAddr(headers.dl_src), self.dpid, in_port)
+            if not headers.is_multicast and self.ctrl.route(self, event, event.parsed):
+                metrics.decision("a1ext2", self.dpid, "route")
+                return
+
+        resend = _forwarding.buffer_or_data(event.ofp)
+        if resend is None:
+            return
+        buffer_id, data = resend
+
+        actions = self._flood_actions(in_port)
+        header = OFP_PACKET_OUT.pack(of.OFP_VERSION, of.OFPT_PACKET_OUT,
+                                     OFP_PACKET_OUT.size + len(actions) + len(data),
+                                     of.generate_xid(), buffer_id, in_port, len(actions))
+        self.connection.send(header + actions + data)
+        metrics.decision("a1ext2", self.dpid, "flood")
+
+
+class SpanningTree(object):
+    """
+    Incrementally maintained spanning forest over the inter-switch links.
+    - adj[u] = {u_port: (v, v_port)} for links seen in both directions
+    - parent[u] = (p, u_port, p_port) or None for a root
+    Adding or removing a link only touches the switches at its ends, plus
+    (when a tree link goes away) the subtree that got cut off while we look
+    for a replacement link. Every method returns the set of dpids whose
+    tree ports may have changed, so only those switches need updates.
+    """
+
+    def __init__(self):
+        self.adj = defaultdict(dict)
+        self.parent = {}
+        self.children = defaultdict(set)
+
+    def copy(self):
+        t = SpanningTree()
+        for u, ports in self.adj.items():
+            t.adj[u] = dict(ports)
+        t.parent = dict(self.parent)
+        for u, kids in self.children.items():
+            t.children[u] = set(kids)
+        return t
+
+    def __len__(self):
+        # number of links
+        return sum(len(ports) for ports in self.adj.values()) // 2
+
+    def has_link(self, u, u_port):
+        return u_port in self.adj.get(u, ())
+
+    def root(self, u):
+        while self.parent.get(u) is not None:
+            u = self.parent[u][0]
+        return u
+
+    def tree_ports(self, u):
+        """
+        Inter-switch ports of u that are on the tree.
+        """
+        ports = set()
+        up = self.parent.get(u)
+        if up is not None:
+            ports.add(up[1])
+        for c in self.children.get(u, ()):
+            ports.add(self.parent[c][2])
+        return ports
+
+    def _subtree(self, u):
+        nodes = set()
+        stack = [u]
+        while stack:
+            x = stack.pop()
+            nodes.add(x)
+            stack.extend(self.children.get(x, ()))
+        return nodes
+
+    def _evert(self, x):
+        """
+        Make x the root of its tree by reversing the parent links between x
+        and the old root. The set of tree links doesn't change.
+        """
+        new_parent = None
+        node = x
+        while True:
+            old = self.parent.get(node)
+            self.parent[node] = new_parent
+            if new_parent is not None:
+                self.children[new_parent[0]].add(node)
+            if old is None:
+                return
+            p, node_port, p_port = old
+            self.children[p].discard(node)
+            new_parent = (node, p_port, node_port)
+            node = p
+
+    def _attach(self, child, child_port, parent, parent_port):
+        self.parent[child] = (parent, child_port, parent_port)
+        self.children[parent].add(child)
+
+    def add_link(self, u, u_port, v, v_port):
+        if self.has_link(u, u_port):
+            return set()
+        self.adj[u][u_port] = (v, v_port)
+        self.adj[v][v_port] = (u, u_port)
+        self.parent.setdefault(u, None)
+        self.parent.setdefault(v, None)
+
+        ru, rv = self.root(u), self.root(v)
+        if ru != rv:
+            # Join two trees; the one with the lower root dpid keeps its root
+            if ru < rv:
+                self._evert(v)
+                self._attach(v, v_port, u, u_port)
+            else:
+                self._evert(u)
+                self._attach(u, u_port, v, v_port)
+        # Otherwise it closes a loop: a non-tree link, blocked on both ends
+        return set([u, v])
 
-        msg = of.ofp_packet_out()
-        msg.in_port = in_port
+    def remove_link(self, u, u_port):
+        if not self.has_link(u, u_port):
+            return set()
+        v, v_port = self.adj[u].pop(u_port)
+        self.adj[v].pop(v_port, None)
+        changed = set([u, v])
 
-        if event.ofp.buffer_id is not None and event.ofp.buffer_id != -1:
-            msg.buffer_id = event.ofp.buffer_id
+        if self.parent.get(u) == (v, u_port, v_port):
+            child, top = u, v
+        elif self.parent.get(v) == (u, v_port, u_port):
+            child, top = v, u
         else:
-            msg.data = event.ofp.data
+            # a non-tree link: the tree is untouched
+            self._forget_isolated(u, v)
+            return changed
 
-        for port_no in sorted(allowed_ports):
-            # Skip special/non-physical ports
-            if port_no >= of.OFPP_MAX:
-                continue
-            if port_no == in_port:
-                continue
-            msg.actions.append(of.ofp_action_output(port=port_no))
+        # Cut the subtree under `child` loose and look for another link
+        # from it to the rest of the tree (lowest dpid/port first)
+        self.parent[child] = None
+        self.children[top].discard(child)
+        cut = self._subtree(child)
+        for x in sorted(cut):
+            for x_port, (y, y_port) in sorted(self.adj.get(x, {}).items()):
+                if y not in cut:
+                    self._evert(x)
+                    self._attach(x, x_port, y, y_port)
+                    changed.update((x, y))
+                    self._forget_isolated(u, v)
+                    return changed
+
+        # No way back: the subtree becomes its own tree, rooted at its lowest dpid
+        self._evert(min(cut))
+        self._forget_isolated(u, v)
+        return changed
+
+    def _forget_isolated(self, *nodes):
+        for u in nodes:
+            if not self.adj.get(u) and self.parent.get(u) is None and not self.children.get(u):
+                self.adj.pop(u, None)
+                self.parent.pop(u, None)
+                self.children.pop(u, None)
+
+
+def _bfs_distances(adj, dst):
+    """
+    Hop count from every switch to dst; adj is SpanningTree.adj.
+    """
+    dist = {dst: 0}
+    q = deque([dst])
+    while q:
+        u = q.popleft()
+        for v, _ in adj.get(u, {}).values():
+            if v not in dist:
+                dist[v] = dist[u] + 1
+                q.append(v)
+    return dist
 
-        self.connection.send(msg)
+
+def _compute_distances(adj, dsts):
+    return dict((dst, _bfs_distances(adj, dst)) for dst in dsts)
+
+
+def _compute_backups(tree, interswitch_ports, dpids):
+    """
+    For every tree link, work out the tree we'd fall back to if it failed
+    and the blocked ports of the switches that change, so a link-down only
+    has to send them: {(dpid, port): {dpid: blocked ports}} for both ends.
+    Runs on a worker, on copies of the controller's state.
+    """
+    backups = {}
+    for u, up in list(tree.parent.items()):
+        if up is None:
+            continue
+        p, u_port, p_port = up
+        alt = tree.copy()
+        changed = alt.remove_link(u, u_port)
+        if len(alt) == 0:
+            # same rule as _apply: no tree, nothing blocked
+            plan = dict((dpid, set()) for dpid in dpids)
+        else:
+            plan = dict((dpid, interswitch_ports.get(dpid, set()) - alt.tree_ports(dpid))
+                        for dpid in changed)
+        backups[(u, u_port)] = plan
+        backups[(p, p_port)] = plan
+    return backups
 
 
 class SpanningTreeController(object):
     """
     Global controller:
     - Track switches and discovery links
-    - Compute spanning tree
-    - Push per-switch blocked ports updates
+    - Maintain the spanning tree incrementally as links come and go
+    - Push blocked ports updates to the switches whose tree ports changed
     """
 
-    def __init__(self):
+    def __init__(self, settle=LINK_SETTLE, max_delay=LINK_MAX_DELAY, flood="controller",
+                 multipath=False, reconcile=False):
         self.switches = {}  # dpid -> Switch instance
+        self.flood = flood
+        self.multipath = multipath
+        self.te = None  # ElephantMover, with --te
+        self.reconcile = reconcile
+
+        # Multipath state: host locations, BFS distances to each switch
+        # (dropped whenever links change), and the links each routed flow uses
+        self.hosts = {}  # mac -> (dpid, port)
+        self._distances = {}  # dst dpid -> {dpid: hops}
+        self.flow_paths = {}  # flow key -> [(dpid, out_port), ...]
+        self.flow_matches = {}  # flow key -> ofp_match installed for it
+        self.flows_by_hop = defaultdict(set)  # (dpid, out_port) -> flow keys
+        self.link_flows = Counter()  # (dpid, out_port) -> active routed flows
+        self.link_bytes = Counter()  # (dpid, out_port) -> bytes of finished flows
+
+        # Backup plans: for each tree link end (dpid, port), the blocked ports
+        # of every switch that changes if that link fails
+        self._backups = {}
+        self.failovers = 0
+        self.last_failover = 0.0
+
+        # Links we took down on PortStatus while discovery still lists them:
+        # (dpid, port) -> (dpid2, port2). Discovery won't report them again
+        # if the port comes back before its timeout, so we restore them.
+        self._suspended = {}
 
         # Link map from discovery:
         # (dpid, port) -> (dpid2, port2)
@@ -136,10 +559,26 @@ class SpanningTreeController(object):
         # For each switch, the set of inter-switch ports we know about
         self.interswitch_ports = defaultdict(set)
 
-        # For each switch, the set of ports that are ON the spanning tree (interswitch only)
-        self.tree_ports = defaultdict(set)
+        # Spanning tree over links known in both directions, updated per link
+        self.tree = SpanningTree()
+        self.stable_tree = False
+
+        # Pending link events: (dpid, port) pair -> added?, last event wins
+        self.settle = settle
+        self.max_delay = max_delay
+        self._pending = OrderedDict()
+        self._first_event = None
+        self._last_event = None
+
+        # Batching metrics
+        self.link_events = 0
+        self.link_batches = 0
+        self.last_batch_size = 0
+        self.last_convergence = 0.0
+        self.max_convergence = 0.0
 
         core.openflow.addListenerByName("ConnectionUp", self._handle_ConnectionUp)
+        core.openflow.addListenerByName("ConnectionDown", self._handle_ConnectionDown)
 
         # Listen to discovery LinkEvent when the component is ready
         core.call_when_ready(self._attach_discovery, ['openflow_discovery'])
@@ -152,116 +591,429 @@ class SpanningTreeController(object):
         sw = Switch(event.connection, self)
         self.switches[event.dpid] = sw
 
-        # After a new switch connects, recompute tree and apply rules
-        self._recompute_and_apply()
+        # Only the new switch needs its blocked ports pushed
+        self._apply([event.dpid])
+        if self.reconcile:
+            # It may still hold rules from before a controller restart
+            sw.reconcile()
+
+    def _handle_ConnectionDown(self, event):
+        """
+        A switch went away: forget it, its links and its hosts now rather
+        than when discovery times its links out.
+        """
+        dpid = event.dpid
+        sw = self.switches.get(dpid)
+        if sw is None or sw.connection is not event.connection:
+            return  # already replaced by a newer connection
+        del self.switches[dpid]
+
+        changed = set()
+        for a, b in list(self.link_out.items()):
+            if a[0] == dpid or b[0] == dpid:
+                self._pending.pop((a, b), None)
+                changed |= self._update_link(a, b, False)
+        for a, b in list(self._suspended.items()):
+            if a[0] == dpid or b[0] == dpid:
+                del self._suspended[a]
+        self.interswitch_ports.pop(dpid, None)
+        for mac, loc in list(self.hosts.items()):
+            if loc[0] == dpid:
+                del self.hosts[mac]
+        self._invalidate_flows(set(key for hop, keys in self.flows_by_hop.items()
+                                   if hop[0] == dpid for key in keys))
+
+        self._distances.clear()
+        changed.discard(dpid)
+        self._apply(changed)
+        self._precompute()
+        log.info("Switch dpid=%s disconnected, pruned its links and hosts", dpid)
 
     def _handle_LinkEvent(self, event):
         """
         Discovery reports a directed link with ports:
           event.link.dpid1, event.link.port1  -> event.link.dpid2, event.link.port2
+        Events are queued and applied together once discovery settles down.
         """
         l = event.link
-        a = (l.dpid1, l.port1)
-        b = (l.dpid2, l.port2)
+        key = ((l.dpid1, l.port1), (l.dpid2, l.port2))
+        self._pending.pop(key, None)
+        self._pending[key] = event.added
+        self.link_events += 1
+
+        now = time.time()
+        self._last_event = now
+        if self.settle <= 0:
+            self._flush_link_events()
+        elif self._first_event is None:
+            self._first_event = now
+            Timer(self.settle, self._check_settled)
+
+    def _check_settled(self):
+        if self._first_event is None:
+            return
+        now = time.time()
+        quiet_until = self._last_event + self.settle
+        deadline = self._first_event + self.max_delay
+        if now >= quiet_until or now >= deadline:
+            self._flush_link_events()
+        else:
+            Timer(min(quiet_until, deadline) - now, self._check_settled)
+
+    def _flush_link_events(self):
+        """
+        Apply every queued link change, then push one round of updates.
+        """
+        pending, self._pending = self._pending, OrderedDict()
+        first = self._first_event if self._first_event is not None else time.time()
+        self._first_event = None
+
+        changed = set()
+        for (a, b), added in pending.items():
+            changed |= self._update_link(a, b, added)
+        self._distances.clear()
+        self._apply(changed)
+        self._precompute()
 
-        if event.added:
+        self.link_batches += 1
+        self.last_batch_size = len(pending)
+        self.last_convergence = time.time() - first
+        self.max_convergence = max(self.max_convergence, self.last_convergence)
+        _CONVERGENCE.observe((), self.last_convergence)
+        log.info("Applied %d link changes in one update, %.1f ms after the first "
+                 "(%d events in %d batches so far)", len(pending),
+                 self.last_convergence * 1000, self.link_events, self.link_batches)
+
+    def _update_link(self, a, b, added):
+        """
+        Record one directed link a -> b coming or going.
+        Returns the dpids whose blocked ports may have changed.
+        """
+        changed = set()
+        if added:
             self.link_out[a] = b
-            # Mark both endpoints as inter-switch ports
-            self.interswitch_ports[l.dpid1].add(l.port1)
-            self.interswitch_ports[l.dpid2].add(l.port2)
-        elif event.removed:
+            # Mark both endpoints as inter-switch ports; whatever was learned
+            # on them before discovery saw the link was not a host
+            for end in (a, b):
+                if end[1] not in self.interswitch_ports[end[0]]:
+                    self.interswitch_ports[end[0]].add(end[1])
+                    self._forget_hosts_at(end)
+            changed.update((a[0], b[0]))
+            # Only add edge when both directions are known (more stable)
+            if self.link_out.get(b) == a:
+                changed |= self.tree.add_link(a[0], a[1], b[0], b[1])
+        else:
+            self._suspended.pop(a, None)
             # Remove directed mapping if exists
             if a in self.link_out and self.link_out[a] == b:
                 del self.link_out[a]
             # Keep interswitch_ports as "known" (optional); it’s safe either way.
             # If you want strict behavior, you can also remove ports here.
+            if self.tree.adj.get(a[0], {}).get(a[1]) == b:
+                changed |= self.tree.remove_link(a[0], a[1])
+        return changed
 
-        self._recompute_and_apply()
-
-    def _build_undirected_edges(self):
+    def _apply(self, dpids):
         """
-        Convert directed link map into undirected edges with port numbers on both sides.
-        Returns a dict:
-          adj[u] = list of (v, u_port, v_port)
-        For parallel links, we keep them as distinct edges, but BFS will deterministically pick
-        the lowest (u_port, v_port) when exploring neighbors.
+        Push blocked-port updates to the given switches only.
         """
-        adj = defaultdict(list)
+        stable = len(self.tree) > 0
+        if stable != self.stable_tree:
+            # Discovery just found its first link (or lost its last): everyone changes
+            self.stable_tree = stable
+            dpids = self.switches.keys()
+            if stable:
+                log.info("Spanning tree formed")
 
-        # Only add edge when both directions are known (more stable)
-        for (u, up), (v, vp) in list(self.link_out.items()):
-            # Check if reverse exists
-            rev = (v, vp)
-            if rev not in self.link_out:
-                continue
-            if self.link_out[rev] != (u, up):
+        for dpid in list(dpids):
+            sw = self.switches.get(dpid)
+            if sw is None:
                 continue
+            if not self.stable_tree:
+                # Discovery / topology not ready -> don't block anything yet
+                sw.apply_blocked_ports(set())
+            else:
+                inter = self.interswitch_ports.get(dpid, set())
+                sw.apply_blocked_ports(inter - self.tree.tree_ports(dpid))
+            if self.flood == "datapath":
+                sw.set_datapath_flood(self.stable_tree)
+
+    def _precompute(self):
+        """
+        After a topology change: recompute the backup plans and the
+        distances to the switches with hosts on a worker (cse561.offload),
+        from copies of the current state. Until they arrive, a link-down
+        recomputes the tree itself and distances are computed on demand.
+        """
+        self._backups = {}
+        if self.stable_tree:
+            interswitch_ports = dict((dpid, set(ports))
+                                     for dpid, ports in self.interswitch_ports.items())
+            offloader.submit("a1ext2.backups", _compute_backups,
+                             (self.tree.copy(), interswitch_ports, list(self.switches)),
+                             self._set_backups)
+        if self.multipath:
+            adj = dict((u, dict(ports)) for u, ports in self.tree.adj.items())
+            dsts = set(dpid for dpid, _ in self.hosts.values())
+            offloader.submit("a1ext2.distances", _compute_distances, (adj, dsts),
+                             self._set_distances)
+
+    def _set_backups(self, backups):
+        # Only the newest submit is applied, so this matches the current tree
+        self._backups = backups
 
-            # Add undirected representation (u<->v). We will add both adjacency directions.
-            adj[u].append((v, up, vp))
-            adj[v].append((u, vp, up))
+    def _set_distances(self, distances):
+        for dst, dist in distances.items():
+            self._distances.setdefault(dst, dist)
 
-        # Sort adjacency lists for deterministic BFS (important with parallel links)
-        for u in adj:
-            adj[u].sort(key=lambda t: (t[0], t[1], t[2]))
-        return adj
+    def port_down(self, dpid, port):
+        """
+        A switch reported one of its ports down: fail over right away
+        instead of waiting for discovery to time the link out, and drop
+        the routed flows and hosts that depended on the port.
+        """
+        a = (dpid, port)
+        for mac, loc in list(self.hosts.items()):
+            if loc == a:
+                del self.hosts[mac]
+
+        peer = self.tree.adj.get(dpid, {}).get(port)
+        if peer is None:
+            self._invalidate_flows(set(self.flows_by_hop.get(a, ())))
+            return  # not a link we use
+        start = time.time()
+        self._invalidate_flows(self.flows_by_hop.get(a, set()) |
+                               self.flows_by_hop.get(peer, set()))
+
+        plan = self._backups.get((dpid, port))
+        if plan is not None:
+            for d, blocked in plan.items():
+                sw = self.switches.get(d)
+                if sw is not None:
+                    sw.apply_blocked_ports(blocked)
+
+        # Bring our own view in line; with a plan this sends nothing new
+        self._pending.pop((a, peer), None)
+        self._pending.pop((peer, a), None)
+        changed = self._update_link(a, peer, False) | self._update_link(peer, a, False)
+        self._suspended[a] = peer
+        self._suspended[peer] = a
+        self._distances.clear()
+        self._apply(changed)
+
+        self.failovers += 1
+        self.last_failover = time.time() - start
+        log.info("Port down dpid=%s port=%s: failed over %s in %.2f ms", dpid, port,
+                 "from backup plan" if plan is not None else "by recompute",
+                 self.last_failover * 1000)
+        self._precompute()
+
+    def _port_is_up(self, dpid, port):
+        sw = self.switches.get(dpid)
+        if sw is None:
+            return False
+        desc = sw.connection.ports.get(port)
+        if desc is None:
+            return False
+        return not (desc.config & of.OFPPC_PORT_DOWN or desc.state & of.OFPPS_LINK_DOWN)
 
-    def _compute_spanning_tree_ports(self):
+    def port_up(self, dpid, port):
         """
-        Compute spanning tree ports sets (tree_ports[dpid] = set of interswitch ports on the tree).
-        Root = smallest DPID in the discovered switch graph.
-        BFS on unweighted graph.
+        A port came back. If we suspended its link and discovery never
+        timed it out, put the link back once both ends are up.
         """
-        adj = self._build_undirected_edges()
-        if not adj:
-            # No inter-switch links discovered yet
-            self.tree_ports = defaultdict(set)
-            self.stable_tree = False
+        a = (dpid, port)
+        b = self._suspended.get(a)
+        if b is None or not self._port_is_up(*b):
+            return
+        del self._suspended[a]
+        self._suspended.pop(b, None)
+        changed = self._update_link(a, b, True) | self._update_link(b, a, True)
+        self._distances.clear()
+        self._apply(changed)
+        self._precompute()
+        log.info("Link dpid=%s port=%s <-> dpid=%s port=%s restored", dpid, port, b[0], b[1])
+
+    def learn_host(self, mac, dpid, port):
+        # Only edge ports tell us where a host lives
+        if port in self.interswitch_ports.get(dpid, ()):
             return
+        old = self.hosts.get(mac)
+        self.hosts[mac] = (dpid, port)
+        if old is not None and old != (dpid, port):
+            # The host moved: flows to it still lead to where it was
+            self._invalidate_flows(self._flows_to(mac))
 
-        root = min(adj.keys())
-        parent = {root: None}          # node -> parent node
-        parent_port = {}               # node -> (node_port_to_parent, parent_port_to_node)
+    def _flows_to(self, mac):
+        return set(key for key in self.flow_paths if key[1] == mac)
+
+    def _forget_hosts_at(self, loc):
+        """
+        Drop the hosts learned on (dpid, port) and the routed flows to them.
+        """
+        for mac, where in list(self.hosts.items()):
+            if where == loc:
+                del self.hosts[mac]
+                self._invalidate_flows(self._flows_to(mac))
 
-        q = deque([root])
-        while q:
-            u = q.popleft()
-            for (v, u_port, v_port) in adj[u]:
-                if v in parent:
+    def _distances_to(self, dst):
+        """
+        Hop count from every switch to dst over all known links.
+        """
+        dist = self._distances.get(dst)
+        if dist is None:
+            dist = self._distances[dst] = _bfs_distances(self.tree.adj, dst)
+        return dist
+
+    @staticmethod
+    def _flow_hash_key(pkt):
+        ip = pkt.find('ipv4')
+        if ip is None:
+            return (pkt.src, pkt.dst)
+        l4 = pkt.find('tcp')
+        if l4 is None:
+            l4 = pkt.find('udp')
+        if l4 is None:
+            return (ip.srcip, ip.dstip, ip.protocol)
+        return (ip.srcip, ip.dstip, ip.protocol, l4.srcport, l4.dstport)
+
+    @staticmethod
+    def _match_key(match):
+        return (match.dl_src, match.dl_dst, match.dl_type, match.nw_src,
+                match.nw_dst, match.nw_proto, match.tp_src, match.tp_dst)
+
+    def multipath_hops(self, src, pkt):
+        """
+        Pick a shortest path from switch src to the host pkt.dst, hashing the
+        flow's 5-tuple over the equal-cost next hops at every switch.
+        Returns [(dpid, out_port), ...] ending at the host port, or None.
+        """
+        loc = self.hosts.get(pkt.dst)
+        if loc is None:
+            return None
+        dst, host_port = loc
+        dist = self._distances_to(dst)
+        if src not in dist:
+            return None
+
+        salt = repr(self._flow_hash_key(pkt)).encode()
+        hops = []
+        u = src
+        while u != dst:
+            choices = sorted((port, v) for port, (v, _) in self.tree.adj[u].items()
+                             if dist.get(v) == dist[u] - 1)
+            port, v = choices[zlib.crc32(salt + b"@%d" % (u,)) % len(choices)]
+            hops.append((u, port))
+            u = v
+        hops.append((dst, host_port))
+        return hops
+
+    def route(self, sw, event, pkt):
+        """
+        Install the flow for pkt on every switch of its path and send the
+        packet on its way. False if the destination can't be routed (yet).
+        """
+        hops = self.multipath_hops(sw.dpid, pkt)
+        if not hops or any(dpid not in self.switches for dpid, _ in hops):
+            return False
+
+        match = of.ofp_match.from_packet(pkt)
+        match.in_port = None
+        key = self._match_key(match)
+        if key in self.flow_paths:
+            # Reinstalling the same flow (e.g. it raced its own flow_mods)
+            self._release(key)
+
+        # Far end first so the packet never overtakes its flow_mods.
+        # Only the ingress switch reports the flow's end (and byte count).
+        for i, (dpid, out_port) in reversed(list(enumerate(hops))):
+            fm = _multipath_flow_mod(match, out_port)
+            if i == 0:
+                fm.flags = of.OFPFF_SEND_FLOW_REM
+            self.switches[dpid].connection.send(fm)
+        self._track(key, match, hops)
+
+        _forwarding.send(sw.connection, event.ofp, hops[0][1])
+        return True
+
+    def _track(self, key, match, hops):
+        self.flow_paths[key] = hops
+        self.flow_matches[key] = match
+        for hop in hops:
+            self.link_flows[hop] += 1
+            self.flows_by_hop[hop].add(key)
+
+    def _release(self, key, byte_count=0):
+        self.flow_matches.pop(key, None)
+        for hop in self.flow_paths.pop(key, ()):
+            self.link_flows[hop] -= 1
+            if self.link_flows[hop] <= 0:
+                del self.link_flows[hop]
+            self.link_bytes[hop] += byte_count
+            keys = self.flows_by_hop.get(hop)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.flows_by_hop[hop]
+
+    def _invalidate_flows(self, keys):
+        """
+        Delete routed flows from every switch on their path, so the next
+        packet comes back to us and gets a working path.
+        """
+        for key in list(keys):
+            match = self.flow_matches.get(key)
+            for dpid, _ in self.flow_paths.get(key, ()):
+                sw = self.switches.get(dpid)
+                if sw is None:
                     continue
-                parent[v] = u
-                parent_port[v] = (u_port, v_port)
-                q.append(v)
+                fm = of.ofp_flow_mod()
+                fm.command = of.OFPFC_DELETE_STRICT
+                fm.match = match
+                fm.priority = MULTIPATH_PRIORITY
+                sw.connection.send(fm)
+            self._release(key)
+        if keys:
+            log.info("Invalidated %d routed flows", len(keys))
 
-        # Build tree_ports from parent relations
-        tree_ports = defaultdict(set)
-        for v, u in parent.items():
-            if u is None:
-                continue
-            u_port_to_v, v_port_to_u = parent_port[v]
-            tree_ports[u].add(u_port_to_v)
-            tree_ports[v].add(v_port_to_u)
+    def flow_removed(self, ofp):
+        self._release(self._match_key(ofp.match), ofp.byte_count)
 
-        self.tree_ports = tree_ports
-        self.stable_tree = True
-        log.info("Spanning tree computed: root dpid=%s, nodes=%s", root, sorted(parent.keys()))
+    def link_load(self):
+        """
+        Per-link load: {(dpid, out_port): (active_flows, bytes_of_finished_flows)}
+        for inter-switch ports.
+        """
+        load = {}
+        for dpid, ports in self.interswitch_ports.items():
+            for port in ports:
+                hop = (dpid, port)
+                load[hop] = (self.link_flows.get(hop, 0), self.link_bytes.get(hop, 0))
+        return load
 
-    def _recompute_and_apply(self):
+    def busiest_tree_link(self):
         """
-        Recompute ST and apply blocked ports to all connected switches.
+        (bytes/s, (dpid, port)) of the busiest tree port, sending side, from
+        cse561.flowstats; None if it isn't running or has no rates yet.
         """
-        self._compute_spanning_tree_ports()
+        if not core.hasComponent("flow_stats"):
+            return None
+        ports = [(dpid, port) for dpid in self.switches for port in self.tree.tree_ports(dpid)]
+        return core.flow_stats.busiest(ports)
 
-        for dpid, sw in self.switches.items():
-            inter = set(self.interswitch_ports.get(dpid, set()))
-            on_tree = set(self.tree_ports.get(dpid, set()))
+    def _log_busiest_link(self):
+        busiest = self.busiest_tree_link()
+        if busiest is not None:
+            rate, (dpid, port) = busiest
+            peer = self.link_out.get((dpid, port))
+            log.info("busiest tree link dpid=%s port=%s -> %s: %.0f bytes/s", dpid, port,
+                     "dpid=%s port=%s" % peer if peer else "?", rate)
 
-            if not self.stable_tree:
-                # Discovery / topology not ready -> don't block anything yet
-                sw.apply_blocked_ports(set())
-            else:
-                blocked = inter - on_tree
-                sw.apply_blocked_ports(blocked)
+    def _log_link_load(self):
+        for (dpid, port), (flows, nbytes) in sorted(self.link_load().items()):
+            peer = self.link_out.get((dpid, port))
+            log.info("link dpid=%s port=%s -> %s: flows=%d bytes=%d", dpid, port,
+                     "dpid=%s port=%s" % peer if peer else "?", flows, nbytes)
 
     def get_allowed_ports(self, dpid):
         """
@@ -280,12 +1032,345 @@ class SpanningTreeController(object):
         allowed = all_ports - set(sw.blocked_ports)
         return allowed
 
+    def stats(self):
+        return {
+            "switches": len(self.switches),
+            "links": len(self.link_out),
+            "hosts": len(self.hosts),
+            "routed_flows": len(self.flow_paths),
+            "link_events": self.link_events,
+            "link_batches": self.link_batches,
+            "failovers": self.failovers,
+            "stable_tree": int(self.stable_tree),
+            "last_convergence": self.last_convergence,
+            "max_convergence": self.max_convergence,
+        }
 
-def launch():
+
+class _Move(object):
+    """
+    An elephant on its way from the `old` to the `new` path, waiting for
+    the barriers in `waiting` before the next switch in `repoint` (the
+    ones on both paths, downstream first, then the ingress) is switched
+    over.
+    """
+
+    __slots__ = ("key", "old", "new", "waiting", "repoint", "started")
+
+    def __init__(self, key, old, new, started):
+        self.key = key
+        self.old = old
+        self.new = new
+        self.waiting = set()
+        self.repoint = []
+        self.started = started
+
+
+class ElephantMover(object):
+    """
+    Traffic engineering for multipath mode. Every `interval` seconds:
+    - read each routed flow's rate at its ingress switch and every
+      inter-switch port's tx rate from cse561.flowstats (core.flow_stats)
+    - for the flows of at least `threshold` bytes/s, heaviest first, find
+      the path (up to `slack` hops longer than the shortest) whose busiest
+      link would carry the least once the flow is on it, and move the flow
+      there if that beats its current path's busiest link
+    No moves are made until the port rates have been polled again since
+    the last one. A move is one targeted update per switch. The switches
+    only on the new path get their entry first (OFPFC_MODIFY_STRICT, which
+    adds it where missing), each followed by a barrier. Once every barrier
+    is answered, the switches on both paths whose out port changes are
+    repointed one at a time from downstream to upstream, each behind its
+    own barrier, and the ingress last. So no packet is sent towards a
+    switch that doesn't know the flow's new route yet, and a flow changes
+    path exactly once. Entries left only on the old path are deleted
+    `drain` seconds later.
+    """
+
+    def __init__(self, ctrl, interval=TE_INTERVAL, threshold=ELEPHANT_RATE, slack=TE_SLACK,
+                 max_moves=TE_MAX_MOVES, cooldown=TE_COOLDOWN, drain=TE_DRAIN, clock=time.time):
+        self.ctrl = ctrl
+        self.interval = interval
+        self.threshold = threshold
+        self.slack = slack
+        self.max_moves = max_moves
+        self.cooldown = cooldown
+        self.drain = drain
+        self.clock = clock
+
+        self._moved_at = {}  # flow key -> when it last moved
+        self._last_move = None
+        self._pending = {}  # barrier xid -> _Move
+
+        self.rounds = 0
+        self.elephants = 0  # elephants seen, summed over rounds
+        self.moves = 0
+        self.abandoned = 0
+
+        core.openflow.addListenerByName("BarrierIn", self._handle_BarrierIn)
+        core.call_when_ready(self._start, ["flow_stats"])
+
+    def _start(self):
+        Timer(self.interval, self._round, recurring=True)
+        log.info("Moving flows over %d bytes/s every %ss", self.threshold, self.interval)
+
+    def _link_loads(self):
+        """
+        {(dpid, port): tx bytes/s} of the inter-switch ports.
+        """
+        load = {}
+        for dpid, ports in self.ctrl.interswitch_ports.items():
+            for port in ports:
+                rate = core.flow_stats.port_rate(dpid, port)
+                load[(dpid, port)] = rate[1] if rate else 0.0
+        return load
+
+    def _elephants(self):
+        """
+        [(bytes/s, flow key), ...] of the routed flows over the threshold.
+        """
+        ctrl = self.ctrl
+        rates = {}
+        for dpid in set(hops[0][0] for hops in ctrl.flow_paths.values()):
+            for rate, flow in core.flow_stats.top_flows(dpid, None, MULTIPATH_COOKIE):
+                rates[(dpid, ctrl._match_key(flow.match))] = rate
+        found = []
+        for key, hops in ctrl.flow_paths.items():
+            rate = rates.get((hops[0][0], key), 0.0)
+            if rate >= self.threshold:
+                found.append((rate, key))
+        found.sort(key=lambda e: e[0], reverse=True)
+        return found
+
+    def paths(self, src, dst):
+        """
+        Loop-free switch paths from src to dst as [(dpid, out_port), ...],
+        at most `slack` hops longer than the shortest, shortest first.
+        """
+        dist = self.ctrl._distances_to(dst)
+        if src not in dist:
+            return []
+        limit = dist[src] + self.slack
+        adj = self.ctrl.tree.adj
+        paths = []
+
+        def walk(u, hops, seen):
+            if len(paths) >= TE_MAX_PATHS:
+                return
+            if u == dst:
+                paths.append(list(hops))
+                return
+            for port, (v, _) in sorted(adj.get(u, {}).items()):
+                if v in seen or v not in dist or len(hops) + 1 + dist[v] > limit:
+                    continue
+                hops.append((u, port))
+                seen.add(v)
+                walk(v, hops, seen)
+                seen.discard(v)
+                hops.pop()
+
+        walk(src, [], set([src]))
+        paths.sort(key=len)
+        return paths
+
+    def _round(self):
+        self.rounds += 1
+        now = self.clock()
+        ctrl = self.ctrl
+        for xid, move in list(self._pending.items()):
+            if now - move.started > 2 * self.interval:
+                del self._pending[xid]
+                if not any(m is move for m in self._pending.values()):
+                    self.abandoned += 1
+        for key in [k for k in self._moved_at if k not in ctrl.flow_paths]:
+            del self._moved_at[key]
+
+        elephants = self._elephants()
+        self.elephants += len(elephants)
+        if not elephants:
+            return
+        if self._last_move is not None and now - self._last_move < core.flow_stats.interval:
+            return  # the port rates don't show the last moves yet
+        load = self._link_loads()
+        moving = set(m.key for m in self._pending.values())
+        moves = 0
+        for rate, key in elephants:
+            if moves >= self.max_moves:
+                break
+            if key in moving or now - self._moved_at.get(key, now - self.cooldown) < self.cooldown:
+                continue
+            hops = ctrl.flow_paths[key]
+            links = hops[:-1]  # the last hop is the host port
+            current = max([load.get(h, 0.0) for h in links] or [0.0])
+            best = None
+            for path in self.paths(hops[0][0], hops[-1][0]):
+                if path == links:
+                    continue
+                cost = max([load.get(h, 0.0) + (0.0 if h in links else rate) for h in path]
+                           or [0.0])
+                if best is None or cost < best[0]:
+                    best = (cost, path)
+            if best is None or best[0] > current * (1 - TE_MIN_GAIN):
+                continue
+            # Count the flow on its new path for the rest of this round
+            for h in links:
+                if h not in best[1]:
+                    load[h] = load.get(h, 0.0) - rate
+            for h in best[1]:
+                if h not in links:
+                    load[h] = load.get(h, 0.0) + rate
+            if self._move(key, hops, best[1] + [hops[-1]], now):
+                moves += 1
+                log.info("Moving flow at %.0f bytes/s: busiest link %.0f -> %.0f bytes/s",
+                         rate, current, best[0])
+
+    def _move(self, key, old, new, now):
+        ctrl = self.ctrl
+        if any(dpid not in ctrl.switches for dpid, _ in new):
+            return False
+        match = ctrl.flow_matches[key]
+        move = _Move(key, old, new, now)
+        on_old = set(dpid for dpid, _ in old)
+        for dpid, out_port in new[1:]:
+            if (dpid, out_port) in old:
+                continue  # already there
+            if dpid in on_old:
+                # Carries the flow now: only repointed once the rest is ready
+                move.repoint.append((dpid, out_port))
+                continue
+            self._send_with_barrier(move, dpid, match, out_port)
+        # Downstream first, so every switch repointed already has its new
+        # next hop ready; the ingress goes last
+        move.repoint.reverse()
+        move.repoint.append(new[0])
+        if not move.waiting:
+            self._repoint(move)
+        return True
+
+    def _send_with_barrier(self, move, dpid, match, out_port):
+        connection = self.ctrl.switches[dpid].connection
+        connection.send(_multipath_flow_mod(match, out_port, of.OFPFC_MODIFY_STRICT))
+        barrier = of.ofp_barrier_request()
+        connection.send(barrier)
+        move.waiting.add(barrier.xid)
+        self._pending[barrier.xid] = move
+
+    def _handle_BarrierIn(self, event):
+        move = self._pending.pop(event.xid, None)
+        if move is None:
+            return
+        move.waiting.discard(event.xid)
+        if not move.waiting:
+            self._repoint(move)
+
+    def _repoint(self, move):
+        """
+        Switch the next switch on both paths over to the new one, behind a
+        barrier, or the ingress once only it is left.
+        """
+        ctrl = self.ctrl
+        key = move.key
+        dpid, out_port = move.repoint.pop(0)
+        if ctrl.flow_paths.get(key) != move.old or dpid not in ctrl.switches:
+            self.abandoned += 1  # the flow ended or was rerouted meanwhile
+            return
+        match = ctrl.flow_matches[key]
+        if move.repoint:
+            self._send_with_barrier(move, dpid, match, out_port)
+            return
+        # MODIFY_STRICT keeps the entry's counters and SEND_FLOW_REM flag
+        ctrl.switches[dpid].connection.send(
+            _multipath_flow_mod(match, out_port, of.OFPFC_MODIFY_STRICT))
+        ctrl._release(key)
+        ctrl._track(key, match, move.new)
+        self._moved_at[key] = self._last_move = self.clock()
+        self.moves += 1
+
+        on_new = set(dpid for dpid, _ in move.new)
+        stale = [dpid for dpid, _ in move.old if dpid not in on_new]
+        if stale:
+            Timer(self.drain, self._delete_stale, args=[key, match, stale])
+
+    def _delete_stale(self, key, match, dpids):
+        on_path = set(dpid for dpid, _ in self.ctrl.flow_paths.get(key, ()))
+        for dpid in dpids:
+            sw = self.ctrl.switches.get(dpid)
+            if sw is None or dpid in on_path:
+                continue  # gone, or the flow came back through it
+            fm = of.ofp_flow_mod()
+            fm.command = of.OFPFC_DELETE_STRICT
+            fm.match = match
+            fm.priority = MULTIPATH_PRIORITY
+            sw.connection.send(fm)
+
+    def stats(self):
+        return {
+            "rounds": self.rounds,
+            "elephants": self.elephants,
+            "moves": self.moves,
+            "abandoned": self.abandoned,
+            "pending": len(set(id(m) for m in list(self._pending.values()))),
+        }
+
+
+def _register_metrics(ctrl):
+    # Read when /metrics is scraped (see cse561.metrics)
+    metrics.stats_collector(
+        "cse561_a1ext2_controller", "a1ext2 spanning tree controller state", (),
+        lambda: {(): ctrl.stats()})
+    metrics.registry.collect(
+        "cse561_a1ext2_blocked_ports", "Ports blocked off the spanning tree", ("dpid",),
+        lambda: dict((dpid, len(sw.blocked_ports)) for dpid, sw in list(ctrl.switches.items())))
+    metrics.stats_collector(
+        "cse561_a1ext2_packet_outs_total", "a1ext2 packet-out buffering counters", (),
+        lambda: {(): _forwarding.stats()}, kind="counter")
+    if ctrl.te is not None:
+        metrics.stats_collector(
+            "cse561_a1ext2_te", "Elephant flow moves (--te)", (), lambda: {(): ctrl.te.stats()})
+
+
+def _log_forwarding():
+    log.info("packet-outs: %s", " ".join("%s=%s" % kv for kv in sorted(_forwarding.stats().items())))
+
+
+def launch(settle=LINK_SETTLE, max_delay=LINK_MAX_DELAY, flood="controller",
+           multipath=False, stats_interval=0, reconcile=False, miss_send_len=None,
+           te=False, elephant=ELEPHANT_RATE, te_interval=TE_INTERVAL):
     """
     Launch controller.
     Make sure openflow.discovery is running; if not, start it.
+
+    --settle=S      apply link events once none arrived for S seconds (0 = at once)
+    --max_delay=S   but never hold an event for longer than S seconds
+    --flood=MODE    controller (default) or datapath: let switches flood
+                    broadcast/ARP along the tree themselves (OFPPC_NO_FLOOD)
+    --multipath     route unicast to known hosts over all equal-cost paths,
+                    parallel links included, hashing flows by 5-tuple
+    --stats_interval=S  log packet-out counters, the busiest tree link
+                    (with cse561.flowstats) and per-link multipath load
+                    every S seconds
+    --reconcile     keep flow tables across controller restarts and diff them
+                    against the tree on (re)connect instead of assuming empty
+    --miss_send_len=N  switches send at most N bytes of a table-miss packet
+                    and buffer the rest
+    --te            with --multipath: move elephant flows to less loaded
+                    paths (needs cse561.flowstats running too)
+    --elephant=B    flows at least B bytes/s fast are elephants
+    --te_interval=S look for elephants every S seconds
     """
+    # POX passes option values as strings, so "--multipath=False" is truthy
+    multipath = str(multipath).lower() != "false"
+    te = str(te).lower() != "false"
+    reconcile = str(reconcile).lower() != "false"
+    if flood not in FLOOD_MODES:
+        raise RuntimeError("--flood must be one of %s" % (", ".join(FLOOD_MODES),))
+    if te and not multipath:
+        raise RuntimeError("--te needs --multipath")
+
+    if reconcile:
+        keep_flows_on_connect()
+    set_miss_send_len(miss_send_len)
+
     # Ensure discovery is loaded
     if not core.hasComponent('openflow_discovery'):
         try:
@@ -296,4 +1381,15 @@ def launch():
             log.error("Failed to launch openflow.discovery: %s", e)
             # Controller can still run, but will not learn links -> cannot compute ST.
 
-    core.registerNew(SpanningTreeController)
+    ctrl = core.registerNew(SpanningTreeController, float(settle), float(max_delay),
+                            flood, multipath, reconcile)
+    if te:
+        ctrl.te = ElephantMover(ctrl, float(te_interval), float(elephant))
+        if not core.hasComponent("flow_stats"):
+            log.info("--te waits for cse561.flowstats (core.flow_stats)")
+    _register_metrics(ctrl)
+    if float(stats_interval) > 0:
+        Timer(float(stats_interval), _log_forwarding, recurring=True)
+        Timer(float(stats_interval), ctrl._log_busiest_link, recurring=True)
+        if multipath:
+            Timer(float(stats_interval), ctrl._log_link_load, recurring=True)
@@ -6,6 +6,9 @@
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 
+from cse561 import metrics
+from cse561.trace import describe_packet_in, tracer
+
 log = core.getLogger()
 
 
@@ -19,6 +22,7 @@ class Firewall(object):
         # Keep track of the connection to the switch so that we can
         # send it messages!
         self.connection = connection
+        metrics.meter_connection(connection)
 
         # This binds our PacketIn event listener
         connection.addListeners(self)
@@ -45,19 +49,16 @@ class Firewall(object):
         drop.match.dl_type = 0x0800
         connection.send(drop)
 
+    @metrics.timed_packet_in("a1part2")
     def _handle_PacketIn(self, event):
         """
         Packets not handled by the router rules will be
         forwarded to this method to be handled by the controller
         """
 
-        packet = event.parsed  # This is the parsed packet data.
-        if not packet.parsed:
-            log.warning("Ignoring incomplete packet")
-            return
-
-        packet_in = event.ofp  # The actual ofp_packet_in message.
-        print("Unhandled packet :" + str(packet.dump()))
+        # The rules handle everything; the packet is only parsed (event.parsed)
+        # if this trace is sampled and shown
+        tracer.trace("packet", describe_packet_in, event)
 
 
 def launch():
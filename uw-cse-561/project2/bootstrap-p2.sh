@@ -5,6 +5,12 @@ set -e
 if [[ -d /home/vagrant/project-2/pox ]]
 then
     ln -s /home/vagrant/project-2/pox/* /home/vagrant/pox/pox/misc/ && echo "Success"
+    # Shared controller code (flow reconciliation) lives in POX's ext/
+    CSE561="$(cd "$(dirname "$0")/.." && pwd)/cse561"
+    if [[ -d $CSE561 && ! -e /home/vagrant/pox/ext/cse561 ]]
+    then
+        ln -s "$CSE561" /home/vagrant/pox/ext/cse561
+    fi
 else
     echo "ERROR -> could not find /home/vagrant/project-2/pox/*"
     echo "You might have cloned the bootstrap repo to the wrong location, or might be running as root/sudo?"
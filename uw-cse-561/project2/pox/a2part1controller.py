@@ -5,7 +5,13 @@
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
-from pox.lib.addresses import IPAddr, IPAddr6, EthAddr
+
+from cse561 import metrics
+from cse561.flowsync import FlowReconciler, keep_flows_on_connect
+from cse561.forwarding import Forwarder, set_miss_send_len
+from cse561.offload import offloader
+from cse561.policy import FLOOD, PolicyCompiler
+from cse561.trace import describe_packet_in, tracer
 
 log = core.getLogger()
 
@@ -27,157 +33,154 @@ SUBNETS = {
     "hnotrust": "172.16.10.0/24",
 }
 
+# The network as data: the core router's port towards each subnet, and the
+# edge switches that just flood IPv4 for theirs
+NETWORK = {
+    "routers": {
+        21: {"h10": 1, "h20": 2, "h30": 3, "serv1": 4, "hnotrust": 5},  # cores21
+    },
+    "edges": {1: "h10", 2: "h20", 3: "h30", 31: "serv1"},  # s1, s2, s3, dcs31
+}
+
+ZONES = {
+    "trusted": ["h10", "h20", "h30"],
+    "untrusted": ["hnotrust"],
+    "datacenter": ["serv1"],
+}
+
+# First match wins; whatever is not denied is routed. Enforced at the
+# routers, which all inter-subnet traffic crosses.
+POLICY = [
+    # Block all ICMP traffic from hnotrust
+    {"action": "deny", "src": "untrusted", "proto": "icmp"},
+    # Block all traffic from hnotrust to the datacenter
+    {"action": "deny", "src": "untrusted", "dst": "datacenter"},
+]
+
+# Cookie namespace of the static rules compiled from POLICY
+RULE_COOKIE_BASE = 0x50415233 << 32
+
+_compiler = PolicyCompiler(NETWORK, ZONES, POLICY, SUBNETS)
+_forwarding = Forwarder()
+
+# dpid -> Part3Controller, for the metrics
+_controllers = {}
+
+
+def _compile(dpid):
+    """
+    (specs, (shadowed, redundant)) for one switch; runs on a worker
+    (cse561.offload), so the rules dropped compiling it come back with
+    the specs.
+    """
+    return _compiler.compile(dpid), _compiler.dropped.get(dpid, (0, 0))
+
+
+def _flow_mod(spec):
+    fm = of.ofp_flow_mod()
+    fm.priority = spec.priority
+    fm.match.dl_type = 0x0800  # IPv4
+    if spec.src is not None:
+        fm.match.nw_src = spec.src
+    if spec.dst is not None:
+        fm.match.nw_dst = spec.dst
+    if spec.proto is not None:
+        fm.match.nw_proto = spec.proto  # Memo: ICMP=1, TCP=6, UDP=17
+    if spec.tp_dst is not None:
+        fm.match.tp_dst = spec.tp_dst
+    if spec.out_port == FLOOD:
+        fm.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
+    elif spec.out_port is not None:
+        fm.actions.append(of.ofp_action_output(port=spec.out_port))
+    # no actions => drop
+    return fm
+
 
 class Part3Controller(object):
     """
     A Connection object for that switch is passed to the __init__ function.
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, reconcile=False):
         print(connection.dpid)
         # Keep track of the connection to the switch so that we can
         # send it messages!
         self.connection = connection
+        metrics.meter_connection(connection)
+        # Static rules of this switch; with reconcile they are diffed
+        # against the switch's flow table instead of sent blindly
+        self.reconcile = reconcile
+        self.rules = []
 
         # This binds our PacketIn event listener
         connection.addListeners(self)
-        # use the dpid to figure out what switch is being created
-        if connection.dpid == 1:
-            self.s1_setup()
-        elif connection.dpid == 2:
-            self.s2_setup()
-        elif connection.dpid == 3:
-            self.s3_setup()
-        elif connection.dpid == 21:
-            self.cores21_setup()
-        elif connection.dpid == 31:
-            self.dcs31_setup()
-        else:
-            print("UNKNOWN SWITCH")
-            exit(1)
-
-    def s1_setup(self):
-        # Allow all traffic to h10
-        ip_allow = of.ofp_flow_mod()
-        ip_allow.priority = 900
-        ip_allow.match.dl_type = 0x0800  # IPv4
-        ip_allow.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        self.connection.send(ip_allow)
-
-    def s2_setup(self):
-        # Allow all traffic to h20
-        ip_allow = of.ofp_flow_mod()
-        ip_allow.priority = 900
-        ip_allow.match.dl_type = 0x0800  # IPv4
-        ip_allow.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        self.connection.send(ip_allow)
-
-    def s3_setup(self):
-        # Allow all traffic to h30
-        ip_allow = of.ofp_flow_mod()
-        ip_allow.priority = 900
-        ip_allow.match.dl_type = 0x0800  # IPv4
-        ip_allow.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        self.connection.send(ip_allow)
-
-    def cores21_setup(self):
-        # Block all ICMP traffic from hnotrust
-        icmp_drop = of.ofp_flow_mod()
-        icmp_drop.priority = 1000
-        icmp_drop.match.dl_type = 0x0800  # IPv4
-        icmp_drop.match.nw_proto = 1  # Memo: ICMP=1, TCP=6, UDP=17
-        icmp_drop.match.nw_src = IPAddr("172.16.10.100") # hnotrust's IP
-        self.connection.send(icmp_drop)
-
-        # If distination ip is 10.0.1.X, send to s1
-        s1_route = of.ofp_flow_mod()
-        s1_route.priority = 900
-        s1_route.match.dl_type = 0x0800  # IPv4
-        s1_route.match.nw_dst = IPAddr("10.0.1.10")
-        s1_route.actions.append(of.ofp_action_output(port=1))
-        self.connection.send(s1_route)
-
-        # If distination ip is 10.0.2.X, send to s2
-        s2_route = of.ofp_flow_mod()
-        s2_route.priority = 900
-        s2_route.match.dl_type = 0x0800  # IPv4
-        s2_route.match.nw_dst = IPAddr("10.0.2.20")
-        s2_route.actions.append(of.ofp_action_output(port=2))
-        self.connection.send(s2_route)
-
-        # If distination ip is 10.0.3.X, send to s3
-        s3_route = of.ofp_flow_mod()
-        s3_route.priority = 900
-        s3_route.match.dl_type = 0x0800  # IPv4
-        s3_route.match.nw_dst = IPAddr("10.0.3.30")
-        s3_route.actions.append(of.ofp_action_output(port=3))
-        self.connection.send(s3_route)
-
-        # If distination ip is 10.0.4.X, send to serv1
-        serv1_route = of.ofp_flow_mod()
-        serv1_route.priority = 900
-        serv1_route.match.dl_type = 0x0800  # IPv4
-        serv1_route.match.nw_dst = IPAddr("10.0.4.10")
-        serv1_route.actions.append(of.ofp_action_output(port=4))
-        self.connection.send(serv1_route)
-
-        # If distination ip is 172.16.10.X, send to hnotrust
-        hnotrust_route = of.ofp_flow_mod()
-        hnotrust_route.priority = 900
-        hnotrust_route.match.dl_type = 0x0800  # IPv4
-        hnotrust_route.match.nw_dst = IPAddr("172.16.10.100")
-        hnotrust_route.actions.append(of.ofp_action_output(port=5))
-        self.connection.send(hnotrust_route)
-
-    def dcs31_setup(self):
-        # Block all traffic from hnotrust
-        ip_drop = of.ofp_flow_mod()
-        ip_drop.priority = 1000
-        ip_drop.match.dl_type = 0x0800  # IPv4
-        ip_drop.match.nw_src = IPAddr("172.16.10.100") # hnotrust's IP
-        self.connection.send(ip_drop)
-
-        # Allow all other traffic to serv1
-        ip_allow = of.ofp_flow_mod()
-        ip_allow.priority = 900
-        ip_allow.match.dl_type = 0x0800  # IPv4
-        ip_allow.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        self.connection.send(ip_allow)
+        # the switch's rules come from the compiled policy, not per-dpid code;
+        # compiling a big policy shouldn't hold up the other switches
+        offloader.submit("a2part1.compile.%s" % (connection.dpid,), _compile,
+                         (connection.dpid,), self._compiled)
+
+    def _compiled(self, result):
+        specs, (shadowed, redundant) = result
+        connection = self.connection
+        if getattr(connection, "disconnected", False):
+            return  # it reconnects with a new Part3Controller
+        if specs is None:
+            log.warning("dpid=%s is not in NETWORK, installing no rules", connection.dpid)
+            specs = []
+        elif connection.dpid in NETWORK["routers"]:
+            log.info("dpid=%s: %d flows compiled from %d policy rules (%d shadowed, %d redundant dropped)",
+                     connection.dpid, len(specs), len(POLICY), shadowed, redundant)
+        for spec in specs:
+            self.install(_flow_mod(spec))
+
+        if self.reconcile:
+            FlowReconciler(connection, RULE_COOKIE_BASE, self.rules).start()
+
+    def install(self, fm):
+        # Give every static rule a stable cookie (same switch, same order
+        # -> same cookie) so that a reconnect can be reconciled
+        fm.cookie = RULE_COOKIE_BASE | len(self.rules)
+        self.rules.append(fm)
+        if not self.reconcile:
+            self.connection.send(fm)
 
     # used in part 4 to handle individual ARP packets
     # not needed for part 3 (USE RULES!)
     # causes the switch to output packet_in on out_port
     def resend_packet(self, packet_in, out_port):
-        msg = of.ofp_packet_out()
-        msg.data = packet_in
-        action = of.ofp_action_output(port=out_port)
-        msg.actions.append(action)
-        self.connection.send(msg)
+        _forwarding.send(self.connection, packet_in, out_port)
 
+    @metrics.timed_packet_in("a2part1")
     def _handle_PacketIn(self, event):
         """
         Packets not handled by the router rules will be
         forwarded to this method to be handled by the controller
         """
 
-        packet = event.parsed  # This is the parsed packet data.
-        if not packet.parsed:
-            log.warning("Ignoring incomplete packet")
-            return
-
-        packet_in = event.ofp  # The actual ofp_packet_in message.
-        print(
-            "Unhandled packet from " + str(self.connection.dpid) + ":" + packet.dump()
-        )
+        # The rules handle everything; the packet is only parsed (event.parsed)
+        # if this trace is sampled and shown
+        tracer.trace("packet", describe_packet_in, event)
 
 
-def launch():
+def launch(reconcile=False, miss_send_len=None):
     """
     Starts the component
+
+    --reconcile keeps switch flow tables across controller restarts and
+    only sends the rules that are missing or stale on (re)connect.
+    --miss_send_len=N has switches send at most N bytes of a table-miss
+    packet (they are only logged here) and buffer the rest.
     """
+    reconcile = str(reconcile).lower() != "false"
+    if reconcile:
+        keep_flows_on_connect()
+    set_miss_send_len(miss_send_len)
 
     def start_switch(event):
         log.debug("Controlling %s" % (event.connection,))
-        Part3Controller(event.connection)
+        _controllers[event.dpid] = Part3Controller(event.connection, reconcile=reconcile)
 
     core.openflow.addListenerByName("ConnectionUp", start_switch)
+    metrics.registry.collect(
+        "cse561_a2part1_rules", "Static rules compiled from POLICY", ("dpid",),
+        lambda: dict((dpid, len(c.rules)) for dpid, c in list(_controllers.items())))
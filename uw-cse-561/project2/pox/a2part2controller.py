@@ -5,10 +5,19 @@
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
-from pox.lib.addresses import IPAddr, IPAddr6, EthAddr
+from pox.lib.addresses import IPAddr, EthAddr
 
-from pox.lib.packet.arp import arp
-from pox.lib.packet.ethernet import ethernet
+from cse561.flowsync import FlowReconciler, keep_flows_on_connect
+from cse561.forwarding import Forwarder, set_miss_send_len
+from cse561.headers import Headers
+from cse561.trace import describe_packet_in, tracer
+from cse561.routing import PrefixTable, int_to_ip, ip_to_int
+from cse561 import metrics, templates
+
+from pox.lib.recoco import Timer
+
+from collections import OrderedDict, deque, namedtuple
+import time
 
 log = core.getLogger()
 
@@ -30,19 +39,249 @@ SUBNETS = {
     "hnotrust": "172.16.10.0/24",
 }
 
+# The router (cores21): port and next-hop MAC towards each subnet. Every
+# subnet has a single host here, so that host is the next hop. A subnet
+# without a next-hop MAC is treated as directly connected: its hosts are
+# resolved with ARP and get /32 flows.
+ROUTER_DPID = 21
+ROUTER_PORTS = {"h10": 1, "h20": 2, "h30": 3, "serv1": 4, "hnotrust": 5}
+NEXT_HOP_MACS = {
+    "h10": "00:00:00:00:00:01",
+    "h20": "00:00:00:00:00:02",
+    "h30": "00:00:00:00:00:03",
+    "serv1": "00:00:00:00:00:04",
+    "hnotrust": "00:00:00:00:00:05",
+}
+ROUTE_PRIORITY = 900  # + prefix length
+HOST_ROUTE_PRIORITY = ROUTE_PRIORITY + 32
+GATEWAY_PRIORITY = HOST_ROUTE_PRIORITY + 1  # pings to x.x.x.1 go to the controller
+
+# The router answers ARP for x.x.x.1 in every subnet with this MAC
+GATEWAY_MAC = EthAddr("00:00:00:00:00:99")
+_GATEWAY_MAC_RAW = templates.mac_bytes(GATEWAY_MAC)
+
+# ARP cache of the router
+ARP_CACHE_CAPACITY = 1024
+ARP_TIMEOUT = 60  # seconds an entry stays valid after it was learned
+ARP_REFRESH = 45  # an entry in use this old gets re-ARPed before it expires
+ARP_RETRY_INTERVAL = 1.0
+ARP_MAX_REQUESTS = 3  # then the queued packets are dropped
+ARP_QUEUE_LEN = 8  # packets held per unresolved destination
+ARP_MAX_PENDING = 256  # unresolved destinations held at once
+
+# Flows through the router logged by --stats_interval (with cse561.flowstats)
+TOP_TALKERS = 5
+
+Route = namedtuple("Route", "port next_hop gateway")
+
+
+def _build_routes():
+    """
+    LPM table: subnet -> Route(port, next-hop MAC or None, gateway IP as int)
+    """
+    routes = PrefixTable()
+    for name, subnet in SUBNETS.items():
+        mac = NEXT_HOP_MACS.get(name)
+        gateway = ip_to_int(subnet.split("/")[0]) + 1
+        routes.insert(subnet, Route(ROUTER_PORTS[name], mac and EthAddr(mac), gateway))
+    return routes
+
+
+ROUTES = _build_routes()
+
+# Pre-packed messages for the packets the controller builds itself; only
+# ports, addresses and xids are patched per packet
+ARP_REPLY = templates.ArpTemplate(templates.ARP_REPLY, GATEWAY_MAC)
+ARP_REQUEST = templates.ArpTemplate(templates.ARP_REQUEST, GATEWAY_MAC)
+ECHO_REPLY = templates.EchoReplyTemplate(GATEWAY_MAC)
+PACKET_OUT = templates.PacketOutTemplate()
+FORWARD = templates.PacketOutTemplate(set_dst=True)
+HOST_ROUTE = templates.HostRouteTemplate(HOST_ROUTE_PRIORITY, ARP_TIMEOUT, ARP_TIMEOUT)
+
+# Cookie namespace of the static rules installed by the *_setup methods
+RULE_COOKIE_BASE = 0x50415234 << 32
+
+# dpid -> Part4Controller of the connected routers, so that ARP seen on the
+# edge switches reaches the router's cache
+_routers = {}
+
+# resends packet-ins by buffer_id where possible, for all switches
+_forwarding = Forwarder()
+
+
+class ArpCache(object):
+    """
+    Bounded IP -> MAC table of one router, plus the packets waiting for an
+    ARP reply.
+    - At most `capacity` entries; the least recently used is evicted first.
+    - An entry is valid for `timeout` seconds after it was learned. One that
+      is used after `refresh` seconds triggers a new request, so busy hosts
+      are re-resolved before they expire.
+    - Packets to an unresolved IP wait in a queue of at most `queue_len`
+      (for at most `max_pending` IPs). The request is repeated every
+      `retry_interval` seconds, `max_requests` times, then they are dropped.
+    `request(ip, port)` sends an ARP request for ip out of port.
+    """
+
+    def __init__(self, request, capacity=ARP_CACHE_CAPACITY, timeout=ARP_TIMEOUT,
+                 refresh=ARP_REFRESH, queue_len=ARP_QUEUE_LEN, max_pending=ARP_MAX_PENDING,
+                 retry_interval=ARP_RETRY_INTERVAL, max_requests=ARP_MAX_REQUESTS,
+                 clock=time.time):
+        self.request = request
+        self.capacity = capacity
+        self.timeout = timeout
+        self.refresh = refresh
+        self.queue_len = queue_len
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self.max_requests = max_requests
+        self.clock = clock
+
+        # ip -> [mac, learned_at, refresh_sent], oldest use first
+        self._entries = OrderedDict()
+        # ip -> [port, requests_sent, last_request, deque of packets]
+        self._pending = OrderedDict()
+
+        self.learned = 0
+        self.changed = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.refreshes = 0
+        self.requests = 0
+        self.queued = 0
+        self.released = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _send_request(self, ip, port):
+        self.requests += 1
+        self.request(ip, port)
+
+    def lookup(self, ip, port):
+        """
+        MAC of ip, or None if unknown or expired. `port` is where a refresh
+        request would go.
+        """
+        entry = self._entries.get(ip)
+        if entry is None:
+            return None
+        age = self.clock() - entry[1]
+        if age >= self.timeout:
+            del self._entries[ip]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(ip)
+        if self.refresh and age >= self.refresh and not entry[2]:
+            entry[2] = True
+            self.refreshes += 1
+            self._send_request(ip, port)
+        return entry[0]
+
+    def learn(self, ip, mac):
+        """
+        Record ip -> mac. Returns (old_mac, released): the previous MAC if it
+        changed (else None) and the [(port, packet)] that were waiting for ip.
+        """
+        entry = self._entries.get(ip)
+        old_mac = None
+        if entry is not None and entry[0] != mac:
+            old_mac = entry[0]
+            self.changed += 1
+        self._entries[ip] = [mac, self.clock(), False]
+        self._entries.move_to_end(ip)
+        self.learned += 1
+        while self.capacity and len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        released = []
+        pending = self._pending.pop(ip, None)
+        if pending is not None:
+            released = [(pending[0], packet) for packet in pending[3]]
+            self.released += len(released)
+        return old_mac, released
+
+    def forget(self, ip):
+        return self._entries.pop(ip, None) is not None
+
+    def enqueue(self, ip, port, packet):
+        """
+        Hold packet until ip is resolved; the first one sends the request.
+        Returns False if the packet had to be dropped.
+        """
+        pending = self._pending.get(ip)
+        if pending is None:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            pending = self._pending[ip] = [port, 1, self.clock(), deque()]
+            self._send_request(ip, port)
+        if len(pending[3]) >= self.queue_len:
+            self.dropped += 1
+            return False
+        pending[3].append(packet)
+        self.queued += 1
+        return True
+
+    def tick(self):
+        """
+        Repeat outstanding requests, give up on the ones out of retries and
+        drop expired entries.
+        """
+        now = self.clock()
+        for ip, pending in list(self._pending.items()):
+            if now - pending[2] < self.retry_interval:
+                continue
+            if pending[1] >= self.max_requests:
+                del self._pending[ip]
+                self.dropped += len(pending[3])
+                log.debug("No ARP reply from %s, dropped %d packets", int_to_ip(ip), len(pending[3]))
+                continue
+            pending[1] += 1
+            pending[2] = now
+            self._send_request(ip, pending[0])
+
+        for ip in [ip for ip, e in self._entries.items() if now - e[1] >= self.timeout]:
+            del self._entries[ip]
+            self.expirations += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "pending": len(self._pending),
+            "learned": self.learned,
+            "changed": self.changed,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "refreshes": self.refreshes,
+            "requests": self.requests,
+            "queued": self.queued,
+            "released": self.released,
+            "dropped": self.dropped,
+        }
+
 
 class Part4Controller(object):
     """
     A Connection object for that switch is passed to the __init__ function.
+    The router keeps an ArpCache; the other switches hand ARP replies for
+    the gateway to it and flood the router's requests towards the hosts.
     """
-    # ip_info = {$ip: {"mac": $mac, "port": $port}}
-    ip_info = {}
 
-    def __init__(self, connection):
+    def __init__(self, connection, reconcile=False):
         print(connection.dpid)
         # Keep track of the connection to the switch so that we can
         # send it messages!
         self.connection = connection
+        metrics.meter_connection(connection)
+        # Static rules of this switch; with reconcile they are diffed
+        # against the switch's flow table instead of sent blindly
+        self.reconcile = reconcile
+        self.rules = []
+        self.arp = None
+        self._arp_timer = None
 
         # This binds our PacketIn event listener
         connection.addListeners(self)
@@ -55,19 +294,33 @@ class Part4Controller(object):
             self.s3_setup()
         elif connection.dpid == 21:
             self.cores21_setup()
+            self.arp = ArpCache(self.send_arp_request)
+            self._arp_timer = Timer(ARP_RETRY_INTERVAL, self.arp.tick, recurring=True)
+            _routers[connection.dpid] = self
         elif connection.dpid == 31:
             self.dcs31_setup()
         else:
             print("UNKNOWN SWITCH")
             exit(1)
 
+        if self.reconcile:
+            FlowReconciler(connection, RULE_COOKIE_BASE, self.rules).start()
+
+    def install(self, fm):
+        # Give every static rule a stable cookie (same switch, same order
+        # -> same cookie) so that a reconnect can be reconciled
+        fm.cookie = RULE_COOKIE_BASE | len(self.rules)
+        self.rules.append(fm)
+        if not self.reconcile:
+            self.connection.send(fm)
+
     def s1_setup(self):
         # Allow all traffic to h10
         ip_allow = of.ofp_flow_mod()
         ip_allow.priority = 900
         ip_allow.match.dl_type = 0x0800  # IPv4
         ip_allow.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        self.connection.send(ip_allow)
+        self.install(ip_allow)
 
     def s2_setup(self):
         # Allow all traffic to h20
@@ -75,7 +328,7 @@ class Part4Controller(object):
         ip_allow.priority = 900
         ip_allow.match.dl_type = 0x0800  # IPv4
         ip_allow.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        self.connection.send(ip_allow)
+        self.install(ip_allow)
 
     def s3_setup(self):
         # Allow all traffic to h30
@@ -83,7 +336,7 @@ class Part4Controller(object):
         ip_allow.priority = 900
         ip_allow.match.dl_type = 0x0800  # IPv4
         ip_allow.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        self.connection.send(ip_allow)
+        self.install(ip_allow)
 
     def cores21_setup(self):
         # Block all ICMP traffic from hnotrust
@@ -92,52 +345,29 @@ class Part4Controller(object):
         icmp_drop.match.dl_type = 0x0800  # IPv4
         icmp_drop.match.nw_proto = 1  # Memo: ICMP=1, TCP=6, UDP=17
         icmp_drop.match.nw_src = IPAddr("172.16.10.100") # hnotrust's IP
-        self.connection.send(icmp_drop)
-
-        # If distination ip is 10.0.1.X, send to s1
-        s1_route = of.ofp_flow_mod()
-        s1_route.priority = 900
-        s1_route.match.dl_type = 0x0800  # IPv4
-        s1_route.match.nw_dst = IPAddr("10.0.1.10")
-        s1_route.actions.append(of.ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:00:01")))
-        s1_route.actions.append(of.ofp_action_output(port=1))
-        self.connection.send(s1_route)
-
-        # If distination ip is 10.0.2.X, send to s2
-        s2_route = of.ofp_flow_mod()
-        s2_route.priority = 900
-        s2_route.match.dl_type = 0x0800  # IPv4
-        s2_route.match.nw_dst = IPAddr("10.0.2.20")
-        s2_route.actions.append(of.ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:00:02")))
-        s2_route.actions.append(of.ofp_action_output(port=2))
-        self.connection.send(s2_route)
-
-        # If distination ip is 10.0.3.X, send to s3
-        s3_route = of.ofp_flow_mod()
-        s3_route.priority = 900
-        s3_route.match.dl_type = 0x0800  # IPv4
-        s3_route.match.nw_dst = IPAddr("10.0.3.30")
-        s3_route.actions.append(of.ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:00:03")))
-        s3_route.actions.append(of.ofp_action_output(port=3))
-        self.connection.send(s3_route)
-
-        # If distination ip is 10.0.4.X, send to serv1
-        serv1_route = of.ofp_flow_mod()
-        serv1_route.priority = 900
-        serv1_route.match.dl_type = 0x0800  # IPv4
-        serv1_route.match.nw_dst = IPAddr("10.0.4.10")
-        serv1_route.actions.append(of.ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:00:04")))
-        serv1_route.actions.append(of.ofp_action_output(port=4))
-        self.connection.send(serv1_route)
-
-        # If distination ip is 172.16.10.X, send to hnotrust
-        hnotrust_route = of.ofp_flow_mod()
-        hnotrust_route.priority = 900
-        hnotrust_route.match.dl_type = 0x0800  # IPv4
-        hnotrust_route.match.nw_dst = IPAddr("172.16.10.100")
-        hnotrust_route.actions.append(of.ofp_action_dl_addr.set_dst(EthAddr("00:00:00:00:00:05")))
-        hnotrust_route.actions.append(of.ofp_action_output(port=5))
-        self.connection.send(hnotrust_route)
+        self.install(icmp_drop)
+
+        # One route per subnet (not per host), rewriting dl_dst to the next
+        # hop. OpenFlow 1.0 has no LPM, so longer prefixes get higher priority.
+        for prefix, r in ROUTES.items():
+            if r.next_hop is None:
+                continue  # connected subnet: hosts are resolved with ARP
+            route = of.ofp_flow_mod()
+            route.priority = ROUTE_PRIORITY + int(prefix.split("/")[1])
+            route.match.dl_type = 0x0800  # IPv4
+            route.match.nw_dst = prefix
+            route.actions.append(of.ofp_action_dl_addr.set_dst(r.next_hop))
+            route.actions.append(of.ofp_action_output(port=r.port))
+            self.install(route)
+
+        # The gateway addresses themselves answer pings from the controller
+        for prefix, r in ROUTES.items():
+            to_gateway = of.ofp_flow_mod()
+            to_gateway.priority = GATEWAY_PRIORITY
+            to_gateway.match.dl_type = 0x0800  # IPv4
+            to_gateway.match.nw_dst = int_to_ip(r.gateway)
+            to_gateway.actions.append(of.ofp_action_output(port=of.OFPP_CONTROLLER))
+            self.install(to_gateway)
 
     def dcs31_setup(self):
         # Block all traffic from hnotrust
@@ -145,108 +375,195 @@ class Part4Controller(object):
         ip_drop.priority = 1000
         ip_drop.match.dl_type = 0x0800  # IPv4
         ip_drop.match.nw_src = IPAddr("172.16.10.100") # hnotrust's IP
-        self.connection.send(ip_drop)
+        self.install(ip_drop)
 
         # Allow all other traffic to serv1
         ip_allow = of.ofp_flow_mod()
         ip_allow.priority = 900
         ip_allow.match.dl_type = 0x0800  # IPv4
         ip_allow.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        self.connection.send(ip_allow)
+        self.install(ip_allow)
 
     # used in part 4 to handle individual ARP packets
     # not needed for part 3 (USE RULES!)
     # causes the switch to output packet_in on out_port
     def resend_packet(self, packet_in, out_port):
-        msg = of.ofp_packet_out()
-        msg.data = packet_in
-        action = of.ofp_action_output(port=out_port)
-        msg.actions.append(action)
-        self.connection.send(msg)
+        if isinstance(packet_in, bytes):
+            self.connection.send(PACKET_OUT.build(out_port, packet_in))
+            return
+        resend = _forwarding.buffer_or_data(packet_in)
+        if resend is not None:
+            self.connection.send(PACKET_OUT.build(out_port, resend[1], resend[0],
+                                                  packet_in.in_port))
+
+    def send_arp_request(self, ip, port):
+        """
+        Ask who has `ip`, from the gateway address of its subnet.
+        """
+        route = ROUTES.lookup(ip)
+        if route is None:
+            return
+        self.connection.send(ARP_REQUEST.build(port, route.gateway, ip))
+
+    def _forward(self, packet_in, port, mac):
+        resend = _forwarding.buffer_or_data(packet_in)
+        if resend is not None:
+            self.connection.send(FORWARD.build(port, resend[1], resend[0], packet_in.in_port, mac))
 
+    def _install_host_route(self, ip, port, mac):
+        # More specific than the subnet flows, and aged like the ARP entry
+        self.connection.send(HOST_ROUTE.build(ip, mac, port))
+
+    def arp_learned(self, ip, mac):
+        """
+        The router learned ip -> mac (from any switch): release what was
+        waiting for it.
+        """
+        old_mac, released = self.arp.learn(ip, mac)
+        if old_mac is not None:
+            fm = of.ofp_flow_mod()
+            fm.command = of.OFPFC_DELETE_STRICT
+            fm.priority = HOST_ROUTE_PRIORITY
+            fm.match.dl_type = 0x0800
+            fm.match.nw_dst = int_to_ip(ip)
+            self.connection.send(fm)
+        if released:
+            self._install_host_route(ip, released[0][0], mac)
+            for port, packet_in in released:
+                self._forward(packet_in, port, mac)
+
+    def route_packet(self, packet_in, receiver_ip):
+        """
+        Slow path of the router: same LPM as its subnet flows, then the ARP
+        cache for the destination's MAC.
+        """
+        route = ROUTES.lookup(receiver_ip)
+        if route is None:
+            log.debug("No route to %s", int_to_ip(receiver_ip))
+            return
+        mac = self.arp.lookup(receiver_ip, route.port)
+        if mac is not None:
+            self._install_host_route(receiver_ip, route.port, mac)
+            self._forward(packet_in, route.port, mac)
+        elif route.next_hop is not None:
+            # the subnet flow covers the next packets, just send this one
+            self._forward(packet_in, route.port, route.next_hop)
+        else:
+            self.arp.enqueue(receiver_ip, route.port, packet_in)
+
+    def _handle_ConnectionDown(self, event):
+        if self._arp_timer is not None:
+            self._arp_timer.cancel()
+        if _routers.get(self.connection.dpid) is self:
+            del _routers[self.connection.dpid]
+
+    @metrics.timed_packet_in("a2part2")
     def _handle_PacketIn(self, event):
         """
         Packets not handled by the router rules will be
         forwarded to this method to be handled by the controller
         """
 
-        packet = event.parsed  # This is the parsed packet data.
-        if not packet.parsed:
+        packet_in = event.ofp  # The actual ofp_packet_in message.
+        # Addresses are read straight from the frame (IPs as ints, MACs as
+        # raw bytes); the full parse (event.parsed) is only for traces
+        headers = Headers(packet_in.data)
+        if not headers.complete:
             log.warning("Ignoring incomplete packet")
             return
+        tracer.trace("packet", describe_packet_in, event)
 
-        packet_in = event.ofp  # The actual ofp_packet_in message.
-        print(
-            "Unhandled packet from " + str(self.connection.dpid) + ":" + packet.dump()
-        )
-
-        if packet.type == packet.ARP_TYPE:
-            arp_packet = packet.payload
-            sender_ip = arp_packet.protosrc
-            sender_mac = arp_packet.hwsrc
+        arp_packet = headers.arp()
+        ip_packet = headers.ipv4()
+        if arp_packet is not None:
+            opcode, sender_mac, sender_ip, target_ip = arp_packet
             in_port = event.port
-            self.ip_info[sender_ip] = {"mac": sender_mac, "port": in_port}
+            router = _routers.get(ROUTER_DPID)
+            if (router is not None and sender_mac != _GATEWAY_MAC_RAW
+                    and ROUTES.lookup(sender_ip) is not None):
+                router.arp_learned(sender_ip, sender_mac)
 
             # Handle ARP request to get the gateway's MAC address
-            if arp_packet.opcode == 1: # ARE request
-                target_ip = arp_packet.protodst
-                if str(target_ip).endswith(".1"): # if target_ip is in the same subnet as one of the hosts, reply with that host's MAC
-                    arp_reply = arp()
-                    arp_reply.opcode = arp.REPLY
-                    arp_reply.hwsrc = EthAddr("00:00:00:00:00:99") # Fake Gateway MAC
-                    arp_reply.hwdst = sender_mac      # sender MAC, e.g. h10's MAC
-                    arp_reply.protosrc = target_ip    # Gateway's IP
-                    arp_reply.protodst = sender_ip    # Sender's IP
-
-                    eth = ethernet()
-                    eth.type = ethernet.ARP_TYPE
-                    eth.src = EthAddr("00:00:00:00:00:99")
-                    eth.dst = sender_mac
-                    eth.payload = arp_reply
-
-                    self.resend_packet(eth.pack(), in_port)
-
-            elif arp_packet.opcode == 2: # ARE reply
-                pass
-        elif packet.type == packet.IP_TYPE:
-            ip_packet = packet.payload
-            sender_ip = ip_packet.srcip
-            receiver_ip = ip_packet.dstip
-            sender_mac = packet.src
-            in_port = event.port
-            self.ip_info[sender_ip] = {"mac": sender_mac, "port": in_port}
-
-            if receiver_ip in self.ip_info:
-                dst_port = self.ip_info[receiver_ip]["port"]
-                dst_mac = self.ip_info[receiver_ip]["mac"]
-
-                # learn flow rule
-                fm = of.ofp_flow_mod()
-                fm.priority = 1000
-                fm.match.nw_dst = receiver_ip
-                fm.match.dl_type = 0x0800
-                fm.actions.append(of.ofp_action_dl_addr.set_dst(dst_mac))
-                fm.actions.append(of.ofp_action_output(port=dst_port))
-                self.connection.send(fm)
-
-                # resend the packet
-                msg = of.ofp_packet_out()
-                msg.data = packet_in
-                msg.actions.append(of.ofp_action_dl_addr.set_dst(dst_mac))
-                msg.actions.append(of.ofp_action_output(port=dst_port))
-                self.connection.send(msg)
+            if opcode == 1: # ARE request
+                if target_ip & 0xff == 1: # x.x.x.1: the gateway of the sender's subnet
+                    # Fake gateway MAC, from the gateway's IP to the sender (e.g. h10)
+                    self.connection.send(ARP_REPLY.build(in_port, target_ip, sender_ip, sender_mac))
+                    metrics.decision("a2part2", self.connection.dpid, "arp_reply")
+
+                elif self.connection.dpid != ROUTER_DPID:
+                    # e.g. the router resolving a host: pass it on
+                    self.resend_packet(packet_in, of.OFPP_FLOOD)
+                    metrics.decision("a2part2", self.connection.dpid, "flood")
+
+            elif opcode == 2: # ARE reply
+                pass # learned above
+        elif ip_packet is not None:
+            receiver_ip = ip_packet[2]
+
+            if self.connection.dpid == ROUTER_DPID:
+                route = ROUTES.lookup(receiver_ip)
+                if route is not None and route.gateway == receiver_ip:
+                    # ping to the gateway; anything else for it is dropped
+                    reply = ECHO_REPLY.build(event.port, packet_in.data)
+                    if reply is not None:
+                        self.connection.send(reply)
+                        metrics.decision("a2part2", self.connection.dpid, "echo_reply")
+                    return
+                self.route_packet(packet_in, receiver_ip)
+                metrics.decision("a2part2", self.connection.dpid, "route")
+            else:
+                # same as the edge switch's IPv4 rule
+                self.resend_packet(packet_in, of.OFPP_FLOOD)
+                metrics.decision("a2part2", self.connection.dpid, "flood")
 
         else:
-            print("Unknown packet type: " + str(packet.type))
+            tracer.trace("packet", "Unknown packet type: 0x%04x", headers.dl_type)
             return
 
-def launch():
+def _log_stats():
+    for dpid, router in sorted(_routers.items()):
+        log.info("dpid=%s ARP: %s", dpid,
+                 " ".join("%s=%s" % kv for kv in sorted(router.arp.stats().items())))
+    log.info("packet-outs: %s", " ".join("%s=%s" % kv for kv in sorted(_forwarding.stats().items())))
+    if core.hasComponent("flow_stats"):
+        # top talkers through the router, from cse561.flowstats
+        for rate, flow in core.flow_stats.top_flows(ROUTER_DPID, TOP_TALKERS):
+            log.info("dpid=%s flow nw_src=%s nw_dst=%s: %.0f bytes/s", ROUTER_DPID,
+                     flow.match.nw_src, flow.match.nw_dst, rate)
+
+
+def _register_metrics():
+    # Read when /metrics is scraped (see cse561.metrics); the ARP cache is
+    # what replaced the old ip_info table
+    metrics.stats_collector(
+        "cse561_a2part2_arp_cache", "Router ARP cache size and counters", ("dpid",),
+        lambda: dict((dpid, router.arp.stats()) for dpid, router in list(_routers.items())))
+    metrics.stats_collector(
+        "cse561_a2part2_packet_outs_total", "a2part2 packet-out buffering counters", (),
+        lambda: {(): _forwarding.stats()}, kind="counter")
+
+
+def launch(reconcile=False, stats_interval=0, miss_send_len=None):
     """
     Starts the component
+
+    --reconcile keeps switch flow tables across controller restarts and
+    only sends the rules that are missing or stale on (re)connect.
+    --stats_interval=S logs the router's ARP cache and packet-out counters
+    every S seconds, and its busiest flows if cse561.flowstats is running.
+    --miss_send_len=N has switches send at most N bytes of a table-miss
+    packet and buffer the rest.
     """
+    reconcile = str(reconcile).lower() != "false"
+    if reconcile:
+        keep_flows_on_connect()
+    set_miss_send_len(miss_send_len)
+    if float(stats_interval) > 0:
+        Timer(float(stats_interval), _log_stats, recurring=True)
 
     def start_switch(event):
         log.debug("Controlling %s" % (event.connection,))
-        Part4Controller(event.connection)
+        Part4Controller(event.connection, reconcile=reconcile)
 
     core.openflow.addListenerByName("ConnectionUp", start_switch)
+    _register_metrics()
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+#
+# Measure how long forwarding is broken when a link fails.
+#
+# Starts the project1 ext2 topology (three switches, two parallel s1-s2
+# links and an s1-s3-s2 detour) against a running controller, pings
+# h1 -> h4 every few milliseconds, takes a link down and reports the
+# longest run of lost pings after the failure, i.e. the time from
+# link-down to restored forwarding.
+#
+# Usage (the controller must already be running):
+#   sudo ~/pox/pox.py project1.a1ext2controller &
+#   sudo python3 tools/failover_time.py                     # all s1-s2 links
+#   sudo python3 tools/failover_time.py --intf s1-eth4      # just one of them
+#   sudo python3 tools/failover_time.py --runs 5 --json failover.json
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from mininet.log import setLogLevel
+from mininet.net import Mininet
+from mininet.node import RemoteController
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "project1", "topos"))
+
+from ext2 import ext2_topo  # noqa: E402
+
+SEQ_RE = re.compile(r"icmp_seq=(\d+)")
+
+
+def wait_for_reachability(net, src, dst, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if net.ping([src, dst], timeout="1") == 0:
+            return True
+        time.sleep(1)
+    return False
+
+
+def outage(seqs, interval, fail_seq):
+    """
+    Longest gap in received icmp_seqs at or after the failure, in seconds.
+    Returns (seconds, lost_pings).
+    """
+    got = sorted(s for s in seqs if s >= fail_seq - 1)
+    if len(got) < 2:
+        return None, None
+    worst = max(b - a for a, b in zip(got, got[1:]))
+    lost = worst - 1
+    return lost * interval, lost
+
+
+def run_once(net, args):
+    h1, h4 = net.get("h1"), net.get("h4")
+    count = int((args.before + args.after) / args.interval)
+    out = "/tmp/failover_ping_%d.txt" % (os.getpid(),)
+    h1.cmd("ping -n -i %s -c %d %s > %s 2>&1 &" % (args.interval, count, h4.IP(), out))
+
+    time.sleep(args.before)
+    fail_seq = int(args.before / args.interval)
+    if args.intf:
+        node = net.get(args.intf.split("-")[0])
+        node.intf(args.intf).ifconfig("down")
+    else:
+        net.configLinkStatus(args.link[0], args.link[1], "down")
+    down_at = time.time()
+
+    h1.cmd("wait")
+    with open(out) as f:
+        seqs = [int(m.group(1)) for m in SEQ_RE.finditer(f.read())]
+    os.unlink(out)
+
+    # bring everything back for the next run
+    if args.intf:
+        node.intf(args.intf).ifconfig("up")
+    else:
+        net.configLinkStatus(args.link[0], args.link[1], "up")
+
+    seconds, lost = outage(seqs, args.interval, fail_seq)
+    return {
+        "down_at": down_at,
+        "sent": count,
+        "received": len(seqs),
+        "lost_after_failure": lost,
+        "convergence_ms": None if seconds is None else seconds * 1000,
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description="Measure failover time on the ext2 topology")
+    p.add_argument("--controller-ip", default="127.0.0.1")
+    p.add_argument("--controller-port", type=int, default=6633)
+    p.add_argument("--link", nargs=2, default=["s1", "s2"], metavar=("A", "B"),
+                   help="take down every link between these switches")
+    p.add_argument("--intf", help="take down this one interface instead (e.g. s1-eth4)")
+    p.add_argument("--interval", type=float, default=0.01, help="ping interval (s)")
+    p.add_argument("--before", type=float, default=2.0, help="seconds of pings before the failure")
+    p.add_argument("--after", type=float, default=8.0, help="seconds of pings after it")
+    p.add_argument("--runs", type=int, default=1)
+    p.add_argument("--settle", type=float, default=15.0,
+                   help="seconds to let discovery and the tree settle between runs")
+    p.add_argument("--json", help="write the results to this file")
+    args = p.parse_args()
+
+    setLogLevel("warning")
+    net = Mininet(topo=ext2_topo(), controller=None)
+    net.addController("c0", controller=RemoteController,
+                      ip=args.controller_ip, port=args.controller_port)
+    net.start()
+    results = []
+    try:
+        for run in range(args.runs):
+            time.sleep(args.settle)
+            if not wait_for_reachability(net, net.get("h1"), net.get("h4"), 30):
+                print("run %d: h1 cannot reach h4 before the failure, skipping" % (run,))
+                continue
+            r = run_once(net, args)
+            results.append(r)
+            print("run %d: convergence %s ms (%s pings lost, %d/%d received)" % (
+                run, "n/a" if r["convergence_ms"] is None else "%.0f" % r["convergence_ms"],
+                r["lost_after_failure"], r["received"], r["sent"]))
+    finally:
+        net.stop()
+
+    times = sorted(r["convergence_ms"] for r in results if r["convergence_ms"] is not None)
+    if times:
+        print("convergence ms: min %.0f median %.0f max %.0f" % (
+            times[0], times[len(times) // 2], times[-1]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "runs": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+#
+# Packet-in decoding benchmark: POX's full parse (what event.parsed does,
+# ethernet(data) and every header below it) against the struct-based
+# Headers in cse561/headers.py, reading the fields the controllers use:
+# MACs, ethertype, and the ARP or IPv4 addresses.
+#
+# For each frame kind it reports ns per packet and the bytes allocated
+# while decoding one (tracemalloc peak). POX is optional: without it only
+# Headers is measured.
+#
+# Usage:
+#   python3 tools/header_bench.py                      # Headers only
+#   python3 tools/header_bench.py --pox-dir ~/pox --check
+#   python3 tools/header_bench.py --count 200000 --json headers.json
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from cse561.headers import ETH_TYPE_ARP, ETH_TYPE_IP, Headers  # noqa: E402
+from cse561.templates import _checksum  # noqa: E402
+
+SRC_MAC = b"\x00\x00\x00\x00\x00\x01"
+DST_MAC = b"\x00\x00\x00\x00\x00\x02"
+SRC_IP = (10 << 24) | (1 << 8) | 10  # 10.0.1.10
+DST_IP = (10 << 24) | (2 << 8) | 20  # 10.0.2.20
+
+
+def _ipv4(proto, payload):
+    ip = bytearray(struct.pack("!BBHHHBBHLL", 0x45, 0, 20 + len(payload), 1, 0, 64, proto, 0,
+                               SRC_IP, DST_IP))
+    ip[10:12] = struct.pack("!H", _checksum(ip))
+    return DST_MAC + SRC_MAC + struct.pack("!H", ETH_TYPE_IP) + bytes(ip) + payload
+
+
+def make_frames():
+    """
+    kind -> frame: an ARP request, a 98-byte ping and a full-size TCP segment.
+    """
+    arp = struct.pack("!HHBBH6sL6sL", 1, ETH_TYPE_IP, 6, 4, 1, SRC_MAC, SRC_IP, b"\x00" * 6, DST_IP)
+    icmp = bytearray(struct.pack("!BBHHH", 8, 0, 0, 1, 1) + b"x" * 56)
+    icmp[2:4] = struct.pack("!H", _checksum(icmp))
+    tcp = struct.pack("!HHLLBBHHH", 5001, 40000, 1, 0, 5 << 4, 0x10, 65535, 0, 0) + b"x" * 1460
+    return {
+        "arp": b"\xff" * 6 + SRC_MAC + struct.pack("!H", ETH_TYPE_ARP) + arp,
+        "ping": _ipv4(1, bytes(icmp)),
+        "tcp_1514": _ipv4(6, tcp),
+    }
+
+
+def decode_headers(data):
+    h = Headers(data)
+    fields = (h.dl_src, h.dl_dst, h.dl_type)
+    if h.dl_type == ETH_TYPE_ARP:
+        op, _, spa, tpa = h.arp()
+        return fields + (op, spa, tpa)
+    proto, src, dst = h.ipv4()
+    return fields + (proto, src, dst)
+
+
+def pox_decoder():
+    from pox.lib.packet.ethernet import ethernet
+
+    def decode_pox(data):
+        p = ethernet(data)
+        fields = (p.src.toRaw(), p.dst.toRaw(), p.type)
+        a = p.find("arp")
+        if a is not None:
+            return fields + (a.opcode, a.protosrc.toUnsigned(), a.protodst.toUnsigned())
+        ip = p.find("ipv4")
+        return fields + (ip.protocol, ip.srcip.toUnsigned(), ip.dstip.toUnsigned())
+    return decode_pox
+
+
+def load_pox(pox_dir):
+    pox_dir = os.path.expanduser(pox_dir)
+    if pox_dir not in sys.path:
+        sys.path.insert(0, pox_dir)
+    try:
+        import pox.lib.packet.ethernet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def measure(decode, data, count, samples=200):
+    for _ in range(min(count, 1000)):
+        decode(data)
+    t = time.perf_counter()
+    for _ in range(count):
+        decode(data)
+    ns = (time.perf_counter() - t) / count * 1e9
+
+    tracemalloc.start()
+    peak = 0
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fields = decode(data)
+        peak += tracemalloc.get_traced_memory()[1] - base
+        del fields
+    tracemalloc.stop()
+    return {"ns_per_pkt": ns, "pkts_per_s": 1e9 / ns if ns else 0.0,
+            "alloc_bytes": peak / float(samples)}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="POX full parse vs struct header decoding")
+    p.add_argument("--count", type=int, default=100000, help="packets per frame kind")
+    p.add_argument("--pox-dir", default=os.environ.get("POX_DIR", "~/pox"),
+                   help="POX checkout (default: $POX_DIR or ~/pox); optional")
+    p.add_argument("--check", action="store_true",
+                   help="check that both decoders return the same fields (needs POX)")
+    p.add_argument("--json", help="write results to this file")
+    args = p.parse_args(argv)
+
+    frames = make_frames()
+    decoders = [("headers", decode_headers)]
+    if load_pox(args.pox_dir):
+        decoders.insert(0, ("pox", pox_decoder()))
+    else:
+        print("POX not found in %s, measuring Headers only" % (args.pox_dir,))
+        if args.check:
+            sys.exit("--check needs POX (use --pox-dir)")
+
+    if args.check:
+        decode_pox = decoders[0][1]
+        for kind, data in sorted(frames.items()):
+            ok = decode_pox(data) == decode_headers(data)
+            print("%-9s %s" % (kind, "ok" if ok else "MISMATCH"))
+            if not ok:
+                sys.exit("pox %r\nheaders %r" % (decode_pox(data), decode_headers(data)))
+
+    results = {}
+    print("%-9s %-8s %10s %12s %12s" % ("frame", "decoder", "ns/pkt", "pkts/s", "alloc bytes"))
+    for kind, data in sorted(frames.items()):
+        for name, decode in decoders:
+            r = measure(decode, data, args.count)
+            results.setdefault(kind, {})[name] = r
+            print("%-9s %-8s %10.0f %12.0f %12.0f" % (
+                kind, name, r["ns_per_pkt"], r["pkts_per_s"], r["alloc_bytes"]))
+        if len(decoders) > 1:
+            pox, ours = results[kind]["pox"], results[kind]["headers"]
+            print("%-9s %-8s %9.1fx %12s %11.1fx" % (
+                "", "speedup", pox["ns_per_pkt"] / ours["ns_per_pkt"], "",
+                pox["alloc_bytes"] / max(ours["alloc_bytes"], 1.0)))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "args": vars(args),
+                "python": sys.version.split()[0],
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Packet-in latency while a large topology is recomputed, with the
+# computation on POX's thread (inline) or offloaded to a worker thread or
+# process through cse561/offload.py.
+#
+# Builds a random connected topology of --switches switches (a random tree
+# plus --extra more links) as an a1ext2controller SpanningTree, then runs
+# a small event loop standing in for POX's: every --period seconds a
+# packet-in is handled (a header decode), and callbacks from the
+# offloader are run in between. At the start the loop does what a1ext2
+# does after a link change: snapshot the tree and submit the backup plan
+# computation. It reports how late packet-ins were handled while that
+# ran, and how long the result took to arrive.
+#
+# Usage:
+#   python3 tools/offload_bench.py --pox-dir ~/pox
+#   python3 tools/offload_bench.py --switches 1000 --modes inline,process --json offload.json
+
+import argparse
+import importlib
+import json
+import os
+import queue
+import random
+import struct
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# 98-byte ping, decoded by every simulated packet-in
+FRAME = (b"\x00\x00\x00\x00\x00\x02\x00\x00\x00\x00\x00\x01\x08\x00"
+         + struct.pack("!BBHHHBBHLL", 0x45, 0, 84, 1, 0, 64, 1, 0, 0x0a00010a, 0x0a000214)
+         + b"\x08\x00" + b"\x00" * 62)
+
+
+def load_pox(pox_dir):
+    pox_dir = os.path.expanduser(pox_dir)
+    if pox_dir not in sys.path:
+        sys.path.insert(0, pox_dir)
+    try:
+        import pox.core  # noqa: F401
+    except ImportError:
+        sys.exit("Cannot import POX from %s (use --pox-dir)" % (pox_dir,))
+    if "project1" not in sys.modules:
+        pkg = types.ModuleType("project1")
+        pkg.__path__ = [os.path.join(ROOT, "project1", "pox")]
+        sys.modules["project1"] = pkg
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def make_topology(mod, switches, extra, rng):
+    """
+    (SpanningTree, {dpid: inter-switch ports}) of a random connected graph.
+    """
+    tree = mod.SpanningTree()
+    next_port = dict((dpid, 1) for dpid in range(1, switches + 1))
+
+    def link(u, v):
+        up, vp = next_port[u], next_port[v]
+        next_port[u] += 1
+        next_port[v] += 1
+        tree.add_link(u, up, v, vp)
+
+    for v in range(2, switches + 1):
+        link(rng.randint(1, v - 1), v)
+    for _ in range(extra):
+        u, v = rng.sample(range(1, switches + 1), 2)
+        link(u, v)
+    ports = dict((u, set(adj)) for u, adj in tree.adj.items())
+    return tree, ports
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(mode, mod, tree, ports, args):
+    from cse561.headers import Headers
+    from cse561.offload import Offloader
+
+    callbacks = queue.Queue()
+    offloader = Offloader(mode, 1, call_later=lambda fn, *a: callbacks.put((fn, a)))
+    result = {}
+
+    def applied(backups):
+        result["plans"] = len(backups)
+        result["applied_at"] = time.perf_counter()
+
+    delays = []
+    start = time.perf_counter()
+    next_packet = start
+    submitted = False
+    while "applied_at" not in result or time.perf_counter() < result["applied_at"] + args.after:
+        now = time.perf_counter()
+        if not submitted and now >= start + args.before:
+            # what a1ext2 does after a link change, on the event loop
+            submitted = True
+            result["submitted_at"] = now
+            snapshot = (tree.copy(), dict((d, set(p)) for d, p in ports.items()), list(ports))
+            offloader.submit("backups", mod._compute_backups, snapshot, applied)
+        while True:
+            try:
+                fn, a = callbacks.get_nowait()
+            except queue.Empty:
+                break
+            fn(*a)
+        if now >= next_packet:
+            Headers(FRAME).ipv4()
+            delays.append(time.perf_counter() - next_packet)
+            next_packet += args.period
+            if next_packet < now:
+                next_packet = now  # don't try to catch up on missed ones
+        else:
+            time.sleep(min(args.period / 10, next_packet - now))
+    offloader.configure("inline")  # shuts the workers down
+
+    ms = [d * 1000 for d in delays]
+    return {
+        "compute_s": result["applied_at"] - result["submitted_at"],
+        "plans": result["plans"],
+        "packet_ins": len(ms),
+        "p50_ms": percentile(ms, 0.5),
+        "p99_ms": percentile(ms, 0.99),
+        "max_ms": max(ms) if ms else 0.0,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Packet-in latency during a topology recompute")
+    p.add_argument("--pox-dir", default=os.environ.get("POX_DIR", "~/pox"),
+                   help="POX checkout (default: $POX_DIR or ~/pox)")
+    p.add_argument("--switches", type=int, default=1000)
+    p.add_argument("--extra", type=int, help="links beyond the tree (default: switches / 2)")
+    p.add_argument("--modes", default="inline,thread,process",
+                   help="comma-separated: inline, thread, process")
+    p.add_argument("--period", type=float, default=0.001, help="seconds between packet-ins")
+    p.add_argument("--before", type=float, default=0.2, help="seconds of packet-ins before the recompute")
+    p.add_argument("--after", type=float, default=0.2, help="and after its result is applied")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--json", help="write results to this file")
+    args = p.parse_args(argv)
+
+    load_pox(args.pox_dir)
+    mod = importlib.import_module("project1.a1ext2controller")
+    extra = args.switches // 2 if args.extra is None else args.extra
+    tree, ports = make_topology(mod, args.switches, extra, random.Random(args.seed))
+    print("%d switches, %d links" % (args.switches, len(tree)))
+
+    results = {}
+    print("%-8s %10s %7s %10s %9s %9s %9s" % (
+        "mode", "compute s", "plans", "packet-ins", "p50 ms", "p99 ms", "max ms"))
+    for mode in args.modes.split(","):
+        r = results[mode] = run(mode, mod, tree, ports, args)
+        print("%-8s %10.2f %7d %10d %9.2f %9.2f %9.2f" % (
+            mode, r["compute_s"], r["plans"], r["packet_ins"], r["p50_ms"], r["p99_ms"],
+            r["max_ms"]))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "args": vars(args),
+                "python": sys.version.split()[0],
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# Record the OpenFlow messages between switches and POX.
+#
+# Sits between the two as a TCP relay: switches connect to --listen (the
+# port Mininet's RemoteController uses), and every connection is relayed
+# to the controller at --controller. Each message, in both directions, is
+# written with its arrival time to a binary log (cse561/oflog.py) before
+# it is passed on. tools/ofreplay.py replays the log offline.
+#
+# Only needs the standard library.
+#
+# Usage:
+#   ~/pox/pox.py project1.a1ext2controller openflow.of_01 --port=6634 &
+#   python3 tools/ofrecord.py ext2.oflog.gz --listen 6633 --controller 127.0.0.1:6634 &
+#   sudo python3 project1/topos/ext2.py
+#   # Ctrl-C the recorder when done
+
+import argparse
+import asyncio
+import collections
+import os
+import struct
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from cse561 import oflog  # noqa: E402
+
+OFP_HEADER = struct.Struct("!BBHL")
+
+
+class Recorder(object):
+    def __init__(self, writer, controller_host, controller_port, flush_every):
+        self.log = writer
+        self.controller_host = controller_host
+        self.controller_port = controller_port
+        self.flush_every = flush_every
+        self.next_conn = 0
+        self.counts = collections.Counter()  # (kind, type name) -> messages
+
+    def record(self, conn, kind, data=b""):
+        self.log.write(time.time(), conn, kind, data)
+        if data:
+            self.counts[(kind, oflog.label(data))] += 1
+        if self.log.records % self.flush_every == 0:
+            self.log.flush()
+
+    async def relay(self, conn, kind, reader, writer):
+        """
+        Copy whole OpenFlow messages from reader to writer, logging each.
+        """
+        try:
+            while True:
+                header = await reader.readexactly(OFP_HEADER.size)
+                length = OFP_HEADER.unpack(header)[2]
+                if length < OFP_HEADER.size:
+                    print("connection %d: bad message length %d, closing" % (conn, length),
+                          file=sys.stderr)
+                    return
+                body = await reader.readexactly(length - OFP_HEADER.size)
+                self.record(conn, kind, header + body)
+                writer.write(header + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+        finally:
+            writer.close()
+
+    async def handle_switch(self, sw_reader, sw_writer):
+        conn = self.next_conn
+        self.next_conn = (self.next_conn + 1) & 0xffff
+        try:
+            ctl_reader, ctl_writer = await asyncio.open_connection(
+                self.controller_host, self.controller_port)
+        except OSError as e:
+            print("connection %d: cannot reach the controller: %s" % (conn, e), file=sys.stderr)
+            sw_writer.close()
+            return
+        self.record(conn, oflog.CONNECT)
+        try:
+            # Either side closing ends both directions
+            tasks = [
+                asyncio.ensure_future(self.relay(conn, oflog.TO_CONTROLLER, sw_reader, ctl_writer)),
+                asyncio.ensure_future(self.relay(conn, oflog.TO_SWITCH, ctl_reader, sw_writer)),
+            ]
+            _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            ctl_writer.close()
+            sw_writer.close()
+        finally:
+            self.record(conn, oflog.CLOSE)
+            self.log.flush()
+
+
+async def serve(args, recorder):
+    server = await asyncio.start_server(recorder.handle_switch, args.address, args.listen)
+    print("Relaying %s:%d -> %s:%d into %s" % (
+        args.address, args.listen, recorder.controller_host, recorder.controller_port, args.log))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Record OpenFlow messages between switches and POX")
+    p.add_argument("log", help="log to write (.gz to compress)")
+    p.add_argument("--address", default="127.0.0.1", help="address to listen on for switches")
+    p.add_argument("--listen", type=int, default=6633, help="port to listen on for switches")
+    p.add_argument("--controller", default="127.0.0.1:6634", help="where POX listens, HOST:PORT")
+    p.add_argument("--flush-every", type=int, default=1000, help="flush the log every N records")
+    args = p.parse_args(argv)
+
+    host, _, port = args.controller.rpartition(":")
+    writer = oflog.LogWriter(args.log, time.time())
+    recorder = Recorder(writer, host or "127.0.0.1", int(port), max(1, args.flush_every))
+    try:
+        asyncio.run(serve(args, recorder))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+
+    print("%d records, %d connections" % (writer.records, recorder.next_conn))
+    for (kind, name), n in sorted(recorder.counts.items()):
+        print("  %-14s %-24s %8d" % (oflog.KIND_NAMES[kind], name, n))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+#
+# Replay a recorded OpenFlow log (tools/ofrecord.py) into POX controller
+# modules offline, and compare what they send and how long they take
+# with the recording and with an earlier replay.
+#
+# The components are launched as POX would launch them from its command
+# line, on top of a real core.openflow. Every switch connection in the log
+# becomes a stand-in connection object, and the switch side of the log
+# (features replies, packet-ins, port status, stats and barrier replies,
+# errors, closes) is turned into the events POX would raise for it, on
+# POX's own thread, one message at a time. The time each event takes the
+# components is measured per message type, and whatever they send is
+# kept.
+#
+# The outputs are compared with the messages the controller sent in the
+# recording (xids ignored, POX's own handshake and echo traffic left
+# out), and with --baseline, the JSON of an earlier replay of the same log:
+# the outputs must be the same and no message type may have got more than
+# --tolerance slower. Either difference makes the exit status 1.
+#
+# Offloaded computations (cse561.offload) run inline, so the outputs don't
+# depend on worker timing; add cse561.offload --mode=thread to the
+# components to change that. Timer-driven messages (discovery's LLDP,
+# statistics polling) depend on the replay speed; LLDP is left out of the
+# comparison by default (--ignore).
+#
+# Usage:
+#   python3 tools/ofreplay.py ext2.oflog.gz -- project1.a1ext2controller --multipath
+#   python3 tools/ofreplay.py ext2.oflog.gz --json today.json -- project1.a1ext2controller
+#   python3 tools/ofreplay.py ext2.oflog.gz --baseline today.json -- project1.a1ext2controller
+#   python3 tools/ofreplay.py p3.oflog.gz --speed 1 -- project2.a2part1controller
+
+import argparse
+import collections
+import hashlib
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+PACKAGES = {
+    "project1": os.path.join(ROOT, "project1", "pox"),
+    "project2": os.path.join(ROOT, "project2", "pox"),
+}
+
+# Sent by POX itself (of_01), not by the components
+POX_OWN = ("hello", "echo_request", "echo_reply", "features_request",
+           "get_config_request", "set_config")
+
+DISPATCH_TIMEOUT = 60.0  # seconds to wait for POX's thread to take a message
+
+
+def load_pox(pox_dir):
+    pox_dir = os.path.expanduser(pox_dir)
+    if pox_dir not in sys.path:
+        sys.path.insert(0, pox_dir)
+    try:
+        import pox.core  # noqa: F401
+    except ImportError:
+        sys.exit("Cannot import POX from %s (use --pox-dir)" % (pox_dir,))
+
+    for name, path in PACKAGES.items():
+        if name not in sys.modules:
+            pkg = types.ModuleType(name)
+            pkg.__path__ = [path]
+            sys.modules[name] = pkg
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def parse_components(argv):
+    """
+    POX-style ["a.b", "--x=1", "--y", "c.d"] -> [("a.b", {"x": "1", "y": True}), ("c.d", {})].
+    """
+    components = []
+    for arg in argv:
+        if arg.startswith("--"):
+            if not components:
+                sys.exit("option %s before any component" % (arg,))
+            key, eq, value = arg[2:].partition("=")
+            components[-1][1][key.replace("-", "_")] = value if eq else True
+        else:
+            components.append((arg, {}))
+    return components
+
+
+def launch_components(components):
+    for name, options in components:
+        module = None
+        # POX looks in ext/ (our packages) first, then in pox/
+        for candidate in (name, "pox." + name):
+            try:
+                module = importlib.import_module(candidate)
+                break
+            except ImportError as e:
+                if e.name is not None and not candidate.startswith(e.name):
+                    raise
+        if module is None:
+            sys.exit("No component %s" % (name,))
+        module.launch(**options)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = int(round((len(sorted_values) - 1) * pct / 100.0))
+    return sorted_values[k]
+
+
+class Replayer(object):
+    """
+    Turns the log's switch-side messages into POX events. Runs on POX's
+    thread (see dispatch()).
+    """
+
+    def __init__(self, ignore):
+        import pox.openflow as pof
+        import pox.openflow.libopenflow_01 as of
+        from pox.core import core
+        from pox.lib.revent import EventMixin
+        from cse561 import oflog
+
+        self.of = of
+        self.pof = pof
+        self.oflog = oflog
+        self.nexus = core.openflow
+        self.ignore = set(ignore)
+        self.stats_events = {
+            of.OFPST_DESC: pof.SwitchDescReceived,
+            of.OFPST_FLOW: pof.FlowStatsReceived,
+            of.OFPST_AGGREGATE: pof.AggregateFlowStatsReceived,
+            of.OFPST_TABLE: pof.TableStatsReceived,
+            of.OFPST_PORT: pof.PortStatsReceived,
+            of.OFPST_QUEUE: pof.QueueStatsReceived,
+        }
+        replayer = self
+
+        class ReplayConnection(EventMixin):
+            """
+            Stands in for pox.openflow.of_01.Connection: keeps what the
+            components send.
+            """
+
+            _eventMixin_events = set([
+                pof.ConnectionUp, pof.ConnectionDown, pof.PortStatus, pof.FlowRemoved,
+                pof.PacketIn, pof.ErrorIn, pof.BarrierIn, pof.RawStatsReply,
+                pof.SwitchDescReceived, pof.FlowStatsReceived, pof.AggregateFlowStatsReceived,
+                pof.TableStatsReceived, pof.PortStatsReceived, pof.QueueStatsReceived,
+            ])
+
+            def __init__(self, number):
+                self.ID = number + 1
+                self.dpid = None
+                self.features = None
+                self.ports = {}
+                self.disconnected = False
+                self.up = False
+                self.sent = []
+
+            def send(self, data):
+                if self.disconnected:
+                    return
+                if not isinstance(data, (bytes, bytearray)):
+                    data = data.pack()
+                self.sent.append(bytes(data))
+                replayer.sent_by_label[oflog.label(data)] += 1
+
+        self.Connection = ReplayConnection
+        self.connections = {}  # log connection number -> ReplayConnection
+        self.all_connections = []
+        self._handshake = {}  # connection number -> POX's messages since the features reply
+        self._handshake_xid = {}  # connection number -> POX's handshake barrier xid
+        self._stats_parts = collections.defaultdict(list)  # (conn, xid) -> replies so far
+
+        self.expected = collections.defaultdict(list)  # dpid -> recorded outputs
+        self.sent_by_label = collections.Counter()
+        self.timings = collections.defaultdict(list)  # input label -> seconds
+        self.errors = 0
+
+    def _raise(self, connection, cls, *args):
+        """
+        Like of_01: on core.openflow first, then on the connection unless
+        a listener halted it.
+        """
+        event = self.nexus.raiseEvent(cls, connection, *args)
+        if event is None or not event.halt:
+            connection.raiseEvent(cls, connection, *args)
+
+    def _timed(self, what, connection, cls, *args):
+        start = time.perf_counter()
+        try:
+            self._raise(connection, cls, *args)
+        except Exception:
+            self.errors += 1
+            logging.getLogger("ofreplay").exception("%s on dpid=%s", what, connection.dpid)
+        self.timings[what].append(time.perf_counter() - start)
+
+    def _unpack(self, data):
+        msg = self.of._message_type_to_class[data[1]]()
+        msg.unpack(data)
+        return msg
+
+    def _connection_up(self, number, handshake_done):
+        """
+        Raise ConnectionUp. Outputs recorded since the features reply count
+        as the components' own, unless POX's handshake barrier is what
+        completed it (then they were POX's: a flow table clear and the
+        barrier).
+        """
+        con = self.connections[number]
+        con.up = True
+        held = self._handshake.pop(number, [])
+        self._handshake_xid.pop(number, None)
+        if not handshake_done:
+            for data in held:
+                self._expect(con, data)
+        self.nexus._connect(con)
+        self._timed("connection_up", con, self.pof.ConnectionUp, con.features)
+
+    def _expect(self, con, data):
+        name = self.oflog.type_name(data)
+        if name not in POX_OWN and self.oflog.label(data) not in self.ignore:
+            self.expected[con.dpid].append(self.oflog.without_xid(data))
+
+    def dispatch(self, record):
+        oflog = self.oflog
+        of = self.of
+        number = record.conn
+        if record.kind == oflog.CONNECT:
+            con = self.connections[number] = self.Connection(number)
+            self.all_connections.append(con)
+            return
+        con = self.connections.get(number)
+        if con is None:
+            return  # its CONNECT was lost
+
+        if record.kind == oflog.CLOSE:
+            if con.up:
+                con.disconnected = True
+                self.nexus._disconnect(con.dpid)
+                self._timed("connection_down", con, self.pof.ConnectionDown)
+            del self.connections[number]
+            return
+
+        data = record.data
+        name = oflog.type_name(data)
+        if record.kind == oflog.TO_SWITCH:
+            # What the controller sent in the recording
+            if con.up:
+                self._expect(con, data)
+            elif number in self._handshake:
+                self._handshake[number].append(data)
+                if name == "barrier_request":
+                    self._handshake_xid[number] = self._unpack(data).xid
+            return
+
+        if name == "features_reply":
+            msg = self._unpack(data)
+            con.features = msg
+            con.dpid = msg.datapath_id
+            con.ports = dict((p.port_no, p) for p in msg.ports)
+            self._handshake[number] = []
+            return
+        if name in ("hello", "echo_request", "echo_reply", "get_config_reply"):
+            return
+        if number in self._handshake:
+            # POX raises ConnectionUp once its handshake barrier is answered
+            # (older versions right after the features reply)
+            if name == "barrier_reply" and self._handshake_xid.get(number) is not None:
+                if self._unpack(data).xid == self._handshake_xid[number]:
+                    self._connection_up(number, True)
+                    return
+            self._connection_up(number, False)
+        if not con.up:
+            return
+
+        msg = self._unpack(data)
+        label = oflog.label(data)
+        if name == "packet_in":
+            self._timed(label, con, self.pof.PacketIn, msg)
+        elif name == "port_status":
+            if msg.reason == of.OFPPR_DELETE:
+                con.ports.pop(msg.desc.port_no, None)
+            else:
+                con.ports[msg.desc.port_no] = msg.desc
+            self._timed(label, con, self.pof.PortStatus, msg)
+        elif name == "flow_removed":
+            self._timed(label, con, self.pof.FlowRemoved, msg)
+        elif name == "barrier_reply":
+            self._timed(label, con, self.pof.BarrierIn, msg)
+        elif name == "error":
+            self._timed(label, con, self.pof.ErrorIn, msg)
+        elif name == "stats_reply":
+            # Multipart replies are raised once, when the last part arrives
+            parts = self._stats_parts[(number, msg.xid)]
+            parts.append(msg)
+            if msg.flags & of.OFPSF_REPLY_MORE:
+                return
+            del self._stats_parts[(number, msg.xid)]
+            cls = self.stats_events.get(msg.type)
+            if cls is None:
+                return
+            if isinstance(msg.body, list):
+                stats = [entry for part in parts for entry in part.body]
+            else:
+                stats = msg.body
+            self._timed("%s/%s" % (label, cls.__name__), con, cls, parts, stats)
+
+    def outputs(self):
+        """
+        {dpid: outputs without xids} the components sent, as _expect()
+        filters the recorded ones.
+        """
+        out = collections.defaultdict(list)
+        for con in self.all_connections:
+            for data in con.sent:
+                if self.oflog.label(data) not in self.ignore:
+                    out[con.dpid].append(self.oflog.without_xid(data))
+        return out
+
+
+def digest(outputs):
+    """
+    One hash of every switch's outputs, in the order they were sent.
+    """
+    h = hashlib.sha1()
+    for dpid in sorted(outputs, key=str):
+        h.update(str(dpid).encode())
+        for data in outputs[dpid]:
+            h.update(data)
+    return h.hexdigest()
+
+
+def compare(expected, got, oflog):
+    """
+    Per message label, how many recorded outputs the replay didn't send
+    (missing) and how many it sent that weren't recorded (extra).
+    """
+    missing = collections.Counter()
+    extra = collections.Counter()
+    for dpid in set(expected) | set(got):
+        want = collections.Counter(expected.get(dpid, ()))
+        have = collections.Counter(got.get(dpid, ()))
+        for data, n in (want - have).items():
+            missing[oflog.label(data)] += n
+        for data, n in (have - want).items():
+            extra[oflog.label(data)] += n
+    return missing, extra
+
+
+def replay(args, components):
+    from pox.core import core
+    import pox.openflow
+    from cse561 import oflog
+    from cse561.offload import offloader
+
+    offloader.configure("inline")
+    if not core.hasComponent("openflow"):
+        pox.openflow.launch()
+    launch_components(components)
+    core.goUp()
+
+    replayer = Replayer(args.ignore.split(",") if args.ignore else ())
+    start_time, records = oflog.read_log(args.log)
+
+    done = threading.Event()
+
+    def on_pox_thread(record):
+        try:
+            replayer.dispatch(record)
+        finally:
+            done.set()
+
+    count = 0
+    began = time.time()
+    for record in records:
+        if args.speed:
+            delay = began + record.time / args.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        done.clear()
+        core.callLater(on_pox_thread, record)
+        if not done.wait(DISPATCH_TIMEOUT):
+            sys.exit("POX's thread didn't take record %d within %ds" % (count, DISPATCH_TIMEOUT))
+        count += 1
+    elapsed = time.time() - began
+    # Let timers and callLater()s that are due run
+    time.sleep(args.settle)
+
+    done.clear()
+    result = {}
+
+    def collect():
+        try:
+            result["outputs"] = replayer.outputs()
+        finally:
+            done.set()
+    core.callLater(collect)
+    done.wait(DISPATCH_TIMEOUT)
+    outputs = result.get("outputs", {})
+    missing, extra = compare(replayer.expected, outputs, oflog)
+
+    inputs = {}
+    for what, seconds in sorted(replayer.timings.items()):
+        seconds.sort()
+        inputs[what] = {
+            "count": len(seconds),
+            "total_ms": sum(seconds) * 1e3,
+            "p50_us": percentile(seconds, 50) * 1e6,
+            "p99_us": percentile(seconds, 99) * 1e6,
+            "max_us": seconds[-1] * 1e6,
+        }
+    return {
+        "records": count,
+        "recorded_at": start_time,
+        "seconds": elapsed,
+        "connections": len(replayer.all_connections),
+        "errors": replayer.errors,
+        "inputs": inputs,
+        "sent": dict(replayer.sent_by_label),
+        "expected": sum(len(v) for v in replayer.expected.values()),
+        "compared": sum(len(v) for v in outputs.values()),
+        "missing": dict(missing),
+        "extra": dict(extra),
+        "digest": digest(outputs),
+    }
+
+
+def print_report(r):
+    print("%d records, %d connections, replayed in %.2f s, %d handler errors" % (
+        r["records"], r["connections"], r["seconds"], r["errors"]))
+    print("%-40s %8s %10s %9s %9s %9s" % ("input", "count", "total ms", "p50 us", "p99 us", "max us"))
+    for what, t in sorted(r["inputs"].items()):
+        print("%-40s %8d %10.1f %9.1f %9.1f %9.1f" % (
+            what, t["count"], t["total_ms"], t["p50_us"], t["p99_us"], t["max_us"]))
+    print("sent: %s" % (", ".join("%s=%d" % kv for kv in sorted(r["sent"].items())),))
+    if r["missing"] or r["extra"]:
+        print("outputs differ from the recording (%d recorded, %d replayed):" % (
+            r["expected"], r["compared"]))
+        for name in sorted(set(r["missing"]) | set(r["extra"])):
+            print("  %-24s %6d missing %6d extra" % (
+                name, r["missing"].get(name, 0), r["extra"].get(name, 0)))
+    else:
+        print("outputs match the recording (%d messages)" % (r["expected"],))
+
+
+def check_baseline(r, baseline, tolerance, min_count):
+    """
+    Differences from an earlier replay that count as regressions.
+    """
+    problems = []
+    if r["digest"] != baseline["digest"]:
+        problems.append("outputs differ from the baseline's")
+    for what, t in sorted(r["inputs"].items()):
+        b = baseline["inputs"].get(what)
+        if b is None or t["count"] < min_count or not b["p50_us"]:
+            continue
+        change = t["p50_us"] / b["p50_us"] - 1
+        line = "%-40s p50 %9.1f us vs %9.1f us (%+.1f%%)" % (
+            what, t["p50_us"], b["p50_us"], 100 * change)
+        print(line)
+        if change > tolerance:
+            problems.append(line)
+    return problems
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if "--" not in argv:
+        sys.exit("usage: ofreplay.py LOG [options] -- COMPONENT [--option=value ...] ...")
+    split = argv.index("--")
+    p = argparse.ArgumentParser(description="Replay a recorded OpenFlow log into POX components")
+    p.add_argument("log", help="log written by tools/ofrecord.py")
+    p.add_argument("--pox-dir", default=os.environ.get("POX_DIR", "~/pox"),
+                   help="POX checkout (default: $POX_DIR or ~/pox)")
+    p.add_argument("--speed", type=float, default=0.0,
+                   help="replay at this multiple of the recorded pace (default 0: as fast as possible)")
+    p.add_argument("--settle", type=float, default=0.5,
+                   help="seconds to let timers run after the last record")
+    p.add_argument("--ignore", default="packet_out/lldp",
+                   help="comma-separated message labels left out of the comparisons")
+    p.add_argument("--baseline", help="JSON of an earlier replay to compare with")
+    p.add_argument("--tolerance", type=float, default=0.25,
+                   help="allowed p50 slowdown per input type vs the baseline (default 0.25)")
+    p.add_argument("--min-count", type=int, default=50,
+                   help="compare the timing of input types with at least this many messages")
+    p.add_argument("--verbose", action="store_true", help="show the components' INFO logs")
+    p.add_argument("--json", help="write the results to this file")
+    args = p.parse_args(argv[:split])
+    components = parse_components(argv[split + 1:])
+    if not components:
+        sys.exit("no components to replay into")
+
+    load_pox(args.pox_dir)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    r = replay(args, components)
+    print_report(r)
+
+    failed = bool(r["missing"] or r["extra"])
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        problems = check_baseline(r, baseline, args.tolerance, args.min_count)
+        for problem in problems:
+            print("REGRESSION: %s" % (problem,))
+        failed = failed or bool(problems)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "args": vars(args),
+                "components": components,
+                "python": sys.version.split()[0],
+                "results": r,
+            }, f, indent=2, sort_keys=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
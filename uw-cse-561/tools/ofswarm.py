@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+#
+# cbench-style load generator: a swarm of fake OpenFlow 1.0 switches.
+#
+# Each fake switch opens its own TCP connection to a running controller,
+# answers the handshake (HELLO, FEATURES_REQUEST, GET_CONFIG, BARRIER,
+# ECHO, STATS) with a distinct dpid, then streams PACKET_INs and times how
+# long the controller takes to answer each one with a flow_mod or packet_out.
+#
+# Only needs the standard library.
+#
+# Usage:
+#   sudo ~/pox/pox.py project1.a1ext1controller &
+#   python3 tools/ofswarm.py --switches 500 --duration 20
+#   python3 tools/ofswarm.py --dpids 1,2,3,21,31 --frames mixed   # a2part2
+#
+# For thousands of switches raise the fd limit first (ulimit -n 65536).
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import struct
+import sys
+import time
+
+OFP_VERSION = 0x01
+
+OFPT_HELLO = 0
+OFPT_ERROR = 1
+OFPT_ECHO_REQUEST = 2
+OFPT_ECHO_REPLY = 3
+OFPT_FEATURES_REQUEST = 5
+OFPT_FEATURES_REPLY = 6
+OFPT_GET_CONFIG_REQUEST = 7
+OFPT_GET_CONFIG_REPLY = 8
+OFPT_SET_CONFIG = 9
+OFPT_PACKET_IN = 10
+OFPT_FLOW_REMOVED = 11
+OFPT_PORT_STATUS = 12
+OFPT_PACKET_OUT = 13
+OFPT_FLOW_MOD = 14
+OFPT_PORT_MOD = 15
+OFPT_STATS_REQUEST = 16
+OFPT_STATS_REPLY = 17
+OFPT_BARRIER_REQUEST = 18
+OFPT_BARRIER_REPLY = 19
+
+OFPST_DESC = 0
+
+OFPR_NO_MATCH = 0
+NO_BUFFER = 0xffffffff
+
+OFP_HEADER = struct.Struct("!BBHL")
+OFP_PHY_PORT = struct.Struct("!H6s16sLLLLLL")
+OFP_SWITCH_FEATURES = struct.Struct("!QLB3xLL")
+OFP_PACKET_IN = struct.Struct("!LHHBx")
+OFP_PACKET_OUT = struct.Struct("!LHH")
+# ofp_flow_mod after the 40-byte match: cookie, command, idle, hard,
+# priority, buffer_id, out_port, flags
+OFP_FLOW_MOD_TAIL = struct.Struct("!QHHHHLHH")
+OFP_MATCH_LEN = 40
+
+ETH_BROADCAST = b"\xff" * 6
+
+
+def ofp_message(msg_type, xid, body=b""):
+    return OFP_HEADER.pack(OFP_VERSION, msg_type, OFP_HEADER.size + len(body), xid) + body
+
+
+def _mac(dpid, host):
+    # locally administered, unique per (dpid, host)
+    return struct.pack("!BBHH", 0x02, dpid >> 16 & 0xff, dpid & 0xffff, host)
+
+
+def _ip(host):
+    # spread hosts over the project 2 subnets so a2part2 recognises them
+    subnets = ((10, 0, 1), (10, 0, 2), (10, 0, 3), (10, 0, 4), (172, 16, 10))
+    a, b, c = subnets[host % len(subnets)]
+    return bytes((a, b, c, 10 + host // len(subnets) % 240))
+
+
+def arp_request(src_mac, src_ip, dst_ip):
+    arp = struct.pack("!HHBBH6s4s6s4s", 1, 0x0800, 6, 4, 1,
+                      src_mac, src_ip, b"\x00" * 6, dst_ip)
+    return ETH_BROADCAST + src_mac + b"\x08\x06" + arp
+
+
+def _ip_checksum(header):
+    total = sum(struct.unpack("!%dH" % (len(header) // 2), header))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def icmp_echo(src_mac, dst_mac, src_ip, dst_ip, seq, size=56):
+    payload = struct.pack("!L", seq) + b"x" * max(0, size - 4)
+    icmp = struct.pack("!BBHHH", 8, 0, 0, 1, seq & 0xffff) + payload
+    icmp = icmp[:2] + struct.pack("!H", _ip_checksum(icmp + b"\x00" * (len(icmp) % 2))) + icmp[4:]
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(icmp), seq & 0xffff, 0,
+                     64, 1, 0, src_ip, dst_ip)
+    ip = ip[:10] + struct.pack("!H", _ip_checksum(ip)) + ip[12:]
+    return dst_mac + src_mac + b"\x08\x00" + ip + icmp
+
+
+class Stats(object):
+    def __init__(self):
+        self.connected = 0
+        self.handshake_times = []
+        self.packet_ins = 0
+        self.matched = 0
+        self.lost = 0
+        self.by_type = collections.Counter()
+        self.latencies = []
+        self.errors = 0
+
+    def summary(self, elapsed):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            if not lat:
+                return 0.0
+            return lat[int(round((len(lat) - 1) * p / 100.0))] * 1e3
+
+        hs = sorted(self.handshake_times)
+        return {
+            "switches": self.connected,
+            "handshake_p50_ms": hs[len(hs) // 2] * 1e3 if hs else 0.0,
+            "handshake_max_ms": hs[-1] * 1e3 if hs else 0.0,
+            "seconds": elapsed,
+            "packet_ins": self.packet_ins,
+            "responses": self.matched,
+            "lost": self.lost,
+            "packet_ins_per_sec": self.packet_ins / elapsed if elapsed else 0.0,
+            "responses_per_sec": self.matched / elapsed if elapsed else 0.0,
+            "flow_mods": self.by_type[OFPT_FLOW_MOD],
+            "packet_outs": self.by_type[OFPT_PACKET_OUT],
+            "errors": self.errors,
+            "rtt_p50_ms": pct(50),
+            "rtt_p90_ms": pct(90),
+            "rtt_p99_ms": pct(99),
+            "rtt_max_ms": lat[-1] * 1e3 if lat else 0.0,
+        }
+
+
+class FakeSwitch(object):
+    """
+    One fake OF1.0 switch. Keeps up to `window` packet-ins outstanding;
+    a packet-in is answered by the first packet_out or flow_mod that
+    carries its buffer_id or, failing that, its exact frame bytes.
+    """
+
+    def __init__(self, dpid, args, stats, rng):
+        self.dpid = dpid
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.xid = 0
+        self.ready = asyncio.Event()
+        self.window = asyncio.Semaphore(args.window)
+        self.outstanding = collections.OrderedDict()  # buffer_id -> (t0, frame)
+        self.by_frame = collections.defaultdict(collections.deque)  # frame -> buffer_ids
+        self.next_buffer = 0
+        self.writer = None
+        self.macs = [_mac(dpid, h) for h in range(args.hosts)]
+        self.ips = [_ip(h) for h in range(args.hosts)]
+
+    def _next_xid(self):
+        self.xid = (self.xid + 1) & 0xffffffff
+        return self.xid
+
+    def send(self, msg_type, body=b"", xid=None):
+        self.writer.write(ofp_message(msg_type, self._next_xid() if xid is None else xid, body))
+
+    def features_reply(self, xid):
+        ports = b"".join(
+            OFP_PHY_PORT.pack(p, _mac(self.dpid, 0xff00 | p),
+                              ("s%d-eth%d" % (self.dpid, p)).encode()[:15],
+                              0, 0, 0, 0, 0, 0)
+            for p in range(1, self.args.ports + 1))
+        body = OFP_SWITCH_FEATURES.pack(self.dpid, 256, 1, 0, 0xfff) + ports
+        self.send(OFPT_FEATURES_REPLY, body, xid)
+
+    def make_frame(self, seq):
+        i = self.rng.randrange(self.args.hosts)
+        kind = self.args.frames
+        if kind == "mixed":
+            kind = "arp" if seq % 4 == 0 else "unicast"
+        if kind == "arp":
+            j = self.rng.randrange(self.args.hosts)
+            return arp_request(self.macs[i], self.ips[i], self.ips[j])
+        j = (i + 1 + self.rng.randrange(max(1, self.args.hosts - 1))) % self.args.hosts
+        return icmp_echo(self.macs[i], self.macs[j], self.ips[i], self.ips[j], seq)
+
+    def packet_in(self):
+        buffer_id = self.next_buffer
+        self.next_buffer = (self.next_buffer + 1) % 0xfffffff0
+        frame = self.make_frame(buffer_id)
+        in_port = 1 + self.rng.randrange(self.args.ports)
+        body = OFP_PACKET_IN.pack(buffer_id if self.args.buffered else NO_BUFFER,
+                                  len(frame), in_port, OFPR_NO_MATCH) + frame
+        self.outstanding[buffer_id] = (time.perf_counter(), frame)
+        self.by_frame[frame].append(buffer_id)
+        self.send(OFPT_PACKET_IN, body)
+        self.stats.packet_ins += 1
+
+    def _answer(self, buffer_id, frame):
+        if buffer_id != NO_BUFFER and buffer_id in self.outstanding:
+            key = buffer_id
+        elif frame and self.by_frame.get(frame):
+            key = self.by_frame[frame][0]
+        else:
+            return
+        t0, f = self.outstanding.pop(key)
+        ids = self.by_frame[f]
+        ids.remove(key)
+        if not ids:
+            del self.by_frame[f]
+        self.stats.latencies.append(time.perf_counter() - t0)
+        self.stats.matched += 1
+        self.window.release()
+
+    def expire(self, now):
+        while self.outstanding:
+            key, (t0, f) = next(iter(self.outstanding.items()))
+            if now - t0 < self.args.timeout:
+                break
+            del self.outstanding[key]
+            ids = self.by_frame[f]
+            ids.remove(key)
+            if not ids:
+                del self.by_frame[f]
+            self.stats.lost += 1
+            self.window.release()
+
+    def handle(self, msg_type, xid, body):
+        if msg_type == OFPT_ECHO_REQUEST:
+            self.send(OFPT_ECHO_REPLY, body, xid)
+        elif msg_type == OFPT_FEATURES_REQUEST:
+            self.features_reply(xid)
+        elif msg_type == OFPT_GET_CONFIG_REQUEST:
+            self.send(OFPT_GET_CONFIG_REPLY, struct.pack("!HH", 0, 128), xid)
+        elif msg_type == OFPT_BARRIER_REQUEST:
+            self.send(OFPT_BARRIER_REPLY, b"", xid)
+            self.ready.set()
+        elif msg_type == OFPT_STATS_REQUEST:
+            stats_type = struct.unpack_from("!H", body)[0] if len(body) >= 2 else 0
+            if stats_type == OFPST_DESC:
+                reply = struct.pack("!HH256s256s256s32s256s", stats_type, 0,
+                                    b"cse561", b"ofswarm", b"ofswarm", b"%d" % self.dpid,
+                                    b"fake switch")
+            else:
+                reply = struct.pack("!HH", stats_type, 0)
+            self.send(OFPT_STATS_REPLY, reply, xid)
+        elif msg_type == OFPT_PACKET_OUT:
+            self.stats.by_type[msg_type] += 1
+            buffer_id, _, actions_len = OFP_PACKET_OUT.unpack_from(body)
+            self._answer(buffer_id, body[OFP_PACKET_OUT.size + actions_len:])
+        elif msg_type == OFPT_FLOW_MOD:
+            self.stats.by_type[msg_type] += 1
+            if len(body) >= OFP_MATCH_LEN + OFP_FLOW_MOD_TAIL.size:
+                buffer_id = OFP_FLOW_MOD_TAIL.unpack_from(body, OFP_MATCH_LEN)[5]
+                self._answer(buffer_id, None)
+        elif msg_type == OFPT_ERROR:
+            self.stats.errors += 1
+        else:
+            self.stats.by_type[msg_type] += 1
+
+    async def reader(self, reader):
+        while True:
+            header = await reader.readexactly(OFP_HEADER.size)
+            _, msg_type, length, xid = OFP_HEADER.unpack(header)
+            body = await reader.readexactly(length - OFP_HEADER.size) if length > OFP_HEADER.size else b""
+            self.handle(msg_type, xid, body)
+
+    async def run(self, start_gate, stop_at):
+        t0 = time.perf_counter()
+        reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        self.send(OFPT_HELLO)
+        read_task = asyncio.ensure_future(self.reader(reader))
+        try:
+            # POX raises ConnectionUp after the barrier that follows FEATURES_REPLY
+            await asyncio.wait_for(self.ready.wait(), self.args.handshake_timeout)
+            self.stats.connected += 1
+            self.stats.handshake_times.append(time.perf_counter() - t0)
+            await start_gate.wait()
+
+            interval = 1.0 / self.args.rate if self.args.rate else 0
+            next_send = time.perf_counter()
+            while time.perf_counter() < stop_at():
+                try:
+                    await asyncio.wait_for(self.window.acquire(), self.args.timeout)
+                except asyncio.TimeoutError:
+                    self.expire(time.perf_counter())
+                    continue
+                if read_task.done():
+                    break
+                self.packet_in()
+                if interval:
+                    next_send += interval
+                    delay = next_send - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif self.stats.packet_ins % 64 == 0:
+                    await asyncio.sleep(0)
+                    self.expire(time.perf_counter())
+                await self.writer.drain()
+            # give the last answers a chance to arrive
+            await asyncio.sleep(min(self.args.timeout, 0.5))
+            self.expire(float("inf"))
+        finally:
+            read_task.cancel()
+            self.writer.close()
+
+
+async def swarm(args):
+    stats = Stats()
+    if args.dpids:
+        dpids = [int(d, 0) for d in args.dpids.split(",")]
+    else:
+        dpids = list(range(args.dpid_base, args.dpid_base + args.switches))
+    rng = random.Random(args.seed)
+    switches = [FakeSwitch(d, args, stats, random.Random(rng.random())) for d in dpids]
+
+    start_gate = asyncio.Event()
+    window = {"stop": float("inf")}
+    tasks = []
+    for i, sw in enumerate(switches):
+        tasks.append(asyncio.ensure_future(sw.run(start_gate, lambda: window["stop"])))
+        if args.connect_rate and i % args.connect_rate == args.connect_rate - 1:
+            await asyncio.sleep(1.0)
+
+    # wait for every handshake (or the handshake timeout), then start
+    deadline = time.perf_counter() + args.handshake_timeout
+    while stats.connected + sum(t.done() for t in tasks) < len(switches) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    print("%d/%d switches connected" % (stats.connected, len(switches)), file=sys.stderr)
+
+    start = time.perf_counter()
+    window["stop"] = start + args.duration
+    start_gate.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # rates are over the send window, not the drain time after it
+    elapsed = min(time.perf_counter() - start, args.duration)
+    failures = [r for r in results if isinstance(r, Exception)]
+    if failures:
+        print("%d switches failed, first: %r" % (len(failures), failures[0]), file=sys.stderr)
+    return stats.summary(elapsed)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Swarm of fake OpenFlow 1.0 switches")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=6633)
+    p.add_argument("--switches", type=int, default=100)
+    p.add_argument("--dpid-base", type=int, default=1)
+    p.add_argument("--dpids", help="explicit comma-separated dpids (overrides --switches)")
+    p.add_argument("--ports", type=int, default=4, help="ports per switch")
+    p.add_argument("--hosts", type=int, default=16, help="distinct MACs per switch")
+    p.add_argument("--frames", choices=("arp", "unicast", "mixed"), default="mixed")
+    p.add_argument("--window", type=int, default=1,
+                   help="outstanding packet-ins per switch (1 = latency mode)")
+    p.add_argument("--rate", type=float, default=0, help="packet-ins/sec per switch (0 = as fast as the window allows)")
+    p.add_argument("--buffered", action="store_true", help="send buffer_ids instead of NO_BUFFER")
+    p.add_argument("--duration", type=float, default=10.0)
+    p.add_argument("--timeout", type=float, default=1.0, help="count a packet-in as lost after this long")
+    p.add_argument("--handshake-timeout", type=float, default=30.0)
+    p.add_argument("--connect-rate", type=int, default=0, help="new connections per second (0 = all at once)")
+    p.add_argument("--seed", type=int, default=561)
+    p.add_argument("--json", help="write the summary to this file")
+    args = p.parse_args(argv)
+
+    summary = asyncio.run(swarm(args))
+    for k in sorted(summary):
+        v = summary[k]
+        print("%-20s %s" % (k, ("%.3f" % v) if isinstance(v, float) else v))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": summary}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+#
+# Offline packet-in benchmark for the POX controllers in this repo.
+#
+# Drives a controller's _handle_PacketIn directly with synthetic PacketIn
+# events and a fake connection that records everything sent, so we can
+# measure controller cost without Mininet/OVS.
+#
+# Needs a POX checkout (https://github.com/noxrepo/pox) but no switches.
+#
+# Usage:
+#   python3 tools/pktin_bench.py --pox-dir ~/pox
+#   python3 tools/pktin_bench.py --controllers a1ext1 a2part2 --workloads arp_storm
+#   python3 tools/pktin_bench.py --json today.json --baseline last_week.json
+#   python3 tools/pktin_bench.py --workloads bulk_ping --buffered --miss_send_len 128
+#   python3 tools/pktin_bench.py --trace packet=0.01 forward=1
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# package name -> directory with the controller modules.
+# POX imports them as package modules (project1.a1ext1controller,
+# misc.a2part2controller), so we load them the same way.
+PACKAGES = {
+    "project1": os.path.join(ROOT, "project1", "pox"),
+    "project2": os.path.join(ROOT, "project2", "pox"),
+}
+
+# dpid the controller runs on and how many ports it has.
+# Project 2 controllers hard-code their dpids; cores21 (21) is the router.
+SWITCH_DPID = {
+    "a1ext1": 1,
+    "a1ext2": 1,
+    "a2part1": 21,
+    "a2part2": 21,
+}
+NUM_PORTS = 5
+
+# OpenFlow 1.0 message types we may see as pre-packed bytes
+RAW_TYPES = {
+    9: "ofp_set_config",
+    13: "ofp_packet_out",
+    14: "ofp_flow_mod",
+    15: "ofp_port_mod",
+    16: "ofp_stats_request",
+    18: "ofp_barrier_request",
+}
+
+
+def load_pox(pox_dir):
+    pox_dir = os.path.expanduser(pox_dir)
+    if pox_dir not in sys.path:
+        sys.path.insert(0, pox_dir)
+    try:
+        import pox.core  # noqa: F401
+    except ImportError:
+        sys.exit("Cannot import POX from %s (use --pox-dir)" % (pox_dir,))
+
+    for name, path in PACKAGES.items():
+        if name not in sys.modules:
+            pkg = types.ModuleType(name)
+            pkg.__path__ = [path]
+            sys.modules[name] = pkg
+    # the shared cse561 package lives next to the projects (POX's ext/)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+class FakePort(object):
+    def __init__(self, port_no):
+        self.port_no = port_no
+        self.hw_addr = "00:00:00:00:%02x:%02x" % (port_no >> 8 & 0xff, port_no & 0xff)
+        self.name = "eth%d" % (port_no,)
+        self.config = 0
+        self.state = 0
+
+
+class FakeConnection(object):
+    """
+    Stands in for pox.openflow.of_01.Connection.
+    send() packs the message like the real one does and counts it by type.
+    """
+
+    def __init__(self, dpid, num_ports=NUM_PORTS):
+        self.dpid = dpid
+        self.ports = dict((p, FakePort(p)) for p in range(1, num_ports + 1))
+        self.listeners = []
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.bytes_sent = 0
+
+    def addListeners(self, sink, *args, **kw):
+        self.listeners.append(sink)
+
+    def addListenerByName(self, *args, **kw):
+        pass
+
+    def send(self, msg):
+        if isinstance(msg, (bytes, bytearray)):
+            data = bytes(msg)
+            kind = RAW_TYPES.get(data[1], "type%d" % (data[1],))
+        else:
+            data = msg.pack()
+            kind = type(msg).__name__
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.bytes_sent += len(data)
+
+
+class FakeNexus(object):
+    """
+    Just enough of core.openflow for controllers that register listeners
+    in their constructors.
+    """
+
+    def __init__(self):
+        self.connections = {}
+
+    def addListenerByName(self, *args, **kw):
+        pass
+
+    def addListeners(self, *args, **kw):
+        pass
+
+    def getConnection(self, dpid):
+        return self.connections.get(dpid)
+
+
+def make_controller(name, connection):
+    """
+    Build the per-switch handler for `name` on `connection`.
+    Returns the object whose _handle_PacketIn we drive.
+    """
+    if name == "a1ext1":
+        mod = importlib.import_module("project1.a1ext1controller")
+        return mod.Firewall(connection)
+    if name == "a1ext2":
+        mod = importlib.import_module("project1.a1ext2controller")
+        ctrl = mod.SpanningTreeController()
+        sw = mod.Switch(connection, ctrl)
+        ctrl.switches[connection.dpid] = sw
+        return sw
+    if name == "a2part1":
+        mod = importlib.import_module("project2.a2part1controller")
+        return mod.Part3Controller(connection)
+    if name == "a2part2":
+        mod = importlib.import_module("project2.a2part2controller")
+        # State shared by every instance: the old class-level ip_info, or
+        # the registry that lets edge switches reach the router's ARP cache
+        if isinstance(getattr(mod.Part4Controller, "ip_info", None), dict):
+            mod.Part4Controller.ip_info.clear()
+        getattr(mod, "_routers", {}).clear()
+        return mod.Part4Controller(connection)
+    raise ValueError("unknown controller %r" % (name,))
+
+
+CONTROLLERS = ("a1ext1", "a1ext2", "a2part1", "a2part2")
+
+
+# ---------------------------------------------------------------------------
+# Workloads: lists of (in_port, raw ethernet frame)
+
+def _host(i):
+    """
+    Host i: MAC 00:00:00:00:hi:lo, IP in one of the project 2 subnets
+    (10.0.1-4.x, 172.16.10.x), attached to port 1..NUM_PORTS.
+    """
+    subnets = ("10.0.1", "10.0.2", "10.0.3", "10.0.4", "172.16.10")
+    idx = i % len(subnets)
+    mac = "00:00:00:00:%02x:%02x" % (i >> 8 & 0xff, i & 0xff)
+    ip = "%s.%d" % (subnets[idx], 10 + i // len(subnets) % 240)
+    return mac, ip, idx + 1
+
+
+def _arp(src_mac, src_ip, dst_ip, dst_mac=None):
+    from pox.lib.addresses import EthAddr, IPAddr
+    from pox.lib.packet.arp import arp
+    from pox.lib.packet.ethernet import ethernet
+
+    a = arp()
+    a.opcode = arp.REQUEST if dst_mac is None else arp.REPLY
+    a.hwsrc = EthAddr(src_mac)
+    a.hwdst = EthAddr(dst_mac or "00:00:00:00:00:00")
+    a.protosrc = IPAddr(src_ip)
+    a.protodst = IPAddr(dst_ip)
+    e = ethernet(type=ethernet.ARP_TYPE, src=a.hwsrc,
+                 dst=EthAddr(dst_mac) if dst_mac else ethernet.ETHER_BROADCAST)
+    e.payload = a
+    return e.pack()
+
+
+def _ping(src_mac, src_ip, dst_mac, dst_ip, reply=False, size=56):
+    from pox.lib.addresses import EthAddr, IPAddr
+    from pox.lib.packet.ethernet import ethernet
+    from pox.lib.packet.icmp import icmp, echo, TYPE_ECHO_REQUEST, TYPE_ECHO_REPLY
+    from pox.lib.packet.ipv4 import ipv4
+
+    ic = icmp(type=TYPE_ECHO_REPLY if reply else TYPE_ECHO_REQUEST)
+    ic.payload = echo(id=1, seq=1, payload=b"x" * size)
+    ip = ipv4(protocol=ipv4.ICMP_PROTOCOL, srcip=IPAddr(src_ip), dstip=IPAddr(dst_ip))
+    ip.payload = ic
+    e = ethernet(type=ethernet.IP_TYPE, src=EthAddr(src_mac), dst=EthAddr(dst_mac))
+    e.payload = ip
+    return e.pack()
+
+
+def _gateway(ip):
+    return ip.rsplit(".", 1)[0] + ".1"
+
+
+def arp_storm(hosts, count, rng):
+    """
+    Every packet is a broadcast ARP request from a random host for a
+    random address.
+    """
+    frames = []
+    for _ in range(count):
+        mac, ip, port = _host(rng.randrange(hosts))
+        _, target, _ = _host(rng.randrange(hosts))
+        frames.append((port, _arp(mac, ip, target)))
+    return frames
+
+
+def host_churn(hosts, count, rng):
+    """
+    A never-ending stream of new hosts, each sending one ping to a random
+    member of a stable set, which replies. Grows learning tables.
+    """
+    frames = []
+    for i in range(count // 2):
+        mac, ip, port = _host(hosts + i)
+        dmac, dip, dport = _host(rng.randrange(hosts))
+        frames.append((port, _ping(mac, ip, dmac, dip)))
+        frames.append((dport, _ping(dmac, dip, mac, ip, reply=True)))
+    return frames
+
+
+def all_pairs_ping(hosts, count, rng):
+    """
+    Like Mininet's pingall: each host ARPs its gateway and each other host
+    (with replies), then pings every other host, which replies.
+    Repeated until `count` packets.
+    """
+    rounds = []
+    for i in range(hosts):
+        mac, ip, port = _host(i)
+        rounds.append((port, _arp(mac, ip, _gateway(ip))))
+    for i in range(hosts):
+        mac, ip, port = _host(i)
+        for j in range(hosts):
+            if i == j:
+                continue
+            dmac, dip, dport = _host(j)
+            rounds.append((port, _arp(mac, ip, dip)))
+            rounds.append((dport, _arp(dmac, dip, ip, mac)))
+            rounds.append((port, _ping(mac, ip, dmac, dip)))
+            rounds.append((dport, _ping(dmac, dip, mac, ip, reply=True)))
+    frames = []
+    while len(frames) < count:
+        frames.extend(rounds[:count - len(frames)])
+    return frames
+
+
+def bulk_ping(hosts, count, rng):
+    """
+    Full-size (1514 byte) frames between random pairs of known hosts, like
+    iperf traffic that misses the flow table.
+    """
+    frames = []
+    for _ in range(count):
+        i, j = rng.sample(range(hosts), 2)
+        mac, ip, port = _host(i)
+        dmac, dip, _ = _host(j)
+        frames.append((port, _ping(mac, ip, dmac, dip, size=1472)))
+    return frames
+
+
+WORKLOADS = {
+    "arp_storm": arp_storm,
+    "host_churn": host_churn,
+    "all_pairs_ping": all_pairs_ping,
+    "bulk_ping": bulk_ping,
+}
+
+# ofp_header + ofp_packet_in fields before the frame
+PACKET_IN_HEADER = 18
+
+
+# ---------------------------------------------------------------------------
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = int(round((len(sorted_values) - 1) * pct / 100.0))
+    return sorted_values[k]
+
+
+def run_one(controller, frames, quiet=True, buffered=False, miss_send_len=None):
+    """
+    Feed `frames` to a fresh instance of `controller`.
+    Buffered packet-ins carry only the first miss_send_len bytes of the
+    frame, unbuffered ones all of it (as the OpenFlow 1.0 spec says).
+    Returns a dict of results.
+    """
+    import pox.openflow.libopenflow_01 as of
+    from pox.openflow import PacketIn
+
+    dpid = SWITCH_DPID[controller]
+    conn = FakeConnection(dpid)
+    core = importlib.import_module("pox.core").core
+    core.openflow.connections[dpid] = conn
+
+    sink = io.StringIO() if quiet else sys.stdout
+    with contextlib.redirect_stdout(sink):
+        handler = make_controller(controller, conn)
+    conn.reset()  # don't count the rules installed at ConnectionUp
+
+    # Build the ofp_packet_in messages up front; only the handler is timed
+    msgs = []
+    bytes_in = 0
+    for n, (port, data) in enumerate(frames):
+        total_len = len(data)
+        if buffered and miss_send_len is not None:
+            data = data[:miss_send_len]
+        pi = of.ofp_packet_in(in_port=port, data=data, total_len=total_len,
+                              reason=of.OFPR_NO_MATCH)
+        pi.buffer_id = n if buffered else None
+        msgs.append(pi)
+        bytes_in += PACKET_IN_HEADER + len(data)
+
+    latencies = []
+    clock = time.perf_counter
+    start = clock()
+    with contextlib.redirect_stdout(sink):
+        for pi in msgs:
+            event = PacketIn(conn, pi)
+            t0 = clock()
+            handler._handle_PacketIn(event)
+            latencies.append(clock() - t0)
+            if quiet and sink.tell() > 1 << 20:
+                sink.seek(0)
+                sink.truncate()
+    elapsed = clock() - start
+
+    latencies.sort()
+    counts = conn.counts
+    n = len(msgs)
+    return {
+        "packet_ins": n,
+        "seconds": elapsed,
+        "pps": n / elapsed if elapsed else 0.0,
+        "p50_us": _percentile(latencies, 50) * 1e6,
+        "p90_us": _percentile(latencies, 90) * 1e6,
+        "p99_us": _percentile(latencies, 99) * 1e6,
+        "max_us": (latencies[-1] if latencies else 0.0) * 1e6,
+        "flow_mods": counts.get("ofp_flow_mod", 0),
+        "packet_outs": counts.get("ofp_packet_out", 0),
+        "flow_mods_per_pi": counts.get("ofp_flow_mod", 0) / float(n or 1),
+        "packet_outs_per_pi": counts.get("ofp_packet_out", 0) / float(n or 1),
+        "bytes_sent": conn.bytes_sent,
+        "bytes_in": bytes_in,
+        "kb_in": bytes_in / 1e3,
+        "kb_out": conn.bytes_sent / 1e3,
+        "sent": dict(counts),
+    }
+
+
+COLUMNS = ("pps", "p50_us", "p90_us", "p99_us", "max_us", "flow_mods", "packet_outs",
+           "kb_in", "kb_out")
+
+
+def print_table(results, baseline=None):
+    print("%-9s %-15s %10s %9s %9s %9s %9s %9s %11s %9s %9s" %
+          (("controller", "workload") + COLUMNS))
+    for key in sorted(results):
+        r = results[key]
+        controller, workload = key.split("/")
+        print("%-9s %-15s %10.0f %9.1f %9.1f %9.1f %9.1f %9d %11d %9.1f %9.1f" %
+              ((controller, workload) + tuple(r[c] for c in COLUMNS)))
+        if baseline and key in baseline:
+            b = baseline[key]
+            deltas = []
+            for c in ("pps", "p99_us", "flow_mods", "packet_outs", "kb_in", "kb_out"):
+                if b.get(c):
+                    deltas.append("%s %+.1f%%" % (c, 100.0 * (r[c] - b[c]) / b[c]))
+            print("%-25s vs baseline: %s" % ("", ", ".join(deltas)))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description="Offline packet-in benchmark for the POX controllers")
+    p.add_argument("--pox-dir", default=os.environ.get("POX_DIR", "~/pox"),
+                   help="POX checkout (default: $POX_DIR or ~/pox)")
+    p.add_argument("--controllers", nargs="+", choices=CONTROLLERS, default=list(CONTROLLERS))
+    p.add_argument("--workloads", nargs="+", choices=sorted(WORKLOADS), default=sorted(WORKLOADS))
+    p.add_argument("--hosts", type=int, default=20, help="hosts per workload")
+    p.add_argument("--count", type=int, default=5000, help="packet-ins per workload")
+    p.add_argument("--seed", type=int, default=561)
+    p.add_argument("--buffered", action="store_true",
+                   help="give packet-ins a buffer_id, like a buffering switch")
+    p.add_argument("--miss_send_len", type=int,
+                   help="with --buffered, packet-ins carry only this many bytes of the frame")
+    p.add_argument("--verbose", action="store_true", help="keep controller stdout")
+    p.add_argument("--trace", nargs="+", default=[], metavar="CATEGORY=RATE",
+                   help="enable cse561.trace categories, e.g. packet=1 (default: all off)")
+    p.add_argument("--json", help="write results to this file")
+    p.add_argument("--baseline", help="compare against results from an earlier --json")
+    args = p.parse_args(argv)
+
+    load_pox(args.pox_dir)
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+    from pox.core import core
+    if not core.hasComponent("openflow"):
+        core.register("openflow", FakeNexus())
+    from cse561.trace import tracer
+    for spec in args.trace:
+        category, _, rate = spec.partition("=")
+        tracer.set_rate(category, rate or 1)
+    # No event loop runs here to deliver offloaded results, so compute
+    # backup plans and policy tables right away, as POX did before
+    from cse561.offload import offloader
+    offloader.configure("inline")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for workload in args.workloads:
+        frames = WORKLOADS[workload](args.hosts, args.count, random.Random(args.seed))
+        for controller in args.controllers:
+            key = "%s/%s" % (controller, workload)
+            results[key] = run_one(controller, frames, quiet=not args.verbose,
+                                   buffered=args.buffered, miss_send_len=args.miss_send_len)
+
+    print_table(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "args": vars(args),
+                "python": sys.version.split()[0],
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+#
+# Routing table benchmark: the Part 4 controller's old exact-match host
+# lookup (a dict keyed by destination IP, one flow per host) against the
+# longest-prefix-match PrefixTable in cse561/routing.py (one flow per
+# prefix).
+#
+# Builds N random routes inside 10.0.0.0/8 with a realistic mix of
+# prefix lengths, then looks up addresses that fall inside them. The
+# exact table holds one host per route, like ip_info after every subnet
+# has been heard from once; it misses every other address. Standard
+# library only, no POX needed.
+#
+# Usage:
+#   python3 tools/route_bench.py                       # 100k routes
+#   python3 tools/route_bench.py --routes 10000 --lookups 200000
+#   python3 tools/route_bench.py --json routes.json --check
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from cse561.routing import PrefixTable, int_to_ip  # noqa: E402
+
+# prefix length -> share of the routes
+LENGTH_MIX = ((16, 0.01), (20, 0.04), (22, 0.05), (24, 0.75), (28, 0.10), (32, 0.05))
+BASE = 10 << 24
+
+
+def make_routes(n, rng):
+    """
+    n distinct (address, prefixlen) routes inside 10.0.0.0/8, port 1-48 each.
+    """
+    routes = {}
+    lengths = [l for l, _ in LENGTH_MIX]
+    weights = [w for _, w in LENGTH_MIX]
+    while len(routes) < n:
+        plen = rng.choices(lengths, weights)[0]
+        mask = (0xffffffff << (32 - plen)) & 0xffffffff
+        addr = (BASE | rng.getrandbits(24)) & mask
+        routes.setdefault((addr, plen), rng.randint(1, 48))
+    return routes
+
+
+def host_in(addr, plen, rng):
+    return addr | rng.getrandbits(32 - plen) if plen < 32 else addr
+
+
+def reference_lookup(routes, by_length, addr):
+    # hash per prefix length, longest first
+    for plen in by_length:
+        mask = (0xffffffff << (32 - plen)) & 0xffffffff
+        port = routes.get((addr & mask, plen))
+        if port is not None:
+            return port
+    return None
+
+
+def measure(build, lookup, addrs):
+    tracemalloc.start()
+    t = time.perf_counter()
+    table = build()
+    build_s = time.perf_counter() - t
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    hits = 0
+    t = time.perf_counter()
+    for a in addrs:
+        if lookup(table, a) is not None:
+            hits += 1
+    lookup_s = time.perf_counter() - t
+    return table, {
+        "build_s": build_s,
+        "memory_mb": memory / 1e6,
+        "lookups_per_s": len(addrs) / lookup_s if lookup_s else 0.0,
+        "ns_per_lookup": lookup_s / len(addrs) * 1e9,
+        "hit_rate": hits / float(len(addrs)),
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Exact-match vs LPM routing table benchmark")
+    p.add_argument("--routes", type=int, default=100000)
+    p.add_argument("--lookups", type=int, default=500000)
+    p.add_argument("--seed", type=int, default=561)
+    p.add_argument("--check", action="store_true",
+                   help="verify every LPM answer against a per-length hash lookup")
+    p.add_argument("--json", help="write results to this file")
+    args = p.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    routes = make_routes(args.routes, rng)
+    keys = list(routes)
+    addrs = [host_in(a, l, rng) for a, l in (rng.choice(keys) for _ in range(args.lookups))]
+
+    # what ip_info ends up with: the one host per route that has sent something
+    hosts = dict((host_in(a, l, rng), port) for (a, l), port in routes.items())
+
+    _, exact = measure(lambda: dict(hosts), lambda t, a: t.get(a), addrs)
+    exact["flows"] = len(hosts)
+
+    def build_lpm():
+        t = PrefixTable()
+        for (a, l), port in routes.items():
+            t.insert((a, l), port)
+        return t
+
+    table, lpm = measure(build_lpm, lambda t, a: t.lookup(a), addrs)
+    lpm["flows"] = len(table)
+
+    if args.check:
+        by_length = sorted(set(l for _, l in routes), reverse=True)
+        for a in addrs:
+            want = reference_lookup(routes, by_length, a)
+            got = table.lookup(a)
+            if got != want:
+                sys.exit("LPM mismatch for %s: got %s, want %s" % (int_to_ip(a), got, want))
+        print("checked %d lookups against the reference" % (len(addrs),))
+
+    print("%d routes, %d lookups" % (len(routes), len(addrs)))
+    print("%-6s %10s %10s %12s %10s %9s %9s" % (
+        "table", "build s", "memory MB", "lookups/s", "ns/lookup", "hit rate", "flows"))
+    for name, r in (("exact", exact), ("lpm", lpm)):
+        print("%-6s %10.3f %10.1f %12.0f %10.0f %8.1f%% %9d" % (
+            name, r["build_s"], r["memory_mb"], r["lookups_per_s"], r["ns_per_lookup"],
+            100 * r["hit_rate"], r["flows"]))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "args": vars(args),
+                "python": sys.version.split()[0],
+                "results": {"exact": exact, "lpm": lpm},
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
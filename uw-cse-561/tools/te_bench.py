@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+#
+# Aggregate TCP throughput on the ext2 topology with and without elephant
+# flow rerouting.
+#
+# Builds project1/topos/ext2.py with the inter-switch links shaped to
+# --bw Mbit/s (hosts stay unshaped), so the s1-s2 links are the
+# bottleneck. For each mode it starts POX with a1ext2controller, waits
+# for the tree to settle, runs one iperf from each of h1, h2 and h3 to h4
+# at the same time and sums their throughput:
+#   tree       - the plain spanning tree: every flow on one s1-s2 link
+#   multipath  - --multipath: flows hashed over the two parallel links
+#   te         - --multipath --te with cse561.flowstats: elephants moved
+#                to the less loaded of the parallel links and the s1-s3-s2
+#                detour
+#
+# Usage (needs Mininet, iperf and POX with project1 and cse561 in ext/):
+#   sudo python3 tools/te_bench.py
+#   sudo python3 tools/te_bench.py --modes multipath,te --runs 3 --json te.json
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+from mininet.link import TCLink
+from mininet.log import setLogLevel
+from mininet.net import Mininet
+from mininet.node import RemoteController
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "project1", "topos"))
+
+from ext2 import ext2_topo  # noqa: E402
+
+MODES = {
+    "tree": ["project1.a1ext2controller"],
+    "multipath": ["project1.a1ext2controller", "--multipath"],
+    # 1 Mbit/s and up counts as an elephant on these 10 Mbit/s links
+    "te": ["project1.a1ext2controller", "--multipath", "--te", "--te_interval=1",
+           "--elephant=125000", "cse561.flowstats", "--interval=1"],
+}
+
+RATE_RE = re.compile(r"([\d.]+) Mbits/sec")
+
+
+class ShapedExt2(ext2_topo):
+    """
+    ext2 with every switch-switch link limited to `bw` Mbit/s.
+    """
+
+    def __init__(self, bw):
+        self.bw = bw
+        ext2_topo.__init__(self)
+
+    def addLink(self, node1, node2, **opts):
+        if self.isSwitch(node1) and self.isSwitch(node2):
+            opts.setdefault("bw", self.bw)
+        return ext2_topo.addLink(self, node1, node2, **opts)
+
+
+def start_pox(args, mode):
+    cmd = [sys.executable, os.path.join(args.pox_dir, "pox.py"), "log.level", "--WARNING"]
+    cmd += MODES[mode] + ["openflow.of_01", "--port=%d" % (args.controller_port,)]
+    log = open("/tmp/te_bench_pox_%s.log" % (mode,), "w")
+    return subprocess.Popen(cmd, cwd=args.pox_dir, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_for_reachability(net, hosts, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if net.ping(hosts, timeout="1") == 0:
+            return True
+        time.sleep(1)
+    return False
+
+
+def run_iperfs(net, args):
+    """
+    One iperf from each sender to h4 at once; Mbit/s per sender.
+    """
+    h4 = net.get("h4")
+    h4.cmd("iperf -s -p 5001 > /dev/null 2>&1 &")
+    time.sleep(1)
+    senders = [net.get(name) for name in ("h1", "h2", "h3")]
+    outs = {}
+    for h in senders:
+        outs[h.name] = "/tmp/te_bench_%s_%d.txt" % (h.name, os.getpid())
+        h.cmd("iperf -c %s -p 5001 -t %d -f m > %s 2>&1 &" % (h4.IP(), args.duration, outs[h.name]))
+    for h in senders:
+        h.cmd("wait")
+    h4.cmd("kill %iperf")
+
+    rates = {}
+    for name, out in outs.items():
+        with open(out) as f:
+            found = RATE_RE.findall(f.read())
+        os.unlink(out)
+        rates[name] = float(found[-1]) if found else 0.0
+    return rates
+
+
+def run_mode(args, mode):
+    pox = start_pox(args, mode)
+    net = Mininet(topo=ShapedExt2(args.bw), link=TCLink, controller=None)
+    net.addController("c0", controller=RemoteController, ip="127.0.0.1", port=args.controller_port)
+    net.start()
+    results = []
+    try:
+        time.sleep(args.settle)
+        hosts = [net.get(name) for name in ("h1", "h2", "h3", "h4")]
+        if not wait_for_reachability(net, hosts, 30):
+            print("%s: hosts cannot reach each other, skipping" % (mode,))
+            return results
+        for run in range(args.runs):
+            rates = run_iperfs(net, args)
+            total = sum(rates.values())
+            results.append({"rates": rates, "total_mbps": total})
+            print("%-9s run %d: %6.1f Mbit/s (%s)" % (
+                mode, run, total, " ".join("%s=%.1f" % kv for kv in sorted(rates.items()))))
+    finally:
+        net.stop()
+        pox.terminate()
+        pox.wait()
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Aggregate iperf throughput with and without elephant rerouting")
+    p.add_argument("--pox-dir", default=os.path.expanduser(os.environ.get("POX_DIR", "~/pox")),
+                   help="POX checkout (default: $POX_DIR or ~/pox)")
+    p.add_argument("--controller-port", type=int, default=6633)
+    p.add_argument("--modes", default="tree,multipath,te",
+                   help="comma-separated, from %s" % (", ".join(sorted(MODES)),))
+    p.add_argument("--bw", type=float, default=10.0, help="inter-switch link bandwidth (Mbit/s)")
+    p.add_argument("--duration", type=int, default=20, help="seconds per iperf")
+    p.add_argument("--runs", type=int, default=1, help="iperf rounds per mode")
+    p.add_argument("--settle", type=float, default=10.0,
+                   help="seconds to let discovery and the tree settle after startup")
+    p.add_argument("--json", help="write the results to this file")
+    args = p.parse_args()
+    args.pox_dir = os.path.expanduser(args.pox_dir)
+
+    modes = args.modes.split(",")
+    for mode in modes:
+        if mode not in MODES:
+            sys.exit("unknown mode %r" % (mode,))
+
+    setLogLevel("warning")
+    results = {}
+    for mode in modes:
+        results[mode] = run_mode(args, mode)
+
+    print("%-9s %12s" % ("mode", "mean Mbit/s"))
+    for mode in modes:
+        totals = [r["total_mbps"] for r in results[mode]]
+        print("%-9s %12s" % (mode, "%.1f" % (sum(totals) / len(totals),) if totals else "n/a"))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "time": time.time(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+#
+# Packet construction benchmark: the messages the Part 4 controller builds
+# itself (gateway ARP reply, ARP request, gateway echo reply, forwarded
+# packet_out, host flow_mod), made the old way with POX packet and
+# OpenFlow objects against the pre-packed templates in cse561/templates.py.
+#
+# For each message it reports ns per message and the bytes allocated while
+# building one (tracemalloc peak). POX is optional: without it only the
+# templates are measured.
+#
+# Usage:
+#   python3 tools/template_bench.py                    # templates only
+#   python3 tools/template_bench.py --pox-dir ~/pox --check
+#   python3 tools/template_bench.py --count 200000 --json templates.json
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from cse561 import templates  # noqa: E402
+
+GATEWAY_MAC = "00:00:00:00:00:99"
+HOST_MAC = "00:00:00:00:00:02"
+HOST_IP = "10.0.2.20"
+GATEWAY_IP = "10.0.2.1"
+PORT = 2
+IN_PORT = 3
+HOST_TIMEOUT = 60
+HOST_PRIORITY = 932
+
+
+class FakePacketIn(object):
+    def __init__(self, data, buffer_id=None, in_port=IN_PORT):
+        self.data = data
+        self.buffer_id = buffer_id
+        self.in_port = in_port
+
+
+def echo_request(payload_len=56):
+    """
+    Ethernet frame of a ping from the host to its gateway.
+    """
+    icmp = bytearray(struct.pack("!BBHHH", templates.ICMP_ECHO_REQUEST, 0, 0, 0x1234, 1))
+    icmp += bytes(range(payload_len % 256)) + b"\x00" * max(0, payload_len - 256)
+    icmp[2:4] = struct.pack("!H", templates._checksum(icmp))
+    ip = bytearray(struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(icmp), 7, 0, 64, 1, 0,
+                               struct.pack("!L", templates.ip_int(HOST_IP)),
+                               struct.pack("!L", templates.ip_int(GATEWAY_IP))))
+    ip[10:12] = struct.pack("!H", templates._checksum(ip))
+    return (templates.mac_bytes(GATEWAY_MAC) + templates.mac_bytes(HOST_MAC)
+            + struct.pack("!H", templates.ETH_TYPE_IP) + bytes(ip) + bytes(icmp))
+
+
+def template_cases(frame):
+    arp_reply = templates.ArpTemplate(templates.ARP_REPLY, GATEWAY_MAC)
+    arp_request = templates.ArpTemplate(templates.ARP_REQUEST, GATEWAY_MAC)
+    echo_reply = templates.EchoReplyTemplate(GATEWAY_MAC)
+    forward = templates.PacketOutTemplate(set_dst=True)
+    host_route = templates.HostRouteTemplate(HOST_PRIORITY, HOST_TIMEOUT, HOST_TIMEOUT)
+    packet_in = FakePacketIn(frame)
+    # addresses arrive parsed in the controller, as they do on the POX side
+    gateway_ip, host_ip = templates.ip_int(GATEWAY_IP), templates.ip_int(HOST_IP)
+    host_mac = templates.mac_bytes(HOST_MAC)
+    return {
+        "arp_reply": lambda: arp_reply.build(IN_PORT, gateway_ip, host_ip, host_mac),
+        "arp_request": lambda: arp_request.build(PORT, gateway_ip, host_ip),
+        "echo_reply": lambda: echo_reply.build(IN_PORT, frame),
+        "forward": lambda: forward.resend(packet_in, PORT, host_mac),
+        "host_route": lambda: host_route.build(host_ip, host_mac, PORT),
+    }
+
+
+def pox_cases(frame):
+    """
+    The same messages built like the controller used to, with POX objects.
+    """
+    import pox.openflow.libopenflow_01 as of
+    from pox.lib.addresses import EthAddr, IPAddr
+    from pox.lib.packet.arp import arp
+    from pox.lib.packet.ethernet import ethernet
+    from pox.lib.packet.icmp import icmp
+    from pox.lib.packet.ipv4 import ipv4
+
+    gateway_mac = EthAddr(GATEWAY_MAC)
+    host_mac = EthAddr(HOST_MAC)
+    gateway_ip, host_ip = IPAddr(GATEWAY_IP), IPAddr(HOST_IP)
+
+    def packet_out(data, port):
+        msg = of.ofp_packet_out()
+        msg.data = data
+        msg.actions.append(of.ofp_action_output(port=port))
+        return msg.pack()
+
+    def arp_message(opcode, port, sender_ip, target_ip, target_mac):
+        a = arp()
+        a.opcode = opcode
+        a.hwsrc = gateway_mac
+        if target_mac is not None:
+            a.hwdst = target_mac
+        a.protosrc = sender_ip
+        a.protodst = target_ip
+        eth = ethernet()
+        eth.type = ethernet.ARP_TYPE
+        eth.src = gateway_mac
+        eth.dst = target_mac or EthAddr("ff:ff:ff:ff:ff:ff")
+        eth.payload = a
+        return packet_out(eth.pack(), port)
+
+    def echo_reply():
+        request = ethernet(frame)
+        ip_in = request.payload
+        reply = icmp()
+        reply.type = 0  # echo reply
+        reply.payload = ip_in.payload.payload
+        ip_out = ipv4()
+        ip_out.protocol = ipv4.ICMP_PROTOCOL
+        ip_out.srcip = ip_in.dstip
+        ip_out.dstip = ip_in.srcip
+        ip_out.id = ip_in.id
+        ip_out.payload = reply
+        eth = ethernet()
+        eth.type = ethernet.IP_TYPE
+        eth.src = gateway_mac
+        eth.dst = request.src
+        eth.payload = ip_out
+        return packet_out(eth.pack(), IN_PORT)
+
+    packet_in = of.ofp_packet_in(data=frame, in_port=IN_PORT)
+
+    def forward():
+        msg = of.ofp_packet_out()
+        msg.data = packet_in
+        msg.actions.append(of.ofp_action_dl_addr.set_dst(host_mac))
+        msg.actions.append(of.ofp_action_output(port=PORT))
+        return msg.pack()
+
+    def host_route():
+        fm = of.ofp_flow_mod()
+        fm.priority = HOST_PRIORITY
+        fm.match.dl_type = 0x0800
+        fm.match.nw_dst = host_ip
+        fm.idle_timeout = HOST_TIMEOUT
+        fm.hard_timeout = HOST_TIMEOUT
+        fm.actions.append(of.ofp_action_dl_addr.set_dst(host_mac))
+        fm.actions.append(of.ofp_action_output(port=PORT))
+        return fm.pack()
+
+    return {
+        "arp_reply": lambda: arp_message(arp.REPLY, IN_PORT, gateway_ip, host_ip, host_mac),
+        "arp_request": lambda: arp_message(arp.REQUEST, PORT, gateway_ip, host_ip, None),
+        "echo_reply": echo_reply,
+        "forward": forward,
+        "host_route": host_route,
+    }
+
+
+def load_pox(pox_dir):
+    pox_dir = os.path.expanduser(pox_dir)
+    if pox_dir not in sys.path:
+        sys.path.insert(0, pox_dir)
+    try:
+        import pox.openflow.libopenflow_01  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def measure(build, count, samples=200):
+    for _ in range(min(count, 1000)):
+        build()
+    t = time.perf_counter()
+    for _ in range(count):
+        build()
+    ns = (time.perf_counter() - t) / count * 1e9
+
+    # bytes allocated while one message is built, whether freed or not
+    tracemalloc.start()
+    peak = 0
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        msg = build()
+        peak += tracemalloc.get_traced_memory()[1] - base
+        del msg
+    tracemalloc.stop()
+    return {"ns_per_msg": ns, "msgs_per_s": 1e9 / ns if ns else 0.0,
+            "alloc_bytes": peak / float(samples)}
+
+
+def without_xid(msg):
+    return msg[:4] + b"\x00" * 4 + msg[8:]
+
+
+def check(ours, theirs):
+    failed = False
+    for name in sorted(ours):
+        a, b = ours[name](), theirs[name]()
+        if name == "echo_reply":
+            # POX makes up its own IP id/flags; compare the parts that matter
+            frame = a[24:]
+            ok = (templates._checksum(frame[14:34]) == 0 and templates._checksum(frame[34:]) == 0
+                  and len(a) == len(b) and frame[34] == templates.ICMP_ECHO_REPLY)
+        else:
+            ok = without_xid(a) == without_xid(b)
+        print("%-12s %s" % (name, "ok" if ok else "MISMATCH"))
+        if not ok:
+            print("  template %s\n  pox      %s" % (a.hex(), b.hex()))
+            failed = True
+    if failed:
+        sys.exit("templates and POX disagree")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="POX objects vs pre-packed templates")
+    p.add_argument("--count", type=int, default=100000, help="messages per case")
+    p.add_argument("--pox-dir", default=os.environ.get("POX_DIR", "~/pox"),
+                   help="POX checkout (default: $POX_DIR or ~/pox); optional")
+    p.add_argument("--check", action="store_true",
+                   help="compare every template's bytes with POX's (needs POX)")
+    p.add_argument("--json", help="write results to this file")
+    args = p.parse_args(argv)
+
+    frame = echo_request()
+    ours = template_cases(frame)
+    theirs = pox_cases(frame) if load_pox(args.pox_dir) else None
+    if theirs is None:
+        print("POX not found in %s, measuring the templates only" % (args.pox_dir,))
+        if args.check:
+            sys.exit("--check needs POX (use --pox-dir)")
+    elif args.check:
+        check(ours, theirs)
+
+    results = {}
+    print("%-12s %-9s %10s %12s %12s" % ("message", "builder", "ns/msg", "msgs/s", "alloc bytes"))
+    for name in sorted(ours):
+        builders = [("template", ours[name])]
+        if theirs is not None:
+            builders.insert(0, ("pox", theirs[name]))
+        for builder, build in builders:
+            r = measure(build, args.count)
+            results.setdefault(name, {})[builder] = r
+            print("%-12s %-9s %10.0f %12.0f %12.0f" % (
+                name, builder, r["ns_per_msg"], r["msgs_per_s"], r["alloc_bytes"]))
+        if theirs is not None:
+            pox, tmpl = results[name]["pox"], results[name]["template"]
+            print("%-12s %-9s %9.1fx %12s %11.1fx" % (
+                "", "speedup", pox["ns_per_msg"] / tmpl["ns_per_msg"], "",
+                pox["alloc_bytes"] / max(tmpl["alloc_bytes"], 1.0)))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "time": time.time(),
+                "args": vars(args),
+                "python": sys.version.split()[0],
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()